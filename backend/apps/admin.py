@@ -1,14 +1,14 @@
 # from django.contrib import admin
 # from django.contrib.auth.admin import UserAdmin
-# from apps.models import User
+# from apps.models import Artist, Playlist, PlaylistTrack, Track, User
 
 # admin.site.register(User, UserAdmin)
 
 from django.contrib import admin
-from apps.models import User
+from apps.models import Artist, Playlist, PlaylistTrack, Recommendation, Track, User
 
 
-@admin.register(User)
+@admin.register(User, Playlist, Track, Artist, PlaylistTrack, Recommendation)
 class UniversalAdmin(admin.ModelAdmin):
     def get_list_display(self, request):
         return [field.name for field in self.model._meta.concrete_fields]
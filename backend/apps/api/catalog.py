@@ -0,0 +1,275 @@
+import logging
+import threading
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from apps.api.pagination import fetch_pages
+from apps.api.spotify_cache import PLAYLIST_FIELDS, playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_token import app_token, user_tokens
+from apps.api.titles import normalize_title
+from apps.api.tracks import Track
+from apps.models import Artist, Playlist, PlaylistTrack, Track as CatalogTrack, User
+
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogSync:
+    """
+    Incremental copy of Spotify playlists into the catalog models.
+
+    A playlist whose snapshot_id did not change since its last sync costs one
+    Spotify call and is skipped. Otherwise its 100-track pages (cached by
+    snapshot, shared with the GraphQL queries) are compared to the stored
+    positions, and only the changed ones are upserted with their tracks and
+    artists, in batches of SPOTIFY_CATALOG_BATCH_SIZE rows.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"skipped": 0, "synced": 0, "positions": 0}
+
+    def sync(self, playlist_id: str, force: bool = False) -> bool:
+        """ Sync one playlist, whether it had changed. """
+        spotipy_auth = SpotifyClient.api(auth_manager=app_token)
+        # Not the cached one, it may be an older snapshot
+        header = spotipy_auth.playlist(playlist_id, fields=PLAYLIST_FIELDS)
+        stored = Playlist.objects.filter(spotify_id=playlist_id).only("snapshot_id").first()
+        if not force and stored is not None and stored.snapshot_id == header['snapshot_id']:
+            self._count("skipped")
+            return False
+
+        items = self._fetch_items(spotipy_auth, playlist_id, header['snapshot_id'])
+        with transaction.atomic():
+            playlist, _ = Playlist.objects.update_or_create(
+                spotify_id=playlist_id,
+                defaults={
+                    "snapshot_id": header['snapshot_id'],
+                    "name": header['name'],
+                    "description": header['description'] or "",
+                    "url": header['external_urls']['spotify'],
+                    "owner_name": header['owner']['display_name'] or "",
+                    "owner_url": header['owner']['external_urls']['spotify'],
+                    "total": len(items),
+                    "synced_at": timezone.now(),
+                },
+            )
+            changed = self._changed_positions(playlist, items)
+            self._upsert(playlist, changed)
+            # The playlist got shorter
+            PlaylistTrack.objects.filter(playlist=playlist, position__gte=len(items)).delete()
+
+        self._count("synced")
+        self._count("positions", len(changed))
+        return True
+
+    def sync_library(self, user: User, force: bool = False) -> List[str]:
+        """
+        Sync the playlists of the Spotify library of `user` and link the synced
+        ones to it, the ids of the library. Playlists are read with the app
+        token, like every catalog playlist: private ones fail and are skipped,
+        they must not be served to other users.
+        """
+        access_token = user.spotify_access_token
+        if user_tokens.is_expiring(user.spotify_token_expires_at):
+            access_token = user_tokens.refresh(user)
+
+        limit_step = 50
+        spotipy_auth = SpotifyClient.api(auth=access_token)
+
+        def fetch_page(offset: int) -> Dict[str, Any]:
+            return spotipy_auth.current_user_playlists(limit=limit_step, offset=offset)
+
+        first_page = fetch_page(0)
+        pages = [first_page, *fetch_pages(fetch_page, range(limit_step, first_page['total'], limit_step))]
+        playlist_ids = list(dict.fromkeys(
+            playlist['id'] for page in pages for playlist in page['items'] if playlist
+        ))
+        for playlist_id in playlist_ids:
+            try:
+                self.sync(playlist_id, force=force)
+            except Exception:
+                logger.exception("Catalog sync failed for playlist %s of user %s", playlist_id, user.pk)
+        user.library.set(Playlist.objects.filter(spotify_id__in=playlist_ids))
+        return playlist_ids
+
+    def page(self, playlist_id: str, snapshot_id: str, offset: int, limit: int) -> Optional[Dict[str, Any]]:
+        """
+        Non-empty tracks of the `limit` items from `offset` of a playlist, with
+        whether it is the last page, if its `snapshot_id` is synced and
+        SPOTIFY_CATALOG is enabled. One query on the (playlist, position) index.
+        """
+        if not settings.SPOTIFY_CATALOG:
+            return None
+        rows = list(
+            PlaylistTrack.objects
+            .filter(
+                playlist__spotify_id=playlist_id,
+                playlist__snapshot_id=snapshot_id,
+                position__gte=offset,
+                position__lt=offset + limit,
+            )
+            .select_related("playlist", "track")
+            .only("position", "playlist__total", *(f"track__{field}" for field in SERVED_FIELDS))
+            .order_by("position")
+        )
+        if rows:
+            total = rows[0].playlist.total
+        else:
+            # Past the end, or not synced
+            total = Playlist.objects.filter(spotify_id=playlist_id, snapshot_id=snapshot_id).values_list("total", flat=True).first()
+            if total is None:
+                return None
+        return {
+            "tracks": [served_track(row.track) for row in rows if row.track is not None],
+            "last_page": offset + limit >= total,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {"skipped": 0, "synced": 0, "positions": 0}
+
+    @staticmethod
+    def _fetch_items(spotipy_auth, playlist_id: str, snapshot_id: str) -> List[Dict[str, Any]]:
+        limit_step = 100
+
+        def fetch_page(offset: int) -> Dict[str, Any]:
+            return playlist_cache.tracks(
+                spotipy_auth,
+                playlist_id=playlist_id,
+                snapshot_id=snapshot_id,
+                limit=limit_step,
+                offset=offset
+            )
+
+        first_page = fetch_page(0)
+        offsets = range(limit_step, first_page['total'], limit_step)
+        items = list(first_page['items'])
+        for page in fetch_pages(fetch_page, offsets):
+            items.extend(page['items'])
+        return items
+
+    @staticmethod
+    def _changed_positions(playlist: Playlist, items: List[Dict[str, Any]]) -> Dict[int, Optional[Dict[str, Any]]]:
+        """ Spotify tracks (None when empty) of the positions whose track changed. """
+        stored = dict(
+            PlaylistTrack.objects.filter(playlist=playlist).values_list("position", "track__spotify_id")
+        )
+        changed = {}
+        for position, item in enumerate(items):
+            track = item['track']
+            # Local files and unavailable tracks have no duration
+            if not track or not track.get('id') or not track['duration_ms']:
+                track = None
+            track_id = track['id'] if track else None
+            if position not in stored or stored[position] != track_id:
+                changed[position] = track
+        return changed
+
+    def _upsert(self, playlist: Playlist, changed: Dict[int, Optional[Dict[str, Any]]]) -> None:
+        batch_size = settings.SPOTIFY_CATALOG_BATCH_SIZE
+        tracks = {track['id']: track for track in changed.values() if track is not None}
+        artists = {artist['id']: artist for track in tracks.values() for artist in track['artists'] if artist.get('id')}
+
+        Artist.objects.bulk_create(
+            [Artist(spotify_id=artist_id, name=artist['name']) for artist_id, artist in artists.items()],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["spotify_id"],
+            update_fields=["name"],
+        )
+        CatalogTrack.objects.bulk_create(
+            [catalog_track(track) for track in tracks.values()],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["spotify_id"],
+            update_fields=[field for field in SYNCED_FIELDS if field != "spotify_id"],
+        )
+
+        # Upserts do not return the primary keys of updated rows
+        track_pks = self._pks(CatalogTrack, tracks)
+        artist_pks = self._pks(Artist, artists)
+        CatalogTrack.artists.through.objects.bulk_create(
+            [
+                CatalogTrack.artists.through(track_id=track_pks[track_id], artist_id=artist_pks[artist['id']])
+                for track_id, track in tracks.items()
+                for artist in track['artists'] if artist.get('id')
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        PlaylistTrack.objects.bulk_create(
+            [
+                PlaylistTrack(playlist=playlist, position=position, track_id=track_pks[track['id']] if track else None)
+                for position, track in changed.items()
+            ],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["playlist", "position"],
+            update_fields=["track"],
+        )
+
+    @staticmethod
+    def _pks(model, spotify_ids: Iterable[str]) -> Dict[str, int]:
+        spotify_ids = list(spotify_ids)
+        batch_size = settings.SPOTIFY_CATALOG_BATCH_SIZE
+        pks = {}
+        for start in range(0, len(spotify_ids), batch_size):
+            pks.update(
+                model.objects
+                .filter(spotify_id__in=spotify_ids[start:start + batch_size])
+                .values_list("spotify_id", "pk")
+            )
+        return pks
+
+    def _count(self, stat: str, value: int = 1) -> None:
+        with self._lock:
+            self._stats[stat] += value
+
+
+# Columns of the catalog tracks written by a sync, and read to serve them
+SYNCED_FIELDS = (
+    "spotify_id", "name", "title", "artist", "artist_ids", "album_id", "link", "cover", "preview", "duration_ms",
+)
+SERVED_FIELDS = ("spotify_id", "title", "artist", "artist_ids", "album_id", "link", "cover", "preview")
+
+
+def catalog_track(track: Dict[str, Any]) -> CatalogTrack:
+    """ Catalog row of a Spotify track, parsed as apps.api.tracks.parse_tracks does. """
+    return CatalogTrack(
+        spotify_id=track['id'],
+        name=track['name'],
+        title=normalize_title(track['name']),
+        artist=track['artists'][0]['name'],
+        artist_ids=[artist['id'] for artist in track['artists'] if artist.get('id')],
+        album_id=track['album'].get('id'),
+        link=track['external_urls']['spotify'],
+        cover=track['album']['images'][0]["url"],
+        preview=track['preview_url'],
+        duration_ms=track['duration_ms'],
+    )
+
+
+def served_track(track: CatalogTrack) -> Track:
+    return Track(
+        track.spotify_id,
+        track.artist,
+        track.title,
+        track.link,
+        track.cover,
+        track.preview,
+        tuple(track.artist_ids),
+        track.album_id,
+    )
+
+
+catalog = CatalogSync()
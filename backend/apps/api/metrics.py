@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Iterator, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from apps.api.tracing import traced_http_request
+
+
+# Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (to an empty directory) so that
+# every worker writes its samples there and /metrics aggregates all of them.
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SPOTIFY_REQUEST_SECONDS = Histogram(
+    "jolify_spotify_request_seconds",
+    "Spotify API requests latency, retries included.",
+    ["endpoint"],
+    buckets=LATENCY_BUCKETS,
+)
+SPOTIFY_RESPONSES = Counter(
+    "jolify_spotify_responses_total",
+    "Spotify API responses by status code, 'error' when no response came back.",
+    ["endpoint", "status"],
+)
+SPOTIFY_RETRIES = Counter(
+    "jolify_spotify_retries_total",
+    "Spotify API requests retried, by status code of the failed attempt.",
+    ["endpoint", "status"],
+)
+SPOTIFY_SCHEDULER = Counter(
+    "jolify_spotify_scheduler_total",
+    "Spotify API requests queued, rate limited (429) or shed by the scheduler.",
+    ["outcome"],
+)
+SPOTIFY_CIRCUIT_TRANSITIONS = Counter(
+    "jolify_spotify_circuit_transitions_total",
+    "Spotify endpoints circuit breakers going open, half_open or closed.",
+    ["endpoint", "state"],
+)
+SPOTIFY_TOKEN_REFRESHES = Counter(
+    "jolify_spotify_token_refreshes_total",
+    "Spotify tokens requested, app (client credentials) or user (refresh token).",
+    ["kind"],
+)
+COALESCED_CALLS = Counter(
+    "jolify_coalesced_calls_total",
+    "Calls answered with the result of an identical call in flight.",
+    ["flight"],
+)
+CACHE_REQUESTS = Counter(
+    "jolify_cache_requests_total",
+    "Cache lookups by cache and result.",
+    ["cache", "result"],
+)
+GRAPHQL_OPERATION_SECONDS = Histogram(
+    "jolify_graphql_operation_seconds",
+    "GraphQL operations latency, in the view.",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Path segments following these are ids
+_COLLECTIONS = frozenset(("albums", "artists", "audio-features", "playlists", "tracks", "users"))
+
+# Operation names come from clients, only so many get their own label
+MAX_OPERATION_LABELS = 100
+_operation_labels: Set[str] = set()
+_operation_labels_lock = threading.Lock()
+
+
+def endpoint_label(url: str) -> str:
+    """ Spotify URL (or path) as a bounded label: /v1/playlists/xyz/tracks -> playlists/{id}/tracks """
+    segments = [segment for segment in urlsplit(url).path.split("/") if segment]
+    if segments[:1] == ["v1"]:
+        segments = segments[1:]
+    return "/".join(
+        "{id}" if index > 0 and segments[index - 1] in _COLLECTIONS else segment
+        for index, segment in enumerate(segments)
+    )
+
+
+def operation_label(operation_name: Optional[str]) -> str:
+    if not operation_name:
+        return "anonymous"
+    with _operation_labels_lock:
+        if operation_name in _operation_labels:
+            return operation_name
+        if len(_operation_labels) < MAX_OPERATION_LABELS:
+            _operation_labels.add(operation_name)
+            return operation_name
+    return "other"
+
+
+class _SpotifyRequest:
+    __slots__ = ("endpoint", "status")
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.status = "error"
+
+
+@contextmanager
+def spotify_request(url: str) -> Iterator[_SpotifyRequest]:
+    """ Time a Spotify request, the block sets `status` once a response came back. """
+    request = _SpotifyRequest(endpoint_label(url))
+    start = time.perf_counter()
+    try:
+        with traced_http_request():
+            yield request
+    finally:
+        SPOTIFY_REQUEST_SECONDS.labels(request.endpoint).observe(time.perf_counter() - start)
+        SPOTIFY_RESPONSES.labels(request.endpoint, str(request.status)).inc()
+
+
+@contextmanager
+def graphql_operation(operation_name: Optional[str]) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        GRAPHQL_OPERATION_SECONDS.labels(operation_label(operation_name)).observe(time.perf_counter() - start)
+
+
+def export() -> Tuple[bytes, str]:
+    """ Text exposition of the metrics of this process, or of every worker in multiprocess mode. """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
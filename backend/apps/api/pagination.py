@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+
+class Window(NamedTuple):
+    """ Items of a window over upstream pages, with their upstream offsets. """
+    items: List[Tuple[int, Any]]
+    has_next: bool
+    # Offset of the page to fetch to fill the window, None once it is
+    next_offset: Optional[int]
+
+
+def page_offsets(start: int, count: int, page_size: int, aligned: bool = True) -> List[int]:
+    """
+    Offsets of the pages of `page_size` items covering [start, start + count).
+
+    Aligned pages (multiples of `page_size`) are the same whatever the window,
+    and can be cached: any window then splits cached pages, or merges two.
+    """
+    first = start - start % page_size if aligned else start
+    return list(range(first, start + count, page_size))
+
+
+def take(
+    pages: Dict[int, Dict[str, Any]],
+    start: int,
+    count: int,
+    parse: Callable[[List[Any]], List[Optional[Any]]],
+) -> Window:
+    """
+    Up to `count` items from `start` out of contiguous Spotify pages (keyed
+    by offset). `parse` maps raw items to parsed ones, None to skip one.
+    """
+    items: List[Tuple[int, Any]] = []
+    for offset in sorted(pages):
+        page = pages[offset]
+        end = offset + len(page['items'])
+        first = max(start, offset)
+        for index, item in enumerate(parse(page['items'][first - offset:]), start=first):
+            if item is None:
+                continue
+            items.append((index, item))
+            if len(items) == count:
+                return Window(items, index + 1 < end or page['next'] is not None, None)
+
+    last = pages[max(pages)]
+    if last['next'] is None or not last['items']:
+        return Window(items, False, None)
+    # Skipped items left the window short
+    return Window(items, True, max(pages) + len(last['items']))
+
+
+def fetch_pages(fetch_page: Callable[[int], Dict[str, Any]], offsets: Sequence[int]) -> List[Dict[str, Any]]:
+    """ Pages at `offsets`, fetched with up to SPOTIFY_FETCH_ALL_WORKERS threads. """
+    if not offsets:
+        return []
+    if len(offsets) == 1:
+        return [fetch_page(offsets[0])]
+    with ThreadPoolExecutor(max_workers=min(len(offsets), settings.SPOTIFY_FETCH_ALL_WORKERS)) as executor:
+        # Each page runs in a copy of our context, to keep the current trace and staleness
+        futures = [executor.submit(copy_context().run, fetch_page, offset) for offset in offsets]
+        return [future.result() for future in futures]
@@ -0,0 +1,197 @@
+import heapq
+import math
+import threading
+
+from collections import Counter, defaultdict
+from itertools import chain, repeat
+from typing import Dict, Iterable, List, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.api.catalog import SERVED_FIELDS, served_track
+from apps.api.pagination import Window
+from apps.models import Playlist, PlaylistTrack, Recommendation, Track, User
+
+
+class CoOccurrence:
+    """
+    Sparse playlist x track matrix of the catalog, as its rows (tracks of each
+    playlist) and columns (playlists of each track).
+
+    Tracks are scored for a library of tracks as X.T @ (X @ library): the
+    playlists sharing tracks with the library, weighted by how many, then the
+    tracks of those playlists. Both products are counted by Counter over
+    chained tuples, in C, and only touch the non-zero cells. The second one
+    keeps the nearest playlists only: through popular tracks, a library
+    shares a track or two with most of them.
+    """
+
+    def __init__(self, cells: Iterable[Tuple[int, int]], track_artists: Iterable[Tuple[int, int]] = ()):
+        playlist_tracks = defaultdict(set)
+        track_playlists = defaultdict(set)
+        for playlist_id, track_id in cells:
+            playlist_tracks[playlist_id].add(track_id)
+            track_playlists[track_id].add(playlist_id)
+        self.playlist_tracks = {playlist_id: tuple(tracks) for playlist_id, tracks in playlist_tracks.items()}
+        self.track_playlists = {track_id: tuple(playlists) for track_id, playlists in track_playlists.items()}
+
+        artists = defaultdict(list)
+        artist_tracks = defaultdict(list)
+        for track_id, artist_id in track_artists:
+            artists[track_id].append(artist_id)
+            artist_tracks[artist_id].append(track_id)
+        self.track_artists = {track_id: tuple(artist_ids) for track_id, artist_ids in artists.items()}
+        self.artist_tracks = {artist_id: tuple(track_ids) for artist_id, track_ids in artist_tracks.items()}
+        # Cosine-like normalization, so hits everyone has do not take every spot
+        self.weights = {track_id: 1 / math.sqrt(len(playlists)) for track_id, playlists in self.track_playlists.items()}
+
+    @property
+    def cells(self) -> int:
+        return sum(len(tracks) for tracks in self.playlist_tracks.values())
+
+    def library(self, playlist_ids: Iterable[int]) -> Set[int]:
+        return set(chain.from_iterable(self.playlist_tracks.get(playlist_id, ()) for playlist_id in playlist_ids))
+
+    def scores(self, library: Set[int], own_playlists: Iterable[int] = (), neighbours: int = 200) -> Counter:
+        """
+        Co-occurrence counts of the tracks with those of `library`, in the
+        `neighbours` other playlists sharing the most tracks with it.
+        """
+        overlaps = Counter(chain.from_iterable(self.track_playlists.get(track_id, ()) for track_id in library))
+        # Nothing new in the library's own playlists
+        for playlist_id in own_playlists:
+            overlaps.pop(playlist_id, None)
+        return Counter(chain.from_iterable(
+            chain.from_iterable(
+                repeat(self.playlist_tracks[playlist_id], overlap)
+                for playlist_id, overlap in overlaps.most_common(neighbours)
+            )
+        ))
+
+    def top(
+        self,
+        playlist_ids: Iterable[int],
+        top_k: int,
+        neighbours: int = 200,
+        artist_weight: float = 0.0,
+    ) -> List[Tuple[int, float]]:
+        """
+        The `top_k` best (track, score) not in the playlists `playlist_ids`.
+        Counts are divided by the square root of the track's popularity (its
+        playlists), and raised up to `artist_weight` for artists the library
+        collects.
+        """
+        playlist_ids = set(playlist_ids)
+        library = self.library(playlist_ids)
+        if not library:
+            return []
+        counts = self.scores(library, playlist_ids, neighbours)
+        for track_id in library:
+            counts.pop(track_id, None)
+        weights = self.weights
+        scores = {track_id: count * weights[track_id] for track_id, count in counts.items()}
+
+        # Only the tracks of the library's artists get more
+        artists = Counter(chain.from_iterable(self.track_artists.get(track_id, ()) for track_id in library))
+        size = len(library)
+        for artist_id, artist_count in artists.items():
+            boost = 1 + artist_weight * artist_count / size
+            for track_id in self.artist_tracks[artist_id]:
+                if track_id in counts:
+                    scores[track_id] = max(scores[track_id], counts[track_id] * weights[track_id] * boost)
+
+        best = heapq.nlargest(top_k, ((track_score, -track_id) for track_id, track_score in scores.items()))
+        return [(-track_id, track_score) for track_score, track_id in best]
+
+
+class Recommender:
+    """
+    Track suggestions computed from the libraries of accepted users.
+
+    refresh() is a batch job: it loads the catalog as a CoOccurrence matrix,
+    scores the RECOMMENDATIONS_TOP_K best tracks of every user and replaces
+    the Recommendation table in one transaction. A window of a user's
+    suggestions is then one query on the (user, rank) index, however many
+    playlists the catalog holds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "users": 0, "recommendations": 0}
+
+    def refresh(self) -> Dict[str, int]:
+        """ Recompute and store the suggestions of every accepted user, what was done. """
+        batch_size = settings.SPOTIFY_CATALOG_BATCH_SIZE
+        matrix = self.load()
+        libraries = defaultdict(list)
+        for user_id, playlist_id in (
+            Playlist.users.through.objects
+            .filter(user__accepted_account=True)
+            .values_list("user_id", "playlist_id")
+        ):
+            libraries[user_id].append(playlist_id)
+
+        suggestions = {
+            user_id: matrix.top(
+                playlist_ids,
+                settings.RECOMMENDATIONS_TOP_K,
+                settings.RECOMMENDATIONS_NEIGHBOURS,
+                settings.RECOMMENDATIONS_ARTIST_WEIGHT,
+            )
+            for user_id, playlist_ids in libraries.items()
+        }
+        with transaction.atomic():
+            # Also the ones of users no longer accepted, or without a library
+            Recommendation.objects.all().delete()
+            Recommendation.objects.bulk_create(
+                (
+                    Recommendation(user_id=user_id, rank=rank, track_id=track_id, score=score)
+                    for user_id, tracks in suggestions.items()
+                    for rank, (track_id, score) in enumerate(tracks)
+                ),
+                batch_size=batch_size,
+            )
+
+        done = {
+            "users": len(suggestions),
+            "recommendations": sum(len(tracks) for tracks in suggestions.values()),
+            "cells": matrix.cells,
+        }
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["users"] += done["users"]
+            self._stats["recommendations"] += done["recommendations"]
+        return done
+
+    @staticmethod
+    def load() -> CoOccurrence:
+        batch_size = settings.SPOTIFY_CATALOG_BATCH_SIZE
+        return CoOccurrence(
+            PlaylistTrack.objects.filter(track__isnull=False).values_list("playlist_id", "track_id").iterator(chunk_size=batch_size),
+            Track.artists.through.objects.values_list("track_id", "artist_id").iterator(chunk_size=batch_size),
+        )
+
+    @staticmethod
+    def window(user: User, start: int, count: int) -> Window:
+        """ Suggestions of `user` from rank `start`, one query. """
+        rows = list(
+            Recommendation.objects
+            .filter(user=user, rank__gte=start, rank__lt=start + count + 1)
+            .select_related("track")
+            .only("rank", *(f"track__{field}" for field in SERVED_FIELDS))
+            .order_by("rank")
+        )
+        # One more row tells whether there is a next window
+        return Window([(row.rank, served_track(row.track)) for row in rows[:count]], len(rows) > count, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {"runs": 0, "users": 0, "recommendations": 0}
+
+
+recommender = Recommender()
@@ -0,0 +1,127 @@
+import re
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import Q, QuerySet
+from django.db.models.functions import Greatest
+
+from apps.api.catalog import SERVED_FIELDS, served_track
+from apps.api.pagination import Window
+from apps.models import Playlist, Track as CatalogTrack
+
+
+# Searched columns, indexed by migration 0009_catalog_search
+TRACK_COLUMNS = ("title", "artist")
+PLAYLIST_COLUMNS = ("name", "owner_name", "description")
+PLAYLIST_FIELDS = ("spotify_id", "name", "description", "url")
+# Lowest word similarity of a trigram match, pg_trgm's 0.6 default misses
+# most typos ("foxgolve" is 0.44 from "Foxglove")
+TRIGRAM_THRESHOLD = 0.3
+
+
+class CatalogSearch:
+    """
+    Ranked search over the synced catalog, see apps.api.catalog.
+
+    On Postgres, rows matching every word of the query as a prefix (typed so
+    far), or close to it by trigram word similarity (typos), ranked by both,
+    through the GIN indexes of migration 0009_catalog_search. On SQLite
+    (tests, dev), an FTS5 trigram index matching the whole words or any of
+    their trigrams, ranked by bm25.
+    """
+
+    def tracks(self, text: str, start: int, count: int) -> Window:
+        if connection.vendor == "postgresql":
+            rows = self._postgres(CatalogTrack.objects.only(*SERVED_FIELDS), TRACK_COLUMNS, text, start, count + 1)
+        else:
+            rows = self._sqlite(CatalogTrack, "apps_track_search", (2.0, 1.0), SERVED_FIELDS, text, start, count + 1)
+        return self._window(rows, start, count, served_track)
+
+    def playlists(self, text: str, start: int, count: int) -> Window:
+        if connection.vendor == "postgresql":
+            rows = self._postgres(Playlist.objects.only(*PLAYLIST_FIELDS), PLAYLIST_COLUMNS, text, start, count + 1)
+        else:
+            rows = self._sqlite(Playlist, "apps_playlist_search", (4.0, 2.0, 1.0), PLAYLIST_FIELDS, text, start, count + 1)
+        return self._window(rows, start, count, served_playlist)
+
+    @staticmethod
+    def _window(rows: List[Any], start: int, count: int, serve: Callable[[Any], Any]) -> Window:
+        # One more row tells whether there is a next window
+        return Window(
+            [(start + index, serve(row)) for index, row in enumerate(rows[:count])],
+            len(rows) > count,
+            None,
+        )
+
+    @staticmethod
+    def _postgres(rows: QuerySet, columns: Tuple[str, ...], text: str, offset: int, limit: int) -> List[Any]:
+        words = search_words(text)
+        if not words:
+            return []
+        phrase = " ".join(words)
+        vector = SearchVector(*columns, config="simple")
+        query = SearchQuery(" & ".join(f"{word}:*" for word in words), search_type="raw", config="simple")
+        # Trigram indexes cover the short columns (names), not descriptions
+        trigram_columns = columns[:2]
+        matches = Q(search=query)
+        for column in trigram_columns:
+            matches |= Q(**{f"{column}__trigram_word_similar": phrase})
+        similarity = Greatest(*(TrigramWordSimilarity(phrase, column) for column in trigram_columns))
+        with transaction.atomic(), connection.cursor() as cursor:
+            # For this transaction only, `%>` still uses the trigram indexes
+            cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", [str(TRIGRAM_THRESHOLD)])
+            return list(
+                rows
+                .annotate(search=vector, rank=SearchRank(vector, query) + similarity)
+                .filter(matches)
+                .order_by("-rank", "pk")[offset:offset + limit]
+            )
+
+    @staticmethod
+    def _sqlite(model, table: str, weights: Tuple[float, ...], fields: Tuple[str, ...], text: str, offset: int, limit: int) -> List[Any]:
+        match = fts5_query(text)
+        if match is None:
+            return []
+        db_table = model._meta.db_table
+        columns = ", ".join(f'"{db_table}"."{model._meta.get_field(field).column}"' for field in fields)
+        bm25 = ", ".join(str(weight) for weight in weights)
+        return list(model.objects.raw(
+            f'SELECT "{db_table}"."id", {columns} FROM "{table}" '
+            f'JOIN "{db_table}" ON "{db_table}"."id" = "{table}".rowid '
+            f'WHERE "{table}" MATCH %s ORDER BY bm25("{table}", {bm25}), "{table}".rowid LIMIT %s OFFSET %s',
+            [match, limit, offset],
+        ))
+
+
+def search_words(text: str) -> List[str]:
+    # Shorter words have no trigram of their own, they would match anything
+    return [word for word in re.findall(r"\w+", text.lower()) if len(word) >= 3]
+
+
+def fts5_query(text: str) -> Optional[str]:
+    """
+    FTS5 query matching rows with any word of `text` or any of their
+    trigrams: whole words rank first, misspelled ones still match.
+    """
+    terms = []
+    for word in search_words(text):
+        terms.append(word)
+        terms.extend(word[index:index + 3] for index in range(len(word) - 2))
+    if not terms:
+        return None
+    return " OR ".join('"{}"'.format(term.replace('"', '""')) for term in dict.fromkeys(terms))
+
+
+def served_playlist(playlist: Playlist) -> Dict[str, Any]:
+    return {
+        "id": playlist.spotify_id,
+        "name": playlist.name,
+        "description": playlist.description,
+        "href": playlist.url,
+        "image": None,
+    }
+
+
+catalog_search = CatalogSearch()
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from apps.api.metrics import COALESCED_CALLS
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share the result of the first one.
+
+    The first caller (leader) runs the call, the others wait for its result,
+    or exception, instead of repeating it. Nothing is kept once the call
+    returned: this deduplicates work in flight, caching is left to callers.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._inflight: Dict[Hashable, Future] = {}
+        # Futures of asyncio belong to one event loop, keyed by loop too
+        self._async_inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self._stats = {"calls": 0, "shared": 0}
+
+    def do(self, key: Hashable, call: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            self._count(shared=not leader)
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = call()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    async def ado(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        key = (loop, key)
+        future = self._async_inflight.get(key)
+        with self._lock:
+            self._count(shared=future is not None)
+        if future is not None:
+            # A follower cancelled must not cancel the leader
+            return await asyncio.shield(future)
+
+        future = self._async_inflight[key] = loop.create_future()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Retrieved, followers or not
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._async_inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, shared: bool) -> None:
+        self._stats["calls"] += 1
+        if shared:
+            self._stats["shared"] += 1
+            COALESCED_CALLS.labels(self.name).inc()
@@ -1,17 +1,24 @@
-import base64
-import re
 import requests
-import spotipy
 
-from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
-from datetime import timedelta, datetime
-from typing import Any, Dict, List
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
 from django.conf import settings
 from django.http import HttpRequest
 from django.utils import timezone
 
-from apps.models import User
+from apps.api.catalog import catalog
+from apps.api.pagination import Window, fetch_pages, page_offsets, take
+from apps.api.single_flight import SingleFlight
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_circuit import track_staleness
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_token import app_token, user_tokens
+from apps.api.tracks import Track, parse_tracks
+
+
+# A shared playlist is opened by many users at once, they share one parsed result
+playlist_queries = SingleFlight("playlist_queries")
 
 
 class SpotifyAPI:
@@ -23,43 +30,34 @@ class SpotifyAPI:
         context: HttpRequest,
     ) -> Dict[str, Any]:
 
-        tracks = []
-        limit_step = 20
-        auth_manager = SpotifyClientCredentials(
-            client_id=settings.SPOTIFY_USER_CLIENT_ID,
-            client_secret=settings.SPOTIFY_USER_CLIENT_SECRET
+        return playlist_queries.do(
+            ("my_suggestions", playlist_id, offset),
+            lambda: SpotifyAPI._get_tracks_from_my_suggestions(playlist_id, offset),
         )
-        spotipy_auth = spotipy.Spotify(auth_manager=auth_manager)
 
-        songs = spotipy_auth.user_playlist_tracks(
-            user='',
-            playlist_id=playlist_id,
-            limit=limit_step,
-            offset=offset
-        )
+    @staticmethod
+    def _get_tracks_from_my_suggestions(
+        playlist_id,
+        offset,
+    ) -> Dict[str, Any]:
 
-        for song in songs['items']:
-            # RegEx manipulation to clean title of track
-            title = re.sub("[\(\[].*?[\)\]]", "", song['track']['name'])  # pylint: disable=W1401
-            title = re.sub(r'\-.*', "", title)
-            title = re.sub(r'\|.*', "", title)
-            # Get track data
-            song_id = song['track']['id']
-            artist = song['track']['artists'][0]['name']
-            link = song['track']['external_urls']['spotify']
-            cover = song['track']['album']['images'][0]["url"]
-            preview = song['track']['preview_url']
-            tracks.append({
-                "id": song_id,
-                "artist": artist,
-                "title": title,
-                "link": link,
-                "cover": cover,
-                "preview": preview,
-            })
+        limit_step = 20
+        spotipy_auth = SpotifyClient.api(auth_manager=app_token)
+
+        with track_staleness() as staleness:
+            playlist = playlist_cache.playlist(spotipy_auth, playlist_id)
+            songs = playlist_cache.tracks(
+                spotipy_auth,
+                playlist_id=playlist_id,
+                snapshot_id=playlist['snapshot_id'],
+                limit=limit_step,
+                offset=offset
+            )
+
+        tracks = parse_tracks(songs['items'])
 
         last_page = songs['next'] is None
-        return {"success": True, "tracks": tracks, "last_page": last_page}
+        return {"success": True, "tracks": tracks, "last_page": last_page, "stale": staleness.served}
 
     @staticmethod
     def get_user_playlists(
@@ -74,112 +72,218 @@ class SpotifyAPI:
 
         if not access_token:
             return {"success": False, "details": "No access token registered", "owner": {}, "playlists": [], "last_page": True}
-        elif SpotifyAPI.is_access_token_expired(context.user.spotify_token_expires_at) is True:
-            access_token = SpotifyAPI.refresh_token(context.user.spotify_refresh_token, context).get("access_token")
+        elif user_tokens.is_expiring(context.user.spotify_token_expires_at):
+            access_token = user_tokens.refresh(context.user)
 
-        spotipy_auth = spotipy.Spotify(access_token)
+        spotipy_auth = SpotifyClient.api(auth=access_token)
 
-        playlists = []
         user_playlists = spotipy_auth.current_user_playlists(limit=50, offset=offset)
 
-        owner_data = user_playlists['items'][0]['owner']
-        owner = {
-            "id": owner_data['id'],
-            "name": owner_data['display_name'],
-            "href": owner_data['external_urls']['spotify'],
-        }
+        return SpotifyAPI._parse_user_playlists(user_playlists)
 
-        for playlist in user_playlists['items']:
-            # TODO : fix that for image should be displayed a default if none is provided
-            # make sure every playlist has an image and a name, if one hasn't don't send it to front
-            if len(playlist['images']) < 1 or len(playlist['name']) < 1:
-                continue
+    @staticmethod
+    def get_playlist_data(
+        playlist_id,
+        offset,
+        context: HttpRequest,
+        with_info: bool = True,
+        with_tracks: bool = True,
+    ) -> Dict[str, Any]:
 
-            playlist_id = playlist['id']
-            playlist_name = playlist['name']
-            playlist_description = playlist['description']
-            playlist_href = playlist['external_urls']['spotify']
-            playlist_image = playlist['images'][0]['url']
-
-            playlists.append({
-                "id": playlist_id,
-                "name": playlist_name,
-                "description": playlist_description,
-                "href": playlist_href,
-                "image": playlist_image,
-            })
+        return playlist_queries.do(
+            ("playlist_data", playlist_id, offset, with_info, with_tracks),
+            lambda: SpotifyAPI._get_playlist_data(playlist_id, offset, with_info, with_tracks),
+        )
 
-        last_page = user_playlists['next'] is None
+    @staticmethod
+    def _get_playlist_data(
+        playlist_id,
+        offset,
+        with_info: bool,
+        with_tracks: bool,
+    ) -> Dict[str, Any]:
 
-        return {"success": True, "details": "Playlists successfuly fetched.", "owner": owner, "playlists": playlists, "last_page": last_page}
+        limit_step = 20
+        spotipy_auth = SpotifyClient.api(auth_manager=app_token)
+
+        with track_staleness() as staleness:
+            # Fetch playlist infos, also needed for the snapshot_id keying its tracks
+            playlist = playlist_cache.playlist(spotipy_auth, playlist_id)
+            # TODO : followers : 'followers': {'href': None, 'total': 0},
+            # TODO : playlist_image : 'images': [{'height': 640, 'url': 'https://mosaic.scdn.co/640/ab67616d0000b2739e01d5ed521b00f41593c4a7ab67616d0000b273a5aef98a1762d0f64bb6ed9aab67616d0000b273bcee8e2aa4ded86f18661153ab67616d0000b273c7167ab79dd0e4e14d3b575a', 'width': 640}, {'height': 300, 'url': 'https://mosaic.scdn.co/300/ab67616d0000b2739e01d5ed521b00f41593c4a7ab67616d0000b273a5aef98a1762d0f64bb6ed9aab67616d0000b273bcee8e2aa4ded86f18661153ab67616d0000b273c7167ab79dd0e4e14d3b575a', 'width': 300}, {'height': 60, 'url': 'https://mosaic.scdn.co/60/ab67616d0000b2739e01d5ed521b00f41593c4a7ab67616d0000b273a5aef98a1762d0f64bb6ed9aab67616d0000b273bcee8e2aa4ded86f18661153ab67616d0000b273c7167ab79dd0e4e14d3b575a', 'width': 60}],
+
+            # Fetch tracks of playlist infos, unless only its details were asked
+            songs = served = None
+            if with_tracks:
+                served = catalog.page(playlist_id, playlist['snapshot_id'], offset, limit_step)
+            if with_tracks and served is None:
+                songs = playlist_cache.tracks(
+                    spotipy_auth,
+                    playlist_id=playlist_id,
+                    snapshot_id=playlist['snapshot_id'],
+                    limit=limit_step,
+                    offset=offset
+                )
+
+        playlist_data = SpotifyAPI._parse_playlist_data(playlist if with_info else None, songs, staleness.served)
+        if served is not None:
+            playlist_data.update(served)
+        return playlist_data
 
     @staticmethod
-    def get_playlist_data(
+    def get_full_playlist_data(
         playlist_id,
-        offset,
         context: HttpRequest,
+        with_info: bool = True,
+        with_tracks: bool = True,
     ) -> Dict[str, Any]:
 
+        limit_step = 100  # Biggest page Spotify serves
+        spotipy_auth = SpotifyClient.api(auth_manager=app_token)
+
+        def fetch_page(offset: int) -> Dict[str, Any]:
+            return playlist_cache.tracks(
+                spotipy_auth,
+                playlist_id=playlist_id,
+                snapshot_id=playlist['snapshot_id'],
+                limit=limit_step,
+                offset=offset
+            )
+
+        with track_staleness() as staleness:
+            playlist = playlist_cache.playlist(spotipy_auth, playlist_id)
+            if not with_tracks:
+                return SpotifyAPI._parse_playlist_data(playlist, None, staleness.served)
+            served = catalog.page(playlist_id, playlist['snapshot_id'], 0, settings.SPOTIFY_FETCH_ALL_MAX_TRACKS)
+            if served is not None:
+                return {**SpotifyAPI._parse_playlist_data(playlist if with_info else None, None, staleness.served), **served}
+
+            # First page gives the total, remaining pages are fetched in parallel
+            first_page = fetch_page(0)
+            total = min(first_page['total'], settings.SPOTIFY_FETCH_ALL_MAX_TRACKS)
+            pages = [first_page, *fetch_pages(fetch_page, range(limit_step, total, limit_step))]
+
         tracks = []
-        limit_step = 20
-        auth_manager = SpotifyClientCredentials(
-            client_id=settings.SPOTIFY_USER_CLIENT_ID,
-            client_secret=settings.SPOTIFY_USER_CLIENT_SECRET
-        )
-        spotipy_auth = spotipy.Spotify(auth_manager=auth_manager)
+        for page in pages:
+            tracks.extend(parse_tracks(page['items'], skip_empty=True))
+
+        return {
+            "success": True,
+            "playlist": SpotifyAPI._parse_playlist_info(playlist) if with_info else None,
+            "tracks": tracks,
+            "last_page": first_page['total'] <= settings.SPOTIFY_FETCH_ALL_MAX_TRACKS,
+            "stale": staleness.served,
+        }
+
+    @staticmethod
+    def get_tracks_window(
+        playlist_id,
+        start: int,
+        count: int,
+        skip_empty: bool,
+        context: HttpRequest,
+    ) -> Dict[str, Any]:
 
-        # Fetch playlist infos
-        playlist = spotipy_auth.user_playlist(
-            user='',
-            playlist_id=playlist_id,
+        return playlist_queries.do(
+            ("tracks_window", playlist_id, start, count, skip_empty),
+            lambda: SpotifyAPI._get_tracks_window(playlist_id, start, count, skip_empty),
         )
 
-        playlist_name = playlist['name']
-        playlist_description = playlist['description']
-        playlist_url = playlist['external_urls']['spotify']
-        owner_name = playlist['owner']['display_name']
-        owner_url = playlist['owner']['external_urls']['spotify']
-        playlist_data = {
-            "playlist_name": playlist_name,
-            "playlist_description": playlist_description,
-            "playlist_url": playlist_url,
-            "owner_name": owner_name,
-            "owner_url": owner_url,
+    @staticmethod
+    def _get_tracks_window(
+        playlist_id,
+        start: int,
+        count: int,
+        skip_empty: bool,
+    ) -> Dict[str, Any]:
+
+        limit_step = 100  # Aligned so that every window shares the cached pages
+        spotipy_auth = SpotifyClient.api(auth_manager=app_token)
+
+        def fetch_page(offset: int) -> Dict[str, Any]:
+            return playlist_cache.tracks(
+                spotipy_auth,
+                playlist_id=playlist_id,
+                snapshot_id=playlist['snapshot_id'],
+                limit=limit_step,
+                offset=offset
+            )
+
+        with track_staleness() as staleness:
+            playlist = playlist_cache.playlist(spotipy_auth, playlist_id)
+
+            pages = {}
+            offsets = page_offsets(start, count, limit_step)
+            while True:
+                pages.update(zip(offsets, fetch_pages(fetch_page, offsets)))
+                window = take(pages, start, count, lambda songs: SpotifyAPI._parse_window_tracks(songs, skip_empty))
+                if window.next_offset is None:
+                    break
+                offsets = [window.next_offset]
+
+        return {
+            "success": True,
+            "playlist": SpotifyAPI._parse_playlist_info(playlist),
+            "tracks": window.items,
+            "has_next_page": window.has_next,
+            "total": pages[min(pages)]['total'],
+            "stale": staleness.served,
         }
-        # TODO : followers : 'followers': {'href': None, 'total': 0},
-        # TODO : playlist_image : 'images': [{'height': 640, 'url': 'https://mosaic.scdn.co/640/ab67616d0000b2739e01d5ed521b00f41593c4a7ab67616d0000b273a5aef98a1762d0f64bb6ed9aab67616d0000b273bcee8e2aa4ded86f18661153ab67616d0000b273c7167ab79dd0e4e14d3b575a', 'width': 640}, {'height': 300, 'url': 'https://mosaic.scdn.co/300/ab67616d0000b2739e01d5ed521b00f41593c4a7ab67616d0000b273a5aef98a1762d0f64bb6ed9aab67616d0000b273bcee8e2aa4ded86f18661153ab67616d0000b273c7167ab79dd0e4e14d3b575a', 'width': 300}, {'height': 60, 'url': 'https://mosaic.scdn.co/60/ab67616d0000b2739e01d5ed521b00f41593c4a7ab67616d0000b273a5aef98a1762d0f64bb6ed9aab67616d0000b273bcee8e2aa4ded86f18661153ab67616d0000b273c7167ab79dd0e4e14d3b575a', 'width': 60}],
-
-        # Fetch tracks of playlist infos
-        songs = spotipy_auth.user_playlist_tracks(
-            user='',
-            playlist_id=playlist_id,
-            limit=limit_step,
-            offset=offset
-        )
 
-        for song in songs['items']:
-            if song['track']['duration_ms'] != 0:
-                # RegEx manipulation to clean title of track
-                title = re.sub("[\(\[].*?[\)\]]", "", song['track']['name'])  # pylint: disable=W1401
-                title = re.sub(r'\-.*', "", title)
-                title = re.sub(r'\|.*', "", title)
-                # Get track data
-                song_id = song['track']['id']
-                artist = song['track']['artists'][0]['name']
-                link = song['track']['external_urls']['spotify']
-                cover = song['track']['album']['images'][0]["url"]
-                preview = song['track']['preview_url']
-                tracks.append({
-                    "id": song_id,
-                    "artist": artist,
-                    "title": title,
-                    "link": link,
-                    "cover": cover,
-                    "preview": preview,
-                })
+    @staticmethod
+    def get_user_playlists_window(
+        start: int,
+        count: int,
+        context: HttpRequest,
+    ) -> Dict[str, Any]:
 
-        last_page = songs['next'] is None
-        return {"success": True, "playlist": playlist_data, "tracks": tracks, "last_page": last_page}
+        if context.user.accepted_account is False:
+            return {"success": False, "details": "Account not accepted.", "owner": None, "playlists": [], "has_next_page": False}
+
+        access_token = context.user.spotify_access_token
+
+        if not access_token:
+            return {"success": False, "details": "No access token registered", "owner": None, "playlists": [], "has_next_page": False}
+        elif user_tokens.is_expiring(context.user.spotify_token_expires_at):
+            access_token = user_tokens.refresh(context.user)
+
+        limit_step = 50  # Not cached, pages start at the window
+        spotipy_auth = SpotifyClient.api(auth=access_token)
+
+        def fetch_page(offset: int) -> Dict[str, Any]:
+            return spotipy_auth.current_user_playlists(limit=limit_step, offset=offset)
+
+        pages = {}
+        offsets = page_offsets(start, count, limit_step, aligned=False)
+        while True:
+            pages.update(zip(offsets, fetch_pages(fetch_page, offsets)))
+            window = take(pages, start, count, SpotifyAPI._parse_window_playlists)
+            if window.next_offset is None:
+                break
+            offsets = [window.next_offset]
+
+        return SpotifyAPI._parse_user_playlists_window(pages, window)
+
+    @staticmethod
+    def get_audio_features(
+        track_ids: List[str],
+    ) -> List[Optional[Dict[str, Any]]]:
+
+        return SpotifyClient.api(auth_manager=app_token).audio_features(track_ids)
+
+    @staticmethod
+    def get_artists(
+        artist_ids: List[str],
+    ) -> List[Optional[Dict[str, Any]]]:
+
+        return SpotifyClient.api(auth_manager=app_token).artists(artist_ids)['artists']
+
+    @staticmethod
+    def get_albums(
+        album_ids: List[str],
+    ) -> List[Optional[Dict[str, Any]]]:
+
+        return SpotifyClient.api(auth_manager=app_token).albums(album_ids)['albums']
 
     @staticmethod
     def get_spotify_oauth_link(
@@ -188,8 +292,10 @@ class SpotifyAPI:
 
         scope = "user-library-read user-read-private playlist-read-private user-read-email"
 
-        res = requests.get(
-            "https://accounts.spotify.com/authorize?",
+        # The authorize link only has to be built, not requested
+        href = requests.Request(
+            "GET",
+            SpotifyClient.accounts_url("authorize"),
             params={
                 "response_type": 'code',
                 "scope": scope,
@@ -197,52 +303,122 @@ class SpotifyAPI:
                 "redirect_uri": settings.SPOTIFY_REDIRECT_URI,
                 "state": context.user.id,
             }
-        )
+        ).prepare().url
 
-        res_status = res.raise_for_status()
+        return {"success": True, "href": href}
 
-        href = res.url
+    @staticmethod
+    def is_access_token_expired(
+        token_expiration_date: datetime,
+    ) -> bool:
 
-        return {"success": True, "href": href}
+        is_expired = token_expiration_date - timezone.now()
+        return is_expired.total_seconds() <= 0
 
     @staticmethod
-    def refresh_token(
-        refresh_token: str,
-        context: HttpRequest,
+    def _parse_playlist_info(
+        playlist: Dict[str, Any],
     ) -> Dict[str, Any]:
 
-        encodedData = base64.b64encode(
-            bytes(f"{settings.SPOTIFY_APP_CLIENT_ID}:{settings.SPOTIFY_APP_CLIENT_SECRET}", "ISO-8859-1")).decode("ascii")
-        credentials = f"{encodedData}"
-
-        res = requests.post(
-            "https://accounts.spotify.com/api/token?",
-            data={
-                "grant_type": "refresh_token",
-                "refresh_token": refresh_token,
-            },
-            headers={
-                "Authorization": f"Basic {credentials}",
-                "Content-Type": "application/x-www-form-urlencoded"
-            }
-        )
+        return {
+            "playlist_name": playlist['name'],
+            "playlist_description": playlist['description'],
+            "playlist_url": playlist['external_urls']['spotify'],
+            "owner_name": playlist['owner']['display_name'],
+            "owner_url": playlist['owner']['external_urls']['spotify'],
+        }
 
-        res_status = res.raise_for_status()
+    @staticmethod
+    def _parse_playlist_data(
+        playlist: Optional[Dict[str, Any]],
+        songs: Optional[Dict[str, Any]],
+        stale: bool,
+    ) -> Dict[str, Any]:
 
-        res_data = res.json()
+        # Parts that were not fetched are left out
+        return {
+            "success": True,
+            "playlist": SpotifyAPI._parse_playlist_info(playlist) if playlist is not None else None,
+            "tracks": parse_tracks(songs['items'], skip_empty=True) if songs is not None else None,
+            "last_page": songs['next'] is None if songs is not None else None,
+            "stale": stale,
+        }
 
-        # Update User token infos in DB
-        user = User.objects.get(pk=context.user.id)
-        user.spotify_access_token = res_data["access_token"]
-        user.spotify_token_expires_at = timezone.now() + timedelta(seconds=res_data["expires_in"])
-        user.save(update_fields=['spotify_access_token', 'spotify_token_expires_at'])
+    @staticmethod
+    def _parse_user_playlists(
+        user_playlists: Dict[str, Any],
+    ) -> Dict[str, Any]:
 
-        return {"access_token": res_data["access_token"]}
+        owner = SpotifyAPI._parse_owner(user_playlists['items'][0]['owner'])
+        playlists = [
+            playlist
+            for playlist in SpotifyAPI._parse_window_playlists(user_playlists['items'])
+            if playlist is not None
+        ]
+
+        last_page = user_playlists['next'] is None
+
+        return {"success": True, "details": "Playlists successfuly fetched.", "owner": owner, "playlists": playlists, "last_page": last_page}
 
     @staticmethod
-    def is_access_token_expired(
-        token_expiration_date: datetime,
-    ) -> bool:
+    def _parse_user_playlists_window(
+        pages: Dict[int, Dict[str, Any]],
+        window: Window,
+    ) -> Dict[str, Any]:
 
-        is_expired = token_expiration_date - timezone.now()
-        return is_expired.total_seconds() <= 0
+        first_page = pages[min(pages)]
+        owner = SpotifyAPI._parse_owner(first_page['items'][0]['owner']) if first_page['items'] else None
+
+        return {
+            "success": True,
+            "details": "Playlists successfuly fetched.",
+            "owner": owner,
+            "playlists": window.items,
+            "has_next_page": window.has_next,
+            "total": first_page['total'],
+        }
+
+    @staticmethod
+    def _parse_owner(
+        owner_data: Dict[str, Any],
+    ) -> Dict[str, Any]:
+
+        return {
+            "id": owner_data['id'],
+            "name": owner_data['display_name'],
+            "href": owner_data['external_urls']['spotify'],
+        }
+
+    @staticmethod
+    def _parse_window_playlists(
+        playlists: List[Dict[str, Any]],
+    ) -> List[Optional[Dict[str, Any]]]:
+
+        parsed = []
+        for playlist in playlists:
+            # TODO : fix that for image should be displayed a default if none is provided
+            # make sure every playlist has an image and a name, if one hasn't don't send it to front
+            if len(playlist['images']) < 1 or len(playlist['name']) < 1:
+                parsed.append(None)
+                continue
+
+            parsed.append({
+                "id": playlist['id'],
+                "name": playlist['name'],
+                "description": playlist['description'],
+                "href": playlist['external_urls']['spotify'],
+                "image": playlist['images'][0]['url'],
+            })
+        return parsed
+
+    @staticmethod
+    def _parse_window_tracks(
+        songs: List[Dict[str, Any]],
+        skip_empty: bool,
+    ) -> List[Optional[Track]]:
+
+        if not skip_empty:
+            return parse_tracks(songs)
+        # Empty tracks stand as None, keeping the offsets of the others
+        tracks = iter(parse_tracks(songs, skip_empty=True))
+        return [None if song['track']['duration_ms'] == 0 else next(tracks) for song in songs]
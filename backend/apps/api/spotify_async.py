@@ -0,0 +1,360 @@
+import asyncio
+import httpx
+
+from asgiref.sync import sync_to_async
+from spotipy.exceptions import SpotifyException
+from typing import Any, Awaitable, Dict, Iterable, List, Optional
+from urllib.parse import urljoin
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+from django.http import HttpRequest
+
+from apps.api.metrics import endpoint_label, spotify_request
+from apps.api.pagination import page_offsets, take
+from apps.api.spotify import SpotifyAPI, playlist_queries
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_circuit import spotify_circuit, track_staleness
+from apps.api.spotify_scheduler import spotify_scheduler
+from apps.api.spotify_token import app_token, user_tokens
+from apps.api.tracks import parse_tracks
+
+
+class AsyncSpotify:
+    """ Async counterpart of the few spotipy.Spotify calls we make. """
+
+    def __init__(self, client: httpx.AsyncClient, auth: str, client_id: Optional[str] = None):
+        self.client = client
+        self.auth = auth
+        self.client_id = client_id
+
+    async def playlist(self, playlist_id: str, fields: Optional[str] = None) -> Dict[str, Any]:
+        return await self._get(f"playlists/{playlist_id}", fields=fields, additional_types="track")
+
+    async def playlist_items(
+        self,
+        playlist_id: str,
+        fields: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+        additional_types: Iterable[str] = ("track",),
+    ) -> Dict[str, Any]:
+        return await self._get(
+            f"playlists/{playlist_id}/tracks",
+            fields=fields,
+            limit=limit,
+            offset=offset,
+            additional_types=",".join(additional_types),
+        )
+
+    async def current_user_playlists(self, limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        return await self._get("me/playlists", limit=limit, offset=offset)
+
+    async def audio_features(self, track_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        return (await self._get("audio-features", ids=",".join(track_ids)))["audio_features"]
+
+    async def artists(self, artist_ids: List[str]) -> Dict[str, Any]:
+        return await self._get("artists", ids=",".join(artist_ids))
+
+    async def albums(self, album_ids: List[str]) -> Dict[str, Any]:
+        return await self._get("albums", ids=",".join(album_ids))
+
+    async def _get(self, path: str, **params) -> Dict[str, Any]:
+        url = httpx.URL(
+            urljoin(settings.SPOTIFY_API_URL, path),
+            params={key: value for key, value in params.items() if value is not None},
+        )
+        authorization = f"Bearer {self.auth}"
+
+        async def observed_send() -> httpx.Response:
+            with spotify_request(str(url)) as observed:
+                response = await self.client.get(url, headers={"Authorization": authorization})
+                observed.status = response.status_code
+            return response
+
+        async def send() -> httpx.Response:
+            return await spotify_circuit.acall(endpoint_label(path), observed_send)
+
+        response = await spotify_scheduler.asend(
+            self.client_id,
+            spotify_scheduler.coalescing_key("GET", str(url), authorization),
+            send,
+        )
+        if response.is_error:
+            # Same error type as spotipy so callers handle both paths alike
+            raise SpotifyException(
+                response.status_code,
+                -1,
+                f"{response.url}:\n {response.text}",
+                headers=response.headers,
+            )
+        return response.json()
+
+
+class AsyncSpotifyClient:
+    """
+    Pooled httpx.AsyncClient for the ASGI deployment.
+
+    An AsyncClient is bound to the event loop it was first used on, so
+    there is one per loop (in practice one per uvicorn worker).
+    """
+
+    _clients: "WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = WeakKeyDictionary()
+
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = cls._clients.get(loop)
+        if client is None:
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=settings.SPOTIFY_ASYNC_POOL_SIZE,
+                    max_keepalive_connections=settings.SPOTIFY_ASYNC_POOL_SIZE,
+                ),
+                retries=settings.SPOTIFY_HTTP_RETRIES,
+            )
+            client = cls._clients[loop] = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(settings.SPOTIFY_HTTP_TIMEOUT, connect=settings.SPOTIFY_HTTP_CONNECT_TIMEOUT),
+            )
+        return client
+
+    @classmethod
+    def api(cls, auth: str, client_id: Optional[str] = None) -> AsyncSpotify:
+        return AsyncSpotify(cls.client(), auth, client_id)
+
+
+class AsyncSpotifyAPI:
+    """ Non-blocking versions of the SpotifyAPI queries, awaited by the async resolvers. """
+
+    @staticmethod
+    async def get_tracks_from_my_suggestions(
+        playlist_id,
+        offset,
+        context: HttpRequest,
+    ) -> Dict[str, Any]:
+
+        return await playlist_queries.ado(
+            ("my_suggestions", playlist_id, offset),
+            lambda: AsyncSpotifyAPI._get_tracks_from_my_suggestions(playlist_id, offset),
+        )
+
+    @staticmethod
+    async def _get_tracks_from_my_suggestions(
+        playlist_id,
+        offset,
+    ) -> Dict[str, Any]:
+
+        limit_step = 20
+        spotify_async = AsyncSpotifyClient.api(
+            auth=await AsyncSpotifyAPI._app_token(),
+            client_id=settings.SPOTIFY_USER_CLIENT_ID,
+        )
+
+        with track_staleness() as staleness:
+            playlist = await playlist_cache.aplaylist(spotify_async, playlist_id)
+            songs = await playlist_cache.atracks(
+                spotify_async,
+                playlist_id=playlist_id,
+                snapshot_id=playlist['snapshot_id'],
+                limit=limit_step,
+                offset=offset
+            )
+
+        tracks = parse_tracks(songs['items'])
+
+        last_page = songs['next'] is None
+        return {"success": True, "tracks": tracks, "last_page": last_page, "stale": staleness.served}
+
+    @staticmethod
+    async def get_user_playlists(
+        offset,
+        context: HttpRequest,
+    ) -> Dict[str, Any]:
+
+        if context.user.accepted_account is False:
+            return {"success": False, "details": "Account not accepted.", "owner": {}, "playlists": [], "last_page": True}
+
+        access_token = context.user.spotify_access_token
+
+        if not access_token:
+            return {"success": False, "details": "No access token registered", "owner": {}, "playlists": [], "last_page": True}
+        elif user_tokens.is_expiring(context.user.spotify_token_expires_at):
+            access_token = await sync_to_async(user_tokens.refresh)(context.user)
+
+        spotify_async = AsyncSpotifyClient.api(auth=access_token, client_id=settings.SPOTIFY_APP_CLIENT_ID)
+        user_playlists = await spotify_async.current_user_playlists(limit=50, offset=offset)
+
+        return SpotifyAPI._parse_user_playlists(user_playlists)
+
+    @staticmethod
+    async def get_playlist_data(
+        playlist_id,
+        offset,
+        context: HttpRequest,
+        with_info: bool = True,
+        with_tracks: bool = True,
+    ) -> Dict[str, Any]:
+
+        return await playlist_queries.ado(
+            ("playlist_data", playlist_id, offset, with_info, with_tracks),
+            lambda: AsyncSpotifyAPI._get_playlist_data(playlist_id, offset, with_info, with_tracks),
+        )
+
+    @staticmethod
+    async def _get_playlist_data(
+        playlist_id,
+        offset,
+        with_info: bool,
+        with_tracks: bool,
+    ) -> Dict[str, Any]:
+
+        limit_step = 20
+        spotify_async = AsyncSpotifyClient.api(
+            auth=await AsyncSpotifyAPI._app_token(),
+            client_id=settings.SPOTIFY_USER_CLIENT_ID,
+        )
+
+        with track_staleness() as staleness:
+            playlist = await playlist_cache.aplaylist(spotify_async, playlist_id)
+            songs = None
+            if with_tracks:
+                songs = await playlist_cache.atracks(
+                    spotify_async,
+                    playlist_id=playlist_id,
+                    snapshot_id=playlist['snapshot_id'],
+                    limit=limit_step,
+                    offset=offset
+                )
+
+        return SpotifyAPI._parse_playlist_data(playlist if with_info else None, songs, staleness.served)
+
+    @staticmethod
+    async def get_tracks_window(
+        playlist_id,
+        start: int,
+        count: int,
+        skip_empty: bool,
+        context: HttpRequest,
+    ) -> Dict[str, Any]:
+
+        return await playlist_queries.ado(
+            ("tracks_window", playlist_id, start, count, skip_empty),
+            lambda: AsyncSpotifyAPI._get_tracks_window(playlist_id, start, count, skip_empty),
+        )
+
+    @staticmethod
+    async def _get_tracks_window(
+        playlist_id,
+        start: int,
+        count: int,
+        skip_empty: bool,
+    ) -> Dict[str, Any]:
+
+        limit_step = 100  # Aligned so that every window shares the cached pages
+        spotify_async = AsyncSpotifyClient.api(
+            auth=await AsyncSpotifyAPI._app_token(),
+            client_id=settings.SPOTIFY_USER_CLIENT_ID,
+        )
+
+        def fetch_page(offset: int) -> Awaitable[Dict[str, Any]]:
+            return playlist_cache.atracks(
+                spotify_async,
+                playlist_id=playlist_id,
+                snapshot_id=playlist['snapshot_id'],
+                limit=limit_step,
+                offset=offset
+            )
+
+        with track_staleness() as staleness:
+            playlist = await playlist_cache.aplaylist(spotify_async, playlist_id)
+
+            pages = {}
+            offsets = page_offsets(start, count, limit_step)
+            while True:
+                pages.update(zip(offsets, await asyncio.gather(*map(fetch_page, offsets))))
+                window = take(pages, start, count, lambda songs: SpotifyAPI._parse_window_tracks(songs, skip_empty))
+                if window.next_offset is None:
+                    break
+                offsets = [window.next_offset]
+
+        return {
+            "success": True,
+            "playlist": SpotifyAPI._parse_playlist_info(playlist),
+            "tracks": window.items,
+            "has_next_page": window.has_next,
+            "total": pages[min(pages)]['total'],
+            "stale": staleness.served,
+        }
+
+    @staticmethod
+    async def get_user_playlists_window(
+        start: int,
+        count: int,
+        context: HttpRequest,
+    ) -> Dict[str, Any]:
+
+        if context.user.accepted_account is False:
+            return {"success": False, "details": "Account not accepted.", "owner": None, "playlists": [], "has_next_page": False}
+
+        access_token = context.user.spotify_access_token
+
+        if not access_token:
+            return {"success": False, "details": "No access token registered", "owner": None, "playlists": [], "has_next_page": False}
+        elif user_tokens.is_expiring(context.user.spotify_token_expires_at):
+            access_token = await sync_to_async(user_tokens.refresh)(context.user)
+
+        limit_step = 50  # Not cached, pages start at the window
+        spotify_async = AsyncSpotifyClient.api(auth=access_token, client_id=settings.SPOTIFY_APP_CLIENT_ID)
+
+        def fetch_page(offset: int) -> Awaitable[Dict[str, Any]]:
+            return spotify_async.current_user_playlists(limit=limit_step, offset=offset)
+
+        pages = {}
+        offsets = page_offsets(start, count, limit_step, aligned=False)
+        while True:
+            pages.update(zip(offsets, await asyncio.gather(*map(fetch_page, offsets))))
+            window = take(pages, start, count, SpotifyAPI._parse_window_playlists)
+            if window.next_offset is None:
+                break
+            offsets = [window.next_offset]
+
+        return SpotifyAPI._parse_user_playlists_window(pages, window)
+
+    @staticmethod
+    async def get_audio_features(
+        track_ids: List[str],
+    ) -> List[Optional[Dict[str, Any]]]:
+
+        spotify_async = AsyncSpotifyClient.api(
+            auth=await AsyncSpotifyAPI._app_token(),
+            client_id=settings.SPOTIFY_USER_CLIENT_ID,
+        )
+        return await spotify_async.audio_features(track_ids)
+
+    @staticmethod
+    async def get_artists(
+        artist_ids: List[str],
+    ) -> List[Optional[Dict[str, Any]]]:
+
+        spotify_async = AsyncSpotifyClient.api(
+            auth=await AsyncSpotifyAPI._app_token(),
+            client_id=settings.SPOTIFY_USER_CLIENT_ID,
+        )
+        return (await spotify_async.artists(artist_ids))['artists']
+
+    @staticmethod
+    async def get_albums(
+        album_ids: List[str],
+    ) -> List[Optional[Dict[str, Any]]]:
+
+        spotify_async = AsyncSpotifyClient.api(
+            auth=await AsyncSpotifyAPI._app_token(),
+            client_id=settings.SPOTIFY_USER_CLIENT_ID,
+        )
+        return (await spotify_async.albums(album_ids))['albums']
+
+    @staticmethod
+    async def _app_token() -> str:
+        # Nearly always a cache hit, the rare token request runs off the event loop
+        return await sync_to_async(app_token.get_access_token, thread_sensitive=False)()
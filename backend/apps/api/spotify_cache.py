@@ -0,0 +1,365 @@
+import asyncio
+import threading
+import time
+import spotipy
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from apps.api.metrics import CACHE_REQUESTS
+from apps.api.single_flight import SingleFlight
+from apps.api.spotify_circuit import current_staleness, is_upstream_failure
+
+
+PLAYLIST_FIELDS = "name,description,external_urls,owner(display_name,external_urls),snapshot_id"
+TRACKS_FIELDS = "items(track(id,name,duration_ms,preview_url,external_urls,artists(id,name),album(id,images))),next,total"
+
+
+class LRUCache:
+    """ Bounded in-process cache with per-entry expiry. """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, timeout: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class Uncached:
+    """ Value of a fetch to return without keeping it in the cache. """
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+class TieredCache:
+    """
+    Read-through cache: an optional in-process LRU in front of a Django cache.
+
+    Local entries live at most `local_timeout` seconds so that workers
+    converge on the shared tier after an invalidation.
+
+    With a `stale_timeout`, the shared tier also keeps the last fetched value
+    that long, served (and reported to the current Staleness) when fetching
+    a fresh one fails because Spotify is down, slow or rate limiting us.
+
+    Concurrent misses of a key share one fetch in the worker and, with
+    SPOTIFY_CACHE_LOCK, across workers: the worker holding the key's lock in
+    the shared tier fetches, the others wait for the value to show up there.
+
+    A fetch returning an `Uncached` value has it served but not stored.
+    """
+
+    def __init__(
+        self,
+        local: Optional[LRUCache],
+        shared_alias: str,
+        local_timeout: float,
+        name: str = "spotify",
+    ):
+        self.local = local
+        self.shared_alias = shared_alias
+        self.local_timeout = local_timeout
+        self.name = name
+        self._flights = SingleFlight(name)
+        self._stats_lock = threading.Lock()
+        self._stats = {"local_hits": 0, "shared_hits": 0, "misses": 0, "stale_hits": 0}
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def get_or_set(
+        self,
+        key: str,
+        fetch: Callable[[], Any],
+        timeout: float,
+        stale_timeout: Optional[float] = None,
+    ) -> Any:
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                self._count("local_hits")
+                return value
+
+        value = self.shared.get(key)
+        if value is not None:
+            self._count("shared_hits")
+        else:
+            self._count("misses")
+            try:
+                value = self._flights.do(key, lambda: self._fetch(key, fetch, timeout, stale_timeout))
+            except Exception as error:
+                return self._stale(error, stale_timeout and self.shared.get(self._stale_key(key)))
+            if isinstance(value, Uncached):
+                return value.value
+
+        if self.local is not None:
+            self.local.set(key, value, min(timeout, self.local_timeout))
+        return value
+
+    async def aget_or_set(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        timeout: float,
+        stale_timeout: Optional[float] = None,
+    ) -> Any:
+        if self.local is not None:
+            value = self.local.get(key)
+            if value is not None:
+                self._count("local_hits")
+                return value
+
+        value = await self.shared.aget(key)
+        if value is not None:
+            self._count("shared_hits")
+        else:
+            self._count("misses")
+            try:
+                value = await self._flights.ado(key, lambda: self._afetch(key, fetch, timeout, stale_timeout))
+            except Exception as error:
+                return self._stale(error, stale_timeout and await self.shared.aget(self._stale_key(key)))
+            if isinstance(value, Uncached):
+                return value.value
+
+        if self.local is not None:
+            self.local.set(key, value, min(timeout, self.local_timeout))
+        return value
+
+    def _fetch(self, key: str, fetch: Callable[[], Any], timeout: float, stale_timeout: Optional[float]) -> Any:
+        if not settings.SPOTIFY_CACHE_LOCK:
+            return self._store(key, fetch(), timeout, stale_timeout)
+
+        lock_key = f"{key}:lock"
+        if self.shared.add(lock_key, True, timeout=settings.SPOTIFY_CACHE_LOCK_TIMEOUT):
+            try:
+                # Set by the previous lock holder while we missed it
+                value = self.shared.get(key)
+                if value is not None:
+                    return value
+                return self._store(key, fetch(), timeout, stale_timeout)
+            finally:
+                self.shared.delete(lock_key)
+
+        deadline = time.monotonic() + settings.SPOTIFY_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = self.shared.get(key)
+            if value is not None:
+                return value
+            if self.shared.get(lock_key) is None:
+                break
+        # The other worker failed or gave up
+        return self._store(key, fetch(), timeout, stale_timeout)
+
+    async def _afetch(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        timeout: float,
+        stale_timeout: Optional[float],
+    ) -> Any:
+        if not settings.SPOTIFY_CACHE_LOCK:
+            return await self._astore(key, await fetch(), timeout, stale_timeout)
+
+        lock_key = f"{key}:lock"
+        if await self.shared.aadd(lock_key, True, timeout=settings.SPOTIFY_CACHE_LOCK_TIMEOUT):
+            try:
+                value = await self.shared.aget(key)
+                if value is not None:
+                    return value
+                return await self._astore(key, await fetch(), timeout, stale_timeout)
+            finally:
+                await self.shared.adelete(lock_key)
+
+        deadline = time.monotonic() + settings.SPOTIFY_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            value = await self.shared.aget(key)
+            if value is not None:
+                return value
+            if await self.shared.aget(lock_key) is None:
+                break
+        return await self._astore(key, await fetch(), timeout, stale_timeout)
+
+    def _store(self, key: str, value: Any, timeout: float, stale_timeout: Optional[float]) -> Any:
+        if isinstance(value, Uncached):
+            return value
+        self.shared.set(key, value, timeout=timeout)
+        if stale_timeout:
+            self.shared.set(self._stale_key(key), value, timeout=stale_timeout)
+        return value
+
+    async def _astore(self, key: str, value: Any, timeout: float, stale_timeout: Optional[float]) -> Any:
+        if isinstance(value, Uncached):
+            return value
+        await self.shared.aset(key, value, timeout=timeout)
+        if stale_timeout:
+            await self.shared.aset(self._stale_key(key), value, timeout=stale_timeout)
+        return value
+
+    def _stale(self, error: Exception, value: Any) -> Any:
+        """ Stale `value` standing in for a failed fetch, which raises again without one. """
+        if not value or not is_upstream_failure(error):
+            raise error
+        self._count("stale_hits")
+        staleness = current_staleness.get()
+        if staleness is not None:
+            staleness.served = True
+        # Never kept in the local tier, whose hits would not be reported stale
+        return value
+
+    @staticmethod
+    def _stale_key(key: str) -> str:
+        return f"{key}:stale"
+
+    def delete(self, key: str) -> None:
+        if self.local is not None:
+            self.local.delete(key)
+        self.shared.delete(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, stat: str) -> None:
+        with self._stats_lock:
+            self._stats[stat] += 1
+        CACHE_REQUESTS.labels(self.name, stat).inc()
+
+
+class PlaylistCache:
+    """
+    Playlist metadata and track pages served from cache.
+
+    Track pages are keyed by the playlist `snapshot_id`, which Spotify changes
+    on every edit: a page key never goes stale, only the (short lived)
+    metadata entry holding the current snapshot has to be refreshed.
+
+    Pages don't come with their snapshot, and the playlist may have been
+    edited since its metadata was read: a fetched page is only kept when the
+    snapshot read after it is still the one of its key.
+    """
+
+    def __init__(self, store: TieredCache):
+        self.store = store
+
+    def playlist(self, spotipy_auth: spotipy.Spotify, playlist_id: str) -> Dict[str, Any]:
+        return self.store.get_or_set(
+            f"spotify:playlist:{playlist_id}",
+            lambda: spotipy_auth.playlist(playlist_id, fields=PLAYLIST_FIELDS),
+            settings.SPOTIFY_PLAYLIST_CACHE_TTL,
+            settings.SPOTIFY_STALE_CACHE_TTL,
+        )
+
+    def tracks(
+        self,
+        spotipy_auth: spotipy.Spotify,
+        playlist_id: str,
+        snapshot_id: str,
+        limit: int,
+        offset: int,
+    ) -> Dict[str, Any]:
+        def fetch() -> Any:
+            page = spotipy_auth.playlist_items(
+                playlist_id,
+                fields=TRACKS_FIELDS,
+                limit=limit,
+                offset=offset,
+                additional_types=("track",),
+            )
+            if spotipy_auth.playlist(playlist_id, fields="snapshot_id")["snapshot_id"] != snapshot_id:
+                return Uncached(page)
+            return page
+
+        return self.store.get_or_set(
+            f"spotify:tracks:{playlist_id}:{snapshot_id}:{offset}:{limit}",
+            fetch,
+            settings.SPOTIFY_TRACKS_CACHE_TTL,
+            settings.SPOTIFY_STALE_CACHE_TTL,
+        )
+
+    async def aplaylist(self, spotify_async: Any, playlist_id: str) -> Dict[str, Any]:
+        return await self.store.aget_or_set(
+            f"spotify:playlist:{playlist_id}",
+            lambda: spotify_async.playlist(playlist_id, fields=PLAYLIST_FIELDS),
+            settings.SPOTIFY_PLAYLIST_CACHE_TTL,
+            settings.SPOTIFY_STALE_CACHE_TTL,
+        )
+
+    async def atracks(
+        self,
+        spotify_async: Any,
+        playlist_id: str,
+        snapshot_id: str,
+        limit: int,
+        offset: int,
+    ) -> Dict[str, Any]:
+        async def fetch() -> Any:
+            page = await spotify_async.playlist_items(
+                playlist_id,
+                fields=TRACKS_FIELDS,
+                limit=limit,
+                offset=offset,
+                additional_types=("track",),
+            )
+            if (await spotify_async.playlist(playlist_id, fields="snapshot_id"))["snapshot_id"] != snapshot_id:
+                return Uncached(page)
+            return page
+
+        return await self.store.aget_or_set(
+            f"spotify:tracks:{playlist_id}:{snapshot_id}:{offset}:{limit}",
+            fetch,
+            settings.SPOTIFY_TRACKS_CACHE_TTL,
+            settings.SPOTIFY_STALE_CACHE_TTL,
+        )
+
+    def invalidate(self, playlist_id: str) -> None:
+        # Forgetting the snapshot is enough, pages of another snapshot are never read
+        self.store.delete(f"spotify:playlist:{playlist_id}")
+
+
+def _build_playlist_cache() -> PlaylistCache:
+    local = None
+    if settings.SPOTIFY_CACHE_LOCAL_SIZE > 0:
+        local = LRUCache(maxsize=settings.SPOTIFY_CACHE_LOCAL_SIZE)
+    return PlaylistCache(TieredCache(
+        local=local,
+        shared_alias=settings.SPOTIFY_CACHE_ALIAS,
+        local_timeout=settings.SPOTIFY_CACHE_LOCAL_TTL,
+        name="playlist",
+    ))
+
+
+playlist_cache = _build_playlist_cache()
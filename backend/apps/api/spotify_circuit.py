@@ -0,0 +1,169 @@
+import math
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+import httpx
+import requests
+
+from django.conf import settings
+from spotipy.exceptions import SpotifyException
+
+from apps.api.metrics import SPOTIFY_CIRCUIT_TRANSITIONS
+from apps.api.spotify_scheduler import SpotifyRateLimited
+
+
+class SpotifyUnavailable(Exception):
+    """ Raised without calling Spotify while the circuit of an endpoint is open. """
+
+    def __init__(self, endpoint: str, retry_after: float):
+        self.endpoint = endpoint
+        self.retry_after = math.ceil(retry_after)
+        super().__init__(f"Spotify is unavailable, please retry in {self.retry_after} seconds.")
+
+    @property
+    def extensions(self) -> Dict[str, Any]:
+        # Copied by graphql-core into the error of the response
+        return {"code": "SPOTIFY_UNAVAILABLE", "retryAfter": self.retry_after}
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """ Spotify being down, slow or overloaded, rather than the request being wrong. """
+    if isinstance(error, (SpotifyUnavailable, SpotifyRateLimited, requests.RequestException, httpx.TransportError)):
+        return True
+    if isinstance(error, SpotifyException):
+        # spotipy reports exhausted retries as 429
+        return error.http_status == 429 or error.http_status >= 500
+    return False
+
+
+class _Circuit:
+    __slots__ = ("failures", "opened_at", "trial")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breakers in front of the Spotify calls of a worker.
+
+    SPOTIFY_CIRCUIT_FAILURES consecutive failures (5xx, connection errors,
+    timeouts) on an endpoint open its circuit: for SPOTIFY_CIRCUIT_RESET_TIMEOUT
+    seconds calls fail right away with SpotifyUnavailable instead of tying
+    up threads on a Spotify incident. Then one trial call goes through,
+    closing the circuit when it succeeds and opening it again otherwise.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._circuits: Dict[str, _Circuit] = {}
+
+    def call(self, endpoint: str, send: Callable[[], Any]) -> Any:
+        """ Run `send`, returning a response with a `status_code`, behind the circuit of `endpoint`. """
+        self._allow(endpoint)
+        try:
+            response = send()
+        except Exception:
+            self._record(endpoint, failed=True)
+            raise
+        except BaseException:
+            # Cancelled, tells nothing about Spotify
+            self._record(endpoint, failed=None)
+            raise
+        self._record(endpoint, failed=response.status_code >= 500)
+        return response
+
+    async def acall(self, endpoint: str, send: Callable[[], Awaitable[Any]]) -> Any:
+        self._allow(endpoint)
+        try:
+            response = await send()
+        except Exception:
+            self._record(endpoint, failed=True)
+            raise
+        except BaseException:
+            # Cancelled, tells nothing about Spotify
+            self._record(endpoint, failed=None)
+            raise
+        self._record(endpoint, failed=response.status_code >= 500)
+        return response
+
+    def state(self, endpoint: str) -> str:
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None or circuit.opened_at is None:
+                return "closed"
+            if circuit.trial or time.monotonic() - circuit.opened_at >= settings.SPOTIFY_CIRCUIT_RESET_TIMEOUT:
+                return "half_open"
+            return "open"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._circuits.clear()
+
+    def _allow(self, endpoint: str) -> None:
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None or circuit.opened_at is None:
+                return
+            remaining = circuit.opened_at + settings.SPOTIFY_CIRCUIT_RESET_TIMEOUT - time.monotonic()
+            if remaining <= 0 and not circuit.trial:
+                # Half-open, this call is the trial
+                circuit.trial = True
+                SPOTIFY_CIRCUIT_TRANSITIONS.labels(endpoint, "half_open").inc()
+                return
+        raise SpotifyUnavailable(endpoint, max(remaining, 1))
+
+    def _record(self, endpoint: str, failed: Optional[bool]) -> None:
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None:
+                if not failed:
+                    return
+                circuit = self._circuits[endpoint] = _Circuit()
+
+            if failed is None:
+                circuit.trial = False
+                return
+            if not failed:
+                if circuit.opened_at is not None:
+                    SPOTIFY_CIRCUIT_TRANSITIONS.labels(endpoint, "closed").inc()
+                del self._circuits[endpoint]
+                return
+
+            circuit.failures += 1
+            if circuit.trial or (circuit.opened_at is None and circuit.failures >= settings.SPOTIFY_CIRCUIT_FAILURES):
+                circuit.opened_at = time.monotonic()
+                circuit.trial = False
+                SPOTIFY_CIRCUIT_TRANSITIONS.labels(endpoint, "open").inc()
+
+
+spotify_circuit = CircuitBreaker()
+
+
+class Staleness:
+    """ Whether the cache served a stale copy to the current query. """
+
+    __slots__ = ("served",)
+
+    def __init__(self):
+        self.served = False
+
+
+# Mutable, so that fetch-all threads running in a copy of the context report to it
+current_staleness: ContextVar[Optional[Staleness]] = ContextVar("spotify_staleness", default=None)
+
+
+@contextmanager
+def track_staleness() -> Iterator[Staleness]:
+    staleness = Staleness()
+    token = current_staleness.set(staleness)
+    try:
+        yield staleness
+    finally:
+        current_staleness.reset(token)
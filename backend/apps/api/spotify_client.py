@@ -0,0 +1,180 @@
+import os
+import threading
+import requests
+import spotipy
+
+from typing import Any, Optional, Tuple
+from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+from apps.api.metrics import SPOTIFY_RETRIES, endpoint_label, spotify_request
+from apps.api.spotify_circuit import spotify_circuit
+from apps.api.spotify_scheduler import credential, spotify_credential, spotify_scheduler
+
+
+class _PooledSpotify(spotipy.Spotify):
+    """ Spotipy client bound to the shared session, which it must never close. """
+
+    client_id: Optional[str] = None
+
+    def __del__(self):
+        pass
+
+    def _internal_call(self, method, url, payload, params):
+        # Tells the adapter whose rate limit budget the request uses
+        with credential(self.client_id):
+            return super()._internal_call(method, url, payload, params)
+
+
+class _CountingRetry(Retry):
+    """ Counts the attempts urllib3 retries, invisible to the adapter. """
+
+    def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+        status = response.status if response is not None else "error"
+        SPOTIFY_RETRIES.labels(endpoint_label(url or ""), str(status)).inc()
+        return super().increment(method, url, response, error, *args, **kwargs)
+
+
+class _SchedulerRetry(_CountingRetry):
+    """ Leaves 429s to the scheduler, which pauses every worker. """
+
+    RETRY_AFTER_STATUS_CODES = frozenset([413, 503])
+
+
+class _InstrumentedAdapter(HTTPAdapter):
+    """
+    Records every request, retries included, in metrics and the current trace.
+
+    Requests to an endpoint failing over and over are cut short by its circuit breaker.
+    """
+
+    def send(self, request, **kwargs):
+        return spotify_circuit.call(endpoint_label(request.url), lambda: self._send(request, **kwargs))
+
+    def _send(self, request, **kwargs):
+        with spotify_request(request.url) as observed:
+            response = super().send(request, **kwargs)
+            observed.status = response.status_code
+            return response
+
+
+class _ScheduledAdapter(_InstrumentedAdapter):
+    """ Web API requests wait for the rate limit scheduler. """
+
+    def send(self, request, **kwargs):
+        return spotify_scheduler.send(
+            spotify_credential.get(),
+            spotify_scheduler.coalescing_key(request.method, request.url, request.headers.get("Authorization")),
+            lambda: super(_ScheduledAdapter, self).send(request, **kwargs),
+        )
+
+
+class SpotifyClient:
+    """
+    Process-wide Spotify HTTP layer.
+
+    Every call to api.spotify.com and accounts.spotify.com goes through one
+    keep-alive requests.Session per worker process, so TCP+TLS handshakes are
+    paid once per pooled connection instead of once per GraphQL query.
+    """
+
+    _session: Optional[requests.Session] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    cls._session = cls._build_session()
+        return cls._session
+
+    @classmethod
+    def _build_session(cls) -> requests.Session:
+        def retry(retry_class, status_forcelist):
+            return retry_class(
+                total=settings.SPOTIFY_HTTP_RETRIES,
+                connect=settings.SPOTIFY_HTTP_RETRIES,
+                read=False,
+                status=settings.SPOTIFY_HTTP_RETRIES,
+                allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                status_forcelist=status_forcelist,
+                backoff_factor=settings.SPOTIFY_HTTP_BACKOFF_FACTOR,
+                respect_retry_after_header=True,
+            )
+
+        # accounts.spotify.com
+        adapter = _InstrumentedAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.SPOTIFY_HTTP_POOL_SIZE,
+            max_retries=retry(_CountingRetry, (429, 500, 502, 503, 504)),
+        )
+        # api.spotify.com, mounted on the longer prefix
+        api_adapter = _ScheduledAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.SPOTIFY_HTTP_POOL_SIZE,
+            max_retries=retry(_SchedulerRetry, (500, 502, 503, 504)),
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.mount(settings.SPOTIFY_API_URL, api_adapter)
+        return session
+
+    @classmethod
+    def reset(cls) -> None:
+        """ Close the pooled session, the next call builds a fresh one. """
+        with cls._lock:
+            session, cls._session = cls._session, None
+        if session is not None:
+            session.close()
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        # Forked workers (gunicorn --preload) must not reuse the parent's sockets
+        cls._lock = threading.Lock()
+        cls._session = None
+
+    @classmethod
+    def api(
+        cls,
+        auth: Optional[str] = None,
+        auth_manager: Any = None,
+    ) -> spotipy.Spotify:
+        client = _PooledSpotify(
+            auth=auth,
+            auth_manager=auth_manager,
+            requests_session=cls.session(),
+            requests_timeout=cls.timeout(),
+        )
+        client.prefix = settings.SPOTIFY_API_URL
+        # Rate limits are per app: app tokens come from the client credentials
+        # app, users' tokens from the OAuth one
+        client.client_id = settings.SPOTIFY_USER_CLIENT_ID if auth_manager is not None else settings.SPOTIFY_APP_CLIENT_ID
+        return client
+
+    @staticmethod
+    def timeout() -> Tuple[float, float]:
+        """ Connect and read timeouts of every attempt. """
+        return settings.SPOTIFY_HTTP_CONNECT_TIMEOUT, settings.SPOTIFY_HTTP_TIMEOUT
+
+    @staticmethod
+    def accounts_url(path: str) -> str:
+        return urljoin(settings.SPOTIFY_ACCOUNTS_URL, path)
+
+    @classmethod
+    def get(cls, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", cls.timeout())
+        return cls.session().get(url, **kwargs)
+
+    @classmethod
+    def post(cls, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", cls.timeout())
+        return cls.session().post(url, **kwargs)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=SpotifyClient._after_fork)
@@ -0,0 +1,212 @@
+import asyncio
+import inspect
+
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest
+
+from apps.api.metrics import CACHE_REQUESTS
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_async import AsyncSpotifyAPI
+from apps.api.tracks import Track
+
+
+Value = Optional[Dict[str, Any]]
+
+
+class BatchLoader:
+    """
+    Catalog data of one GraphQL request, fetched from a multi-id endpoint.
+
+    The ids loaded together are looked up in the shared cache, the missing
+    ones fetched `max_batch_size` at a time, and every id is fetched at most
+    once per request. Sync execution resolves the tracks of a page one after
+    the other, so the page announces their ids with expect(): the first
+    load() then fetches them all.
+    """
+
+    def __init__(self, kind: str, batch: Callable[[List[str]], List[Value]], max_batch_size: int):
+        self.kind = kind
+        self.batch = batch
+        self.max_batch_size = max_batch_size
+        # Fetched values, or the exception of their batch
+        self._values: Dict[str, Union[Value, Exception]] = {}
+        # Ordered set of the ids of the next batch
+        self._pending: Dict[str, None] = {}
+
+    def expect(self, keys: Iterable[Optional[str]]) -> None:
+        for key in keys:
+            if key and key not in self._values:
+                self._pending[key] = None
+
+    def load(self, key: Optional[str]) -> Value:
+        if not key:
+            return None
+        if key not in self._values:
+            self._pending[key] = None
+            self._dispatch()
+        return self._value(key)
+
+    def load_many(self, keys: Iterable[str]) -> List[Value]:
+        keys = list(keys)
+        self.expect(keys)
+        return [self.load(key) for key in keys]
+
+    def _dispatch(self) -> None:
+        keys = self._take()
+        cached = caches[settings.SPOTIFY_CACHE_ALIAS].get_many([self._cache_key(key) for key in keys])
+        for chunk in self._chunks(self._cached(keys, cached)):
+            try:
+                values = self.batch(chunk)
+            except Exception as error:
+                self._failed(chunk, error)
+                continue
+            caches[settings.SPOTIFY_CACHE_ALIAS].set_many(self._fetched(chunk, values), settings.SPOTIFY_CATALOG_CACHE_TTL)
+
+    def _take(self) -> List[str]:
+        keys = list(self._pending)
+        self._pending.clear()
+        return keys
+
+    def _cached(self, keys: List[str], cached: Dict[str, Any]) -> List[str]:
+        """ Resolve the cached keys, returning the ones left to fetch. """
+        missing = []
+        for key in keys:
+            value = cached.get(self._cache_key(key))
+            if value is None:
+                missing.append(key)
+            else:
+                self._values[key] = value
+        CACHE_REQUESTS.labels(self.kind, "shared_hits").inc(len(keys) - len(missing))
+        CACHE_REQUESTS.labels(self.kind, "misses").inc(len(missing))
+        return missing
+
+    def _chunks(self, keys: List[str]) -> Iterable[List[str]]:
+        for start in range(0, len(keys), self.max_batch_size):
+            yield keys[start:start + self.max_batch_size]
+
+    def _fetched(self, keys: List[str], values: List[Value]) -> Dict[str, Any]:
+        """ Resolve the fetched keys, returning the cache entries to set. """
+        entries = {}
+        for key, value in zip(keys, values):
+            self._values[key] = value
+            # Spotify answers null for unknown ids, not worth caching
+            if value is not None:
+                entries[self._cache_key(key)] = value
+        return entries
+
+    def _failed(self, keys: List[str], error: Exception) -> None:
+        # Every field waiting for these ids gets the error, without a call each
+        for key in keys:
+            self._values[key] = error
+
+    def _value(self, key: str) -> Value:
+        value = self._values[key]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def _cache_key(self, key: str) -> str:
+        return f"spotify:{self.kind}:{key}"
+
+
+class AsyncBatchLoader(BatchLoader):
+    """
+    BatchLoader of the async resolvers: the ids loaded while the event loop
+    runs the other resolvers share the batch, scheduled by the first load().
+    """
+
+    def __init__(self, kind: str, batch: Callable[[List[str]], Awaitable[List[Value]]], max_batch_size: int):
+        super().__init__(kind, batch, max_batch_size)
+        self._batch: Optional["asyncio.Future[None]"] = None
+
+    async def load(self, key: Optional[str]) -> Value:
+        if not key:
+            return None
+        while key not in self._values:
+            # Joins the batch about to start, or the next one once it ran
+            self._pending[key] = None
+            if self._batch is None:
+                self._batch = asyncio.ensure_future(self._dispatch())
+            await asyncio.shield(self._batch)
+        return self._value(key)
+
+    async def load_many(self, keys: Iterable[str]) -> List[Value]:
+        keys = list(keys)
+        self.expect(keys)
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    async def _dispatch(self) -> None:
+        try:
+            keys = self._take()
+            cached = await caches[settings.SPOTIFY_CACHE_ALIAS].aget_many([self._cache_key(key) for key in keys])
+            chunks = list(self._chunks(self._cached(keys, cached)))
+            results = await asyncio.gather(*(self.batch(chunk) for chunk in chunks), return_exceptions=True)
+            entries = {}
+            for chunk, values in zip(chunks, results):
+                if isinstance(values, Exception):
+                    self._failed(chunk, values)
+                else:
+                    entries.update(self._fetched(chunk, values))
+            if entries:
+                await caches[settings.SPOTIFY_CACHE_ALIAS].aset_many(entries, settings.SPOTIFY_CATALOG_CACHE_TTL)
+        finally:
+            self._batch = None
+
+
+class SpotifyLoaders:
+    """ The catalog loaders of one GraphQL request, see spotify_loaders(). """
+
+    def __init__(self, audio_features: BatchLoader, artists: BatchLoader, albums: BatchLoader):
+        self.audio_features = audio_features
+        self.artists = artists
+        self.albums = albums
+
+    def expect(self, tracks: Iterable[Track]) -> None:
+        """ Announce the tracks of a page, batched on the first load of one of them. """
+        tracks = list(tracks)
+        self.audio_features.expect(track.id for track in tracks)
+        self.artists.expect(artist_id for track in tracks for artist_id in track.artist_ids)
+        self.albums.expect(track.album_id for track in tracks)
+
+
+def spotify_loaders(context: HttpRequest) -> SpotifyLoaders:
+    """ Loaders of the request, async ones when it is executed on an event loop. """
+    loaders = getattr(context, "spotify_loaders", None)
+    if loaders is None:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            loaders = SpotifyLoaders(
+                BatchLoader("audio_features", SpotifyAPI.get_audio_features, 100),
+                BatchLoader("artist", SpotifyAPI.get_artists, 50),
+                BatchLoader("album", SpotifyAPI.get_albums, 20),
+            )
+        else:
+            loaders = SpotifyLoaders(
+                AsyncBatchLoader("audio_features", AsyncSpotifyAPI.get_audio_features, 100),
+                AsyncBatchLoader("artist", AsyncSpotifyAPI.get_artists, 50),
+                AsyncBatchLoader("album", AsyncSpotifyAPI.get_albums, 20),
+            )
+        context.spotify_loaders = loaders
+    return loaders
+
+
+def then(value: Any, callback: Callable[[Any], Any]) -> Any:
+    """ callback(value), once awaited when the loader is async. """
+    if inspect.isawaitable(value):
+        async def chained():
+            return callback(await value)
+        return chained()
+    return callback(value)
+
+
+def genres(artists: List[Value]) -> List[str]:
+    """ Genres of the artists of a track, without repeats. """
+    merged = {}
+    for artist in artists:
+        if artist is not None:
+            merged.update(dict.fromkeys(artist.get("genres", ())))
+    return list(merged)
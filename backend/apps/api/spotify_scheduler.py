@@ -0,0 +1,218 @@
+import asyncio
+import copy
+import math
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.api.metrics import SPOTIFY_SCHEDULER
+from apps.api.single_flight import SingleFlight
+
+
+# App whose rate limit the Spotify calls of the current context count against
+spotify_credential: ContextVar[Optional[str]] = ContextVar("spotify_credential", default=None)
+
+
+@contextmanager
+def credential(client_id: Optional[str]) -> Iterator[None]:
+    token = spotify_credential.set(client_id)
+    try:
+        yield
+    finally:
+        spotify_credential.reset(token)
+
+
+class SpotifyRateLimited(Exception):
+    """ Raised instead of queueing once a request would wait longer than allowed. """
+
+    def __init__(self, retry_after: float):
+        self.retry_after = math.ceil(retry_after)
+        super().__init__(f"Spotify is rate limiting us, please retry in {self.retry_after} seconds.")
+
+    @property
+    def extensions(self) -> Dict[str, Any]:
+        # Copied by graphql-core into the error of the response
+        return {"code": "SPOTIFY_RATE_LIMITED", "retryAfter": self.retry_after}
+
+
+class SpotifyScheduler:
+    """
+    Rate limit aware gate in front of every Spotify API request.
+
+    Spotify enforces its rate limit per app over a rolling 30 seconds window
+    and answers 429 + Retry-After beyond it. Each app credential gets a
+    budget of SPOTIFY_RATE_LIMIT_REQUESTS per SPOTIFY_RATE_LIMIT_WINDOW,
+    counted in Django's cache so that every worker shares it, and a 429
+    pauses the credential for every worker until Retry-After is over.
+
+    Requests over budget wait their turn for up to SPOTIFY_RATE_LIMIT_MAX_WAIT
+    seconds (identical GETs waiting or in flight share one upstream call),
+    beyond that or with a full queue they fail fast with SpotifyRateLimited.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = SingleFlight("spotify_http")
+        self._waiting = 0
+
+    # Budget, shared by the workers through the cache
+
+    def reserve(self, client_id: str) -> float:
+        """ Take one request from the budget, or return how long to wait before asking again. """
+        now = time.time()
+        blocked_until = cache.get(self._key(client_id, "blocked_until"))
+        if blocked_until is not None and blocked_until > now:
+            return blocked_until - now
+
+        limit = settings.SPOTIFY_RATE_LIMIT_REQUESTS
+        if limit <= 0:
+            return 0.0
+
+        # Sliding window counter: the previous window weighs what is left of it
+        window = settings.SPOTIFY_RATE_LIMIT_WINDOW
+        position = now / window
+        current = int(position)
+        elapsed = position - current
+        key = self._key(client_id, f"budget:{current}")
+        cache.add(key, 0, timeout=window * 2 + 1)
+        count = cache.incr(key)
+        previous = cache.get(self._key(client_id, f"budget:{current - 1}"), 0)
+        if previous * (1 - elapsed) + count <= limit:
+            return 0.0
+
+        # Over budget, give the request back and wait for the window to slide
+        cache.decr(key)
+        others = count - 1
+        if others + 1 > limit or not previous:
+            return (1 - elapsed) * window
+        freed_at = 1 - (limit - others - 1) / previous
+        return max(freed_at - elapsed, 0.01) * window
+
+    def block(self, client_id: str, retry_after: float) -> None:
+        """ Pause the credential for every worker, Spotify said so. """
+        blocked_until = time.time() + retry_after
+        key = self._key(client_id, "blocked_until")
+        if (cache.get(key) or 0) < blocked_until:
+            cache.set(key, blocked_until, timeout=math.ceil(retry_after) + 1)
+
+    # Requests
+
+    def send(self, client_id: Optional[str], key: Any, send: Callable[[], Any]) -> Any:
+        """
+        Run `send` (returning a requests.Response) within the budget of `client_id`.
+
+        Concurrent calls with the same `key` (not None) share one response.
+        """
+        if key is None:
+            return self._send(client_id or "default", send)
+        response = self._flights.do(key, lambda: self._send_and_read(client_id or "default", send))
+        # Everyone gets their own copy, the session post-processes it
+        return copy.copy(response)
+
+    async def asend(self, client_id: Optional[str], key: Any, send: Callable[[], Awaitable[Any]]) -> Any:
+        """ send() for the async client, `send` returns an httpx.Response. """
+        if key is None:
+            return await self._asend(client_id or "default", send)
+        return await self._flights.ado(key, lambda: self._asend(client_id or "default", send))
+
+    def _send_and_read(self, client_id: str, send: Callable[[], Any]) -> Any:
+        response = self._send(client_id, send)
+        # Read the body now, copies of a consumed response are complete
+        response.content
+        return response
+
+    def _send(self, client_id: str, send: Callable[[], Any]) -> Any:
+        deadline = time.monotonic() + settings.SPOTIFY_RATE_LIMIT_MAX_WAIT
+        rate_limited = 0
+        while True:
+            wait = self.reserve(client_id)
+            if wait > 0:
+                with self._queued(wait, deadline):
+                    time.sleep(wait)
+                continue
+
+            response = send()
+            retry_after = self._retry_after(response)
+            if retry_after is None:
+                return response
+            response.close()
+            rate_limited = self._rate_limited(client_id, retry_after, rate_limited)
+
+    async def _asend(self, client_id: str, send: Callable[[], Awaitable[Any]]) -> Any:
+        deadline = time.monotonic() + settings.SPOTIFY_RATE_LIMIT_MAX_WAIT
+        rate_limited = 0
+        while True:
+            # Nearly always a cache hit, the cache client may block though
+            wait = await sync_to_async(self.reserve, thread_sensitive=False)(client_id)
+            if wait > 0:
+                with self._queued(wait, deadline):
+                    await asyncio.sleep(wait)
+                continue
+
+            response = await send()
+            retry_after = self._retry_after(response)
+            if retry_after is None:
+                return response
+            rate_limited = await sync_to_async(self._rate_limited, thread_sensitive=False)(
+                client_id, retry_after, rate_limited
+            )
+
+    def _rate_limited(self, client_id: str, retry_after: float, rate_limited: int) -> int:
+        SPOTIFY_SCHEDULER.labels("rate_limited").inc()
+        self.block(client_id, retry_after)
+        rate_limited += 1
+        if rate_limited > settings.SPOTIFY_HTTP_RETRIES:
+            SPOTIFY_SCHEDULER.labels("shed").inc()
+            raise SpotifyRateLimited(retry_after)
+        return rate_limited
+
+    @contextmanager
+    def _queued(self, wait: float, deadline: float) -> Iterator[None]:
+        with self._lock:
+            shed = (
+                time.monotonic() + wait > deadline
+                or self._waiting >= settings.SPOTIFY_RATE_LIMIT_QUEUE_SIZE
+            )
+            if not shed:
+                self._waiting += 1
+        if shed:
+            SPOTIFY_SCHEDULER.labels("shed").inc()
+            raise SpotifyRateLimited(wait)
+
+        SPOTIFY_SCHEDULER.labels("queued").inc()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    @staticmethod
+    def _retry_after(response: Any) -> Optional[float]:
+        """ Seconds to wait when `response` is a 429, None otherwise. """
+        if response.status_code != 429:
+            return None
+        try:
+            return max(float(response.headers.get("Retry-After", 1)), 0.0)
+        except ValueError:
+            return 1.0
+
+    @staticmethod
+    def _key(client_id: str, name: str) -> str:
+        return f"spotify:rate_limit:{client_id}:{name}"
+
+    @staticmethod
+    def coalescing_key(method: str, url: str, authorization: Optional[str]) -> Optional[Tuple[str, str]]:
+        """ Only GETs, for the same token, are answered with someone else's response. """
+        if method != "GET":
+            return None
+        return url, authorization or ""
+
+
+spotify_scheduler = SpotifyScheduler()
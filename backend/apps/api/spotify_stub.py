@@ -0,0 +1,375 @@
+import copy
+import json
+import random
+import re
+import threading
+import time
+
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from django.conf import settings
+from django.test import override_settings
+
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures" / "spotify"
+
+ROUTES = (
+    ("GET", re.compile(r"^/v1/playlists/(?P<playlist_id>[^/]+)$"), "playlist"),
+    ("GET", re.compile(r"^/v1/playlists/(?P<playlist_id>[^/]+)/tracks$"), "playlist_items"),
+    ("GET", re.compile(r"^/v1/me/playlists$"), "current_user_playlists"),
+    ("GET", re.compile(r"^/v1/audio-features/?$"), "audio_features"),
+    ("GET", re.compile(r"^/v1/artists/?$"), "artists"),
+    ("GET", re.compile(r"^/v1/albums/?$"), "albums"),
+    ("POST", re.compile(r"^/api/token$"), "token"),
+)
+
+# Most ids the multi-id endpoints accept in one request
+MAX_IDS = {"audio_features": 100, "artists": 50, "albums": 20}
+
+GENRES = ("indie folk", "dream pop", "chamber pop", "synthwave", "shoegaze", "alt country", "post-rock", "lo-fi")
+
+
+class SpotifyStub:
+    """
+    Local stand-in for api.spotify.com and accounts.spotify.com.
+
+    Serves the recorded fixtures for every playlist id, paginated like
+    Spotify, and made-up catalog data (audio features, artists, albums) of
+    their tracks, after a configurable latency, and fails a configurable share
+    of requests with 5xx or 429 + Retry-After. Point SPOTIFY_API_URL and
+    SPOTIFY_ACCOUNTS_URL at it (override_settings() or SPOTIFY_STUB_URL).
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: int = 1,
+        tracks: Optional[int] = None,
+        seed: Optional[int] = None,
+        fixtures_dir: Optional[str] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+        fixtures = Path(fixtures_dir or getattr(settings, "SPOTIFY_STUB_FIXTURES_DIR", None) or FIXTURES_DIR)
+        self.playlist_fixture = self._load(fixtures / "playlist.json")
+        self.user_playlists = self._load(fixtures / "user_playlists.json")["items"]
+        recorded = self._load(fixtures / "playlist_tracks.json")["items"]
+        self.tracks = self._repeat(recorded, len(recorded) if tracks is None else tracks)
+        self.snapshot_id = self.playlist_fixture["snapshot_id"]
+        self.track_ids = {item["track"]["id"] for item in self.tracks}
+        self.artists = {artist["id"]: artist for item in recorded for artist in item["track"]["artists"]}
+        self.albums = {item["track"]["album"]["id"]: item["track"]["album"] for item in recorded}
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._failures: Deque[Tuple[int, Optional[int]]] = deque()
+        self._stats = {"connections": 0, "requests": Counter(), "statuses": Counter()}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # Server lifecycle
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "SpotifyStub":
+        """ Serve from a background thread, port 0 picks a free one. """
+        self.bind(host, port)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def bind(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        return self._server
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "SpotifyStub":
+        return self.start() if self._server is None else self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}v1/"
+
+    @property
+    def accounts_url(self) -> str:
+        return self.url
+
+    def override_settings(self, **kwargs) -> override_settings:
+        return override_settings(SPOTIFY_API_URL=self.api_url, SPOTIFY_ACCOUNTS_URL=self.accounts_url, **kwargs)
+
+    # Fault injection and stats
+
+    def fail(self, status: int, times: int = 1, retry_after: Optional[int] = None) -> None:
+        """ Answer the next `times` requests with `status`, whatever the rates. """
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * times)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "connections": self._stats["connections"],
+                "requests": dict(self._stats["requests"]),
+                "statuses": dict(self._stats["statuses"]),
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {"connections": 0, "requests": Counter(), "statuses": Counter()}
+
+    def _count(self, stat: str, key: Any = None) -> None:
+        with self._lock:
+            if key is None:
+                self._stats[stat] += 1
+            else:
+                self._stats[stat][key] += 1
+
+    def _next_failure(self) -> Optional[Tuple[int, Optional[int]]]:
+        with self._lock:
+            if self._failures:
+                return self._failures.popleft()
+            draw = self._random.random()
+            if draw < self.rate_limit_rate:
+                return 429, self.retry_after
+            if draw < self.rate_limit_rate + self.error_rate:
+                return self._random.choice((500, 502, 503)), None
+            return None
+
+    def _delay(self) -> float:
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    # Responses
+
+    def respond(self, method: str, path: str, query: Dict[str, str], form: Dict[str, str], base_url: str):
+        """ Status code, headers and JSON body answering a request. """
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                break
+        else:
+            self._count("requests", "not_found")
+            return 404, {}, _error(404, "Service not found")
+
+        self._count("requests", name)
+        delay = self._delay()
+        if delay:
+            time.sleep(delay)
+
+        failure = self._next_failure()
+        if failure is not None:
+            status, retry_after = failure
+            headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+            return status, headers, _error(status, "API rate limit exceeded" if status == 429 else "Server error")
+
+        if name == "token":
+            return self.token(form)
+        if name == "playlist":
+            return self.playlist(match["playlist_id"], base_url)
+        if name == "playlist_items":
+            return self.page(
+                self.tracks,
+                f"{base_url}v1/playlists/{match['playlist_id']}/tracks",
+                query,
+            )
+        if name in MAX_IDS:
+            return self.several(name, query)
+        return self.page(self.user_playlists, f"{base_url}v1/me/playlists", query, default_limit=20, max_limit=50)
+
+    def token(self, form: Dict[str, str]):
+        grant_type = form.get("grant_type")
+        token_info = {
+            "access_token": f"stub-{grant_type}-{self._random.getrandbits(64):016x}",
+            "token_type": "Bearer",
+            "expires_in": 3600,
+        }
+        if grant_type == "client_credentials":
+            return 200, {}, token_info
+        if grant_type in ("authorization_code", "refresh_token"):
+            token_info["scope"] = "user-library-read user-read-private playlist-read-private user-read-email"
+            if grant_type == "authorization_code":
+                token_info["refresh_token"] = f"stub-refresh-{self._random.getrandbits(64):016x}"
+            return 200, {}, token_info
+        return 400, {}, {"error": "unsupported_grant_type", "error_description": f"grant_type: {grant_type}"}
+
+    def playlist(self, playlist_id: str, base_url: str):
+        playlist = copy.deepcopy(self.playlist_fixture)
+        playlist["id"] = playlist_id
+        playlist["snapshot_id"] = self.snapshot_id
+        playlist["tracks"] = self.page(self.tracks, f"{base_url}v1/playlists/{playlist_id}/tracks", {})[2]
+        return 200, {}, playlist
+
+    def several(self, name: str, query: Dict[str, str]):
+        """ Multi-id endpoints, null for unknown ids like Spotify. """
+        ids = [id for id in query.get("ids", "").split(",") if id]
+        if not 0 < len(ids) <= MAX_IDS[name]:
+            return 400, {}, _error(400, "Invalid ids")
+        if name == "audio_features":
+            return 200, {}, {name: [self._audio_features(id) if id in self.track_ids else None for id in ids]}
+        if name == "artists":
+            return 200, {}, {name: [self._artist(self.artists[id]) if id in self.artists else None for id in ids]}
+        return 200, {}, {name: [self._album(self.albums[id]) if id in self.albums else None for id in ids]}
+
+    @staticmethod
+    def _audio_features(track_id: str) -> Dict[str, Any]:
+        # Seeded by the id, a track always gets the same features
+        draw = random.Random(track_id)
+        return {
+            "id": track_id,
+            "type": "audio_features",
+            "uri": f"spotify:track:{track_id}",
+            "danceability": round(draw.random(), 3),
+            "energy": round(draw.random(), 3),
+            "key": draw.randrange(12),
+            "loudness": round(draw.uniform(-20, 0), 3),
+            "mode": draw.randrange(2),
+            "speechiness": round(draw.random() / 4, 4),
+            "acousticness": round(draw.random(), 4),
+            "instrumentalness": round(draw.random(), 4),
+            "liveness": round(draw.random() / 2, 4),
+            "valence": round(draw.random(), 3),
+            "tempo": round(draw.uniform(60, 180), 3),
+            "time_signature": draw.choice((3, 4, 4, 4)),
+        }
+
+    @staticmethod
+    def _artist(artist: Dict[str, Any]) -> Dict[str, Any]:
+        draw = random.Random(artist["id"])
+        return {
+            **artist,
+            "genres": draw.sample(GENRES, draw.randint(1, 3)),
+            "popularity": draw.randrange(100),
+            "followers": {"href": None, "total": draw.randrange(1000000)},
+            "images": [],
+        }
+
+    @staticmethod
+    def _album(album: Dict[str, Any]) -> Dict[str, Any]:
+        draw = random.Random(album["id"])
+        album = {key: value for key, value in album.items() if key != "available_markets"}
+        return {
+            **album,
+            "genres": [],
+            "label": draw.choice(("Lowland Records", "Harbour Sound", "Self-released")),
+            "popularity": draw.randrange(100),
+            "copyrights": [],
+        }
+
+    @staticmethod
+    def page(
+        items: List[Any],
+        href: str,
+        query: Dict[str, str],
+        default_limit: int = 100,
+        max_limit: int = 100,
+    ):
+        try:
+            limit = int(query.get("limit", default_limit))
+            offset = int(query.get("offset", 0))
+        except ValueError:
+            return 400, {}, _error(400, "Invalid limit or offset")
+        if not 0 < limit <= max_limit or offset < 0:
+            return 400, {}, _error(400, "Invalid limit")
+
+        def link(page_offset: int) -> str:
+            return f"{href}?{urlencode({'offset': page_offset, 'limit': limit})}"
+
+        end = offset + limit
+        return 200, {}, {
+            "href": link(offset),
+            "items": items[offset:end],
+            "limit": limit,
+            "next": link(end) if end < len(items) else None,
+            "offset": offset,
+            "previous": link(max(offset - limit, 0)) if offset > 0 else None,
+            "total": len(items),
+        }
+
+    @staticmethod
+    def _load(path: Path) -> Dict[str, Any]:
+        with open(path) as fixture:
+            return json.load(fixture)
+
+    @staticmethod
+    def _repeat(recorded: List[Dict[str, Any]], total: int) -> List[Dict[str, Any]]:
+        # Longer playlists cycle through the recorded tracks under new ids
+        tracks = []
+        for index in range(total):
+            item = recorded[index % len(recorded)]
+            if index >= len(recorded):
+                track = item["track"]
+                item = {**item, "track": {**track, "id": f"{track['id'][:14]}{index:08d}"}}
+            tracks.append(item)
+        return tracks
+
+
+def _error(status: int, message: str) -> Dict[str, Any]:
+    return {"error": {"status": status, "message": message}}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """ Keep-alive HTTP/1.1 handler delegating every request to the server's SpotifyStub. """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stub._count("connections")
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        self._handle({key: values[-1] for key, values in parse_qs(body).items()})
+
+    def _handle(self, form: Dict[str, str]):
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path.startswith("/v1/") and not self.headers.get("Authorization"):
+            status, headers, body = 401, {}, _error(401, "No token provided")
+        else:
+            status, headers, body = stub.respond(
+                self.command,
+                url.path,
+                query,
+                form,
+                f"http://{self.headers.get('Host', '%s:%s' % self.server.server_address[:2])}/",
+            )
+        stub._count("statuses", status)
+
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
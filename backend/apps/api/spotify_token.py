@@ -0,0 +1,207 @@
+import threading
+import time
+
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from apps.api.metrics import CACHE_REQUESTS, SPOTIFY_TOKEN_REFRESHES
+from apps.api.spotify_client import SpotifyClient
+from apps.models import User
+
+
+class AppTokenProvider:
+    """
+    Client-credentials token shared by every request and worker through Django's cache.
+
+    Used as a spotipy auth manager. A token close to expiry is refreshed by a
+    single caller (thread lock inside a worker, cache lock across workers)
+    while the others keep using the still valid one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0}
+
+    def get_access_token(self, as_dict: bool = False, check_cache: bool = True) -> str:
+        token_info = cache.get(self._cache_key()) if check_cache else None
+
+        if self._is_valid(token_info):
+            self._count("hits")
+            if self._is_expiring(token_info):
+                self._refresh(blocking=False)
+        else:
+            self._count("misses")
+            token_info = self._refresh(blocking=True)
+
+        return token_info if as_dict else token_info["access_token"]
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def _refresh(self, blocking: bool) -> Optional[Dict[str, Any]]:
+        if not self._lock.acquire(blocking=blocking):
+            return None
+        try:
+            # Another thread or worker may have refreshed while we waited
+            token_info = cache.get(self._cache_key())
+            if self._is_valid(token_info) and (blocking or not self._is_expiring(token_info)):
+                return token_info
+
+            lock_key = f"{self._cache_key()}:lock"
+            if cache.add(lock_key, True, timeout=settings.SPOTIFY_HTTP_TIMEOUT * 2):
+                try:
+                    return self._request_token()
+                finally:
+                    cache.delete(lock_key)
+
+            if not blocking:
+                return None
+            return self._wait_for_token() or self._request_token()
+        finally:
+            self._lock.release()
+
+    def _wait_for_token(self) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + settings.SPOTIFY_HTTP_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            token_info = cache.get(self._cache_key())
+            if self._is_valid(token_info):
+                return token_info
+        return None
+
+    def _request_token(self) -> Dict[str, Any]:
+        res = SpotifyClient.post(
+            SpotifyClient.accounts_url("api/token"),
+            data={"grant_type": "client_credentials"},
+            auth=(settings.SPOTIFY_USER_CLIENT_ID, settings.SPOTIFY_USER_CLIENT_SECRET),
+        )
+        res.raise_for_status()
+        res_data = res.json()
+
+        token_info = {
+            "access_token": res_data["access_token"],
+            "expires_at": time.time() + res_data["expires_in"],
+        }
+        cache.set(self._cache_key(), token_info, timeout=res_data["expires_in"])
+        self._count("refreshes")
+        SPOTIFY_TOKEN_REFRESHES.labels("app").inc()
+        return token_info
+
+    def _count(self, stat: str) -> None:
+        with self._stats_lock:
+            self._stats[stat] += 1
+        if stat != "refreshes":
+            CACHE_REQUESTS.labels("app_token", stat).inc()
+
+    @staticmethod
+    def _cache_key() -> str:
+        return f"spotify:app_token:{settings.SPOTIFY_USER_CLIENT_ID}"
+
+    @staticmethod
+    def _is_valid(token_info: Optional[Dict[str, Any]]) -> bool:
+        return token_info is not None and token_info["expires_at"] > time.time()
+
+    @staticmethod
+    def _is_expiring(token_info: Dict[str, Any]) -> bool:
+        return token_info["expires_at"] - time.time() <= settings.SPOTIFY_TOKEN_REFRESH_MARGIN
+
+
+app_token = AppTokenProvider()
+
+
+class UserTokenRefresher:
+    """
+    Single-flight refresh of users' Spotify access tokens.
+
+    Inside a worker, concurrent requests for the same user wait on the
+    refresh started by the first one. Across workers the user row is locked
+    while refreshing, so a worker that got the lock second finds the new
+    token in DB instead of asking Spotify again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[int, Future] = {}
+
+    @staticmethod
+    def is_expiring(token_expiration_date: Optional[datetime], margin: Optional[int] = None) -> bool:
+        if token_expiration_date is None:
+            return True
+        if margin is None:
+            margin = settings.SPOTIFY_USER_TOKEN_REFRESH_MARGIN
+        return token_expiration_date - timedelta(seconds=margin) <= timezone.now()
+
+    def refresh(self, user: User, margin: Optional[int] = None) -> str:
+        with self._lock:
+            future = self._inflight.get(user.pk)
+            leader = future is None
+            if leader:
+                future = self._inflight[user.pk] = Future()
+
+        if not leader:
+            access_token, refresh_token, expires_at = future.result(
+                timeout=settings.SPOTIFY_HTTP_TIMEOUT * (settings.SPOTIFY_HTTP_RETRIES + 1)
+            )
+        else:
+            try:
+                access_token, refresh_token, expires_at = self._refresh_locked(user.pk, margin)
+                future.set_result((access_token, refresh_token, expires_at))
+            except Exception as error:
+                future.set_exception(error)
+                raise
+            finally:
+                with self._lock:
+                    del self._inflight[user.pk]
+
+        user.spotify_access_token = access_token
+        user.spotify_refresh_token = refresh_token
+        user.spotify_token_expires_at = expires_at
+        return access_token
+
+    def _refresh_locked(self, user_id: int, margin: Optional[int]):
+        with transaction.atomic():
+            user = User.objects.select_for_update().only(
+                "spotify_access_token",
+                "spotify_refresh_token",
+                "spotify_token_expires_at",
+            ).get(pk=user_id)
+
+            # Refreshed by another worker while we waited for the row lock
+            if not self.is_expiring(user.spotify_token_expires_at, margin):
+                return user.spotify_access_token, user.spotify_refresh_token, user.spotify_token_expires_at
+
+            res = SpotifyClient.post(
+                SpotifyClient.accounts_url("api/token"),
+                data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": user.spotify_refresh_token,
+                },
+                auth=(settings.SPOTIFY_APP_CLIENT_ID, settings.SPOTIFY_APP_CLIENT_SECRET),
+            )
+            res.raise_for_status()
+            res_data = res.json()
+            SPOTIFY_TOKEN_REFRESHES.labels("user").inc()
+
+            # Update User token infos in DB
+            user.spotify_access_token = res_data["access_token"]
+            # Spotify may rotate the refresh token, the previous one is revoked then
+            user.spotify_refresh_token = res_data.get("refresh_token", user.spotify_refresh_token)
+            user.spotify_token_expires_at = timezone.now() + timedelta(seconds=res_data["expires_in"])
+            user.save(update_fields=['spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at'])
+
+        return user.spotify_access_token, user.spotify_refresh_token, user.spotify_token_expires_at
+
+
+user_tokens = UserTokenRefresher()
@@ -0,0 +1,21 @@
+import re
+
+from functools import lru_cache
+from typing import Iterable, List
+
+
+# One pass of what used to be three re.sub calls: drop every (...) or [...]
+# group, then everything from the first "-" or "|" left outside of them.
+# Groups are tried first so a "-" inside brackets never cuts the title.
+TITLE_NOISE = re.compile(r"[\(\[].*?[\)\]]|[-|].*")
+
+
+@lru_cache(maxsize=8192)
+def normalize_title(title: str) -> str:
+    """ Clean a track title, "Song [Live]" becomes "Song ". """
+    return TITLE_NOISE.sub("", title)
+
+
+def normalize_titles(titles: Iterable[str]) -> List[str]:
+    """ Normalize a whole page of titles. """
+    return [normalize_title(title) for title in titles]
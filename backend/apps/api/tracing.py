@@ -0,0 +1,137 @@
+import json
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    """
+    Where the time of one GraphQL operation went: phases of the view,
+    resolvers (per Type.field), DB queries and outbound HTTP requests.
+
+    Resolvers of fetch-all run in threads, counters are guarded by a lock.
+    """
+
+    def __init__(self, operation_name: Optional[str]):
+        self.operation_name = operation_name
+        self.start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self._open_phases: Dict[str, float] = {}
+        self.resolvers: Dict[str, list] = {}
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.http_requests = 0
+        self.http_time = 0.0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = self._open_phases[name] = time.perf_counter()
+        try:
+            yield
+        finally:
+            del self._open_phases[name]
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def add_resolver(self, path: str, duration: float) -> None:
+        with self._lock:
+            stat = self.resolvers.get(path)
+            if stat is None:
+                self.resolvers[path] = [1, duration]
+            else:
+                stat[0] += 1
+                stat[1] += duration
+
+    def add_db_query(self, duration: float) -> None:
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += duration
+
+    def add_http_request(self, duration: float) -> None:
+        with self._lock:
+            self.http_requests += 1
+            self.http_time += duration
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.start
+
+    def as_dict(self) -> Dict[str, Any]:
+        # Also called while running, for the response extensions
+        now = time.perf_counter()
+        phases = dict(self.phases)
+        for name, start in self._open_phases.items():
+            phases[name] = phases.get(name, 0.0) + now - start
+
+        with self._lock:
+            resolvers = sorted(self.resolvers.items(), key=lambda item: item[1][1], reverse=True)
+            return {
+                "operation": self.operation_name,
+                "duration_ms": _ms(self.duration if self.duration is not None else now - self.start),
+                "phases": {name: _ms(duration) for name, duration in phases.items()},
+                "db": {"queries": self.db_queries, "time_ms": _ms(self.db_time)},
+                "http": {"requests": self.http_requests, "time_ms": _ms(self.http_time)},
+                "resolvers": {
+                    path: {"count": count, "time_ms": _ms(duration)}
+                    for path, (count, duration) in resolvers
+                },
+            }
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("graphql_trace", default=None)
+
+
+@contextmanager
+def trace_operation(operation_name: Optional[str]) -> Iterator[Trace]:
+    """ Trace the operation run inside the block and log its summary. """
+    trace = Trace(operation_name)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        trace.finish()
+        summary = trace.as_dict()
+        logger.info("graphql_trace %s", json.dumps(summary), extra={"graphql_trace": summary})
+
+
+def record_db_query(execute, sql, params, many, context):
+    """ Execute wrapper installed on every DB connection, a no-op outside of a trace. """
+    trace = current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_db_query(time.perf_counter() - start)
+
+
+def install_db_tracing(sender, connection, **kwargs) -> None:
+    """ connection_created receiver. """
+    if record_db_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_db_query)
+
+
+@contextmanager
+def traced_http_request() -> Iterator[None]:
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_http_request(time.perf_counter() - start)
@@ -0,0 +1,42 @@
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from apps.api.titles import normalize_title
+
+
+class Track(NamedTuple):
+    """ Parsed Spotify track, resolved as is by graphene's TrackData. """
+    id: str
+    artist: str
+    title: str
+    link: str
+    cover: str
+    preview: Optional[str]
+    # Keys of the catalog data batched by apps.api.spotify_loaders
+    artist_ids: Tuple[str, ...] = ()
+    album_id: Optional[str] = None
+
+
+def parse_tracks(
+    songs: Iterable[Dict[str, Any]],
+    skip_empty: bool = False,
+) -> List[Track]:
+    """ Parse the items of a Spotify playlist tracks page. """
+    tracks = []
+    append = tracks.append
+    for song in songs:
+        track = song['track']
+        # Local files and unavailable tracks have no duration
+        if skip_empty and track['duration_ms'] == 0:
+            continue
+        append(Track(
+            track['id'],
+            track['artists'][0]['name'],
+            normalize_title(track['name']),
+            track['external_urls']['spotify'],
+            track['album']['images'][0]["url"],
+            track['preview_url'],
+            # Pages cached before ids were requested have none
+            tuple(artist['id'] for artist in track['artists'] if artist.get('id')),
+            track['album'].get('id'),
+        ))
+    return tracks
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class AppsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps'
+
+    def ready(self):
+        from apps.api.tracing import install_db_tracing
+
+        connection_created.connect(install_db_tracing, dispatch_uid="apps.api.tracing")
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import statistics
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory
+
+from apps.api.spotify_async import AsyncSpotifyAPI, AsyncSpotifyClient
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_token import app_token
+from backend.schema import async_schema
+from backend.views import AdminOnlyGraphiQLView, AsyncGraphQLView
+
+
+QUERY = """
+query specificPlaylistData($playlistId: String, $offset: Int){
+    specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+        success
+        playlist { playlistName }
+        tracks { id title }
+        lastPage
+    }
+}
+"""
+
+
+def _playlist(playlist_id: str) -> Dict[str, Any]:
+    return {
+        "name": playlist_id,
+        "description": "",
+        "external_urls": {"spotify": ""},
+        "owner": {"display_name": "bench", "external_urls": {"spotify": ""}},
+        "snapshot_id": "bench",
+    }
+
+
+def _items(limit: int, offset: int) -> Dict[str, Any]:
+    return {
+        "items": [
+            {"track": {
+                "id": str(index),
+                "name": f"Track {index} (feat. Someone)",
+                "duration_ms": 1000,
+                "preview_url": None,
+                "external_urls": {"spotify": ""},
+                "artists": [{"name": "Artist"}],
+                "album": {"images": [{"url": ""}]},
+            }}
+            for index in range(offset, offset + limit)
+        ],
+        "next": "next",
+        "total": 1000,
+    }
+
+
+class _SlowSpotify:
+    """ Fake spotipy client blocking its thread for the upstream latency. """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def playlist(self, playlist_id, **kwargs):
+        time.sleep(self.latency)
+        return _playlist(playlist_id)
+
+    def playlist_items(self, playlist_id, limit=100, offset=0, **kwargs):
+        time.sleep(self.latency)
+        return _items(limit, offset)
+
+
+class _AsyncSlowSpotify:
+    """ Fake AsyncSpotify yielding to the event loop for the upstream latency. """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def playlist(self, playlist_id, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _playlist(playlist_id)
+
+    async def playlist_items(self, playlist_id, limit=100, offset=0, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _items(limit, offset)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test specificPlaylistData through the sync (WSGI) and async (ASGI) "
+        "GraphQL views against a simulated slow Spotify API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--latency-ms", type=float, default=200)
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=8,
+            help="Request threads of the WSGI deployment (gunicorn workers x threads)",
+        )
+
+    def handle(self, *args, **options):
+        latency = options["latency_ms"] / 1000
+
+        with mock.patch.object(app_token, "get_access_token", return_value="bench"), \
+                mock.patch.object(SpotifyClient, "api", return_value=_SlowSpotify(latency)):
+            cache.clear()
+            wsgi = self.run_wsgi(options["requests"], options["threads"])
+
+        with mock.patch.object(AsyncSpotifyAPI, "_app_token", new=mock.AsyncMock(return_value="bench")), \
+                mock.patch.object(AsyncSpotifyClient, "api", return_value=_AsyncSlowSpotify(latency)):
+            cache.clear()
+            asgi = asyncio.run(self.run_asgi(options["requests"], options["concurrency"]))
+
+        for name, (elapsed, latencies) in (("wsgi", wsgi), ("asgi", asgi)):
+            self.report(name, elapsed, latencies, options["requests"])
+        self.stdout.write(f"speedup: x{wsgi[0] / asgi[0]:.1f}")
+
+    def run_wsgi(self, requests: int, threads: int):
+        view = AdminOnlyGraphiQLView.as_view()
+        factory = RequestFactory()
+
+        def send(index: int) -> float:
+            request = factory.post("/graphql/", data=self.body(index), content_type="application/json")
+            request.user = AnonymousUser()
+            start = time.perf_counter()
+            response = view(request)
+            assert response.status_code == 200, response.content
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = list(executor.map(send, range(requests)))
+        return time.perf_counter() - start, latencies
+
+    async def run_asgi(self, requests: int, concurrency: int):
+        view = AsyncGraphQLView.as_view(schema=async_schema)
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(index: int) -> float:
+            request = factory.post("/graphql/", data=self.body(index), content_type="application/json")
+            request.user = AnonymousUser()
+            async with semaphore:
+                start = time.perf_counter()
+                response = await view(request)
+            assert response.status_code == 200, response.content
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(send(index) for index in range(requests)))
+        return time.perf_counter() - start, latencies
+
+    @staticmethod
+    def body(index: int) -> str:
+        # One playlist per request so that every request reaches "Spotify"
+        return json.dumps({"query": QUERY, "variables": {"playlistId": f"bench{index}", "offset": 0}})
+
+    def report(self, name: str, elapsed: float, latencies: List[float], requests: int) -> None:
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f"{name}: {requests / elapsed:7.1f} req/s, "
+            f"p50 {statistics.median(latencies) * 1000:6.0f}ms, p95 {p95 * 1000:6.0f}ms"
+        )
@@ -0,0 +1,81 @@
+import time
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_client import SpotifyClient
+
+
+class _SlowSpotify:
+    """ Fake spotipy client answering after a fixed upstream latency. """
+
+    def __init__(self, total: int, latency: float):
+        self.total = total
+        self.latency = latency
+
+    def playlist(self, playlist_id, **kwargs):
+        time.sleep(self.latency)
+        return {
+            "name": "Bench",
+            "description": "",
+            "external_urls": {"spotify": ""},
+            "owner": {"display_name": "bench", "external_urls": {"spotify": ""}},
+            "snapshot_id": "bench",
+        }
+
+    def playlist_items(self, playlist_id, limit=100, offset=0, **kwargs):
+        time.sleep(self.latency)
+        end = min(offset + limit, self.total)
+        return {
+            "items": [
+                {"track": {
+                    "id": str(index),
+                    "name": f"Track {index} (feat. Someone) - Remix",
+                    "duration_ms": 1000,
+                    "preview_url": None,
+                    "external_urls": {"spotify": ""},
+                    "artists": [{"name": "Artist"}],
+                    "album": {"images": [{"url": ""}]},
+                }}
+                for index in range(offset, end)
+            ],
+            "next": "next" if end < self.total else None,
+            "total": self.total,
+        }
+
+
+class Command(BaseCommand):
+    help = "Compare loading a whole playlist page by page with the concurrent fetch-all mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tracks", type=int, default=500)
+        parser.add_argument("--latency-ms", type=float, default=100)
+
+    def handle(self, *args, **options):
+        spotify = _SlowSpotify(options["tracks"], options["latency_ms"] / 1000)
+
+        with mock.patch.object(SpotifyClient, "api", return_value=spotify):
+            cache.clear()
+            start = time.perf_counter()
+            offset, pages, tracks = 0, 0, 0
+            while True:
+                # What the frontend does today: one query per 20 tracks
+                playlist = SpotifyAPI.get_playlist_data(playlist_id="bench", offset=offset, context=None)
+                tracks += len(playlist["tracks"])
+                pages += 1
+                offset += 20
+                if playlist["last_page"]:
+                    break
+            paged = time.perf_counter() - start
+
+            cache.clear()
+            start = time.perf_counter()
+            playlist = SpotifyAPI.get_full_playlist_data(playlist_id="bench", context=None)
+            full = time.perf_counter() - start
+
+        self.stdout.write(f"   paged: {tracks} tracks in {pages} queries, {paged * 1000:.0f}ms")
+        self.stdout.write(f"fetch-all: {len(playlist['tracks'])} tracks in 1 query, {full * 1000:.0f}ms")
+        self.stdout.write(f" speedup: x{paged / full:.1f}")
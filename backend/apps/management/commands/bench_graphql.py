@@ -0,0 +1,318 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import django
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphene_django.settings import graphene_settings
+from graphene_django.views import instantiate_middleware
+from graphql_jwt.shortcuts import get_token
+
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.models import User
+from backend.schema import schema
+
+
+BENCH_PASSWORD = "bench_password"
+
+
+class Operation(NamedTuple):
+    query: str
+    variables: Callable[[int], Dict[str, Any]]
+    authenticated: bool = False
+
+
+OPERATIONS = {
+    "whoami": Operation(
+        """
+        query whoami {
+            whoami { id username email hasSpotifyToken isAccessTokenExpired }
+        }
+        """,
+        lambda index: {},
+        authenticated=True,
+    ),
+    "users": Operation(
+        """
+        query users {
+            users(first: 100) { edges { node { id username email spotifyTokenExpiresAt hasSpotifyToken } } }
+        }
+        """,
+        lambda index: {},
+    ),
+    "createUser": Operation(
+        """
+        mutation createUser($email: String, $username: String, $password: String) {
+            createUser(email: $email, username: $username, password: $password) {
+                success token refreshToken details
+            }
+        }
+        """,
+        lambda index: {
+            "email": f"create{index}@bench.local",
+            "username": f"create{index}",
+            "password": BENCH_PASSWORD,
+        },
+    ),
+    "loginUser": Operation(
+        """
+        mutation loginUser($username: String, $password: String) {
+            loginUser(username: $username, password: $password) {
+                success token refreshToken details
+            }
+        }
+        """,
+        lambda index: {"username": "bench", "password": BENCH_PASSWORD},
+    ),
+    "mySuggestions": Operation(
+        """
+        query mySuggestions($playlistId: String, $offset: Int) {
+            mySuggestions(playlistId: $playlistId, offset: $offset) {
+                success tracks { id artist title link cover preview } lastPage
+            }
+        }
+        """,
+        lambda index: {"playlistId": "bench", "offset": index % 5 * 20},
+    ),
+    "specificPlaylistData": Operation(
+        """
+        query specificPlaylistData($playlistId: String, $offset: Int) {
+            specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+                success
+                playlist { playlistName playlistDescription playlistUrl ownerName ownerUrl }
+                tracks { id artist title link cover preview }
+                lastPage
+            }
+        }
+        """,
+        lambda index: {"playlistId": "bench", "offset": index % 5 * 20},
+    ),
+    "userPlaylistsData": Operation(
+        """
+        query userPlaylistsData($offset: Int) {
+            userPlaylistsData(offset: $offset) {
+                success details owner { id name href } playlists { id name description href image } lastPage
+            }
+        }
+        """,
+        lambda index: {"offset": 0},
+        authenticated=True,
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark representative GraphQL operations through backend.schema against "
+        "a test database and the local Spotify stub: throughput, latency percentiles, "
+        "DB queries, allocations and Spotify calls per operation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=100)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--operations", nargs="+", choices=list(OPERATIONS), default=list(OPERATIONS))
+        parser.add_argument("--users", type=int, default=100, help="Users in the test database")
+        parser.add_argument("--latency-ms", type=float, default=0, help="Latency of the Spotify stub")
+        parser.add_argument(
+            "--cold-cache",
+            action="store_true",
+            help="Clear the cached Spotify responses and tokens before every operation",
+        )
+        parser.add_argument(
+            "--fast-hashing",
+            action="store_true",
+            help="Hash passwords with MD5 as in tests, PBKDF2 dominates createUser and loginUser otherwise",
+        )
+        parser.add_argument("--output", default=None, help="Write the JSON report to this file, - for stdout")
+
+    def handle(self, *args, **options):
+        hashers = ["django.contrib.auth.hashers.MD5PasswordHasher"] if options["fast_hashing"] else None
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        stub = SpotifyStub(latency=options["latency_ms"] / 1000, tracks=100, seed=0).start()
+        try:
+            with stub.override_settings(
+                SPOTIFY_USER_CLIENT_ID="bench",
+                SPOTIFY_USER_CLIENT_SECRET="bench",
+                SPOTIFY_RATE_LIMIT_REQUESTS=0,
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+                **({"PASSWORD_HASHERS": hashers} if hashers else {}),
+            ):
+                SpotifyClient.reset()
+                cache.clear()
+                user = self.create_users(options["users"])
+                results = {
+                    name: self.run(name, OPERATIONS[name], user, stub, options)
+                    for name in options["operations"]
+                }
+        finally:
+            stub.stop()
+            SpotifyClient.reset()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {"meta": self.meta(options), "operations": results}
+        if options["output"] == "-":
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_table(results)
+            if options["output"]:
+                with open(options["output"], "w") as output:
+                    json.dump(report, output, indent=2)
+                self.stdout.write(f"Report written to {options['output']}")
+
+    @staticmethod
+    def create_users(count: int) -> User:
+        expires_at = timezone.now() + timedelta(days=365)
+        User.objects.bulk_create([
+            User(
+                username=f"user{index}",
+                email=f"user{index}@bench.local",
+                spotify_access_token=f"access{index}",
+                spotify_refresh_token=f"refresh{index}",
+                spotify_token_expires_at=expires_at,
+            )
+            for index in range(count)
+        ])
+        user = User(
+            username="bench",
+            email="bench@bench.local",
+            accepted_account=True,
+            spotify_access_token="bench_access",
+            spotify_refresh_token="bench_refresh",
+            spotify_token_expires_at=expires_at,
+        )
+        user.set_password(BENCH_PASSWORD)
+        user.save()
+        return user
+
+    def run(self, name: str, operation: Operation, user: User, stub: SpotifyStub, options) -> Dict[str, Any]:
+        middleware = list(instantiate_middleware(graphene_settings.MIDDLEWARE))
+        token = get_token(user) if operation.authenticated else None
+        iterations = options["iterations"]
+        index = 0
+
+        def execute() -> None:
+            nonlocal index
+            if options["cold_cache"]:
+                self.clear_spotify_cache()
+            result = schema.execute(
+                operation.query,
+                variable_values=operation.variables(index),
+                context_value=self.request(token),
+                middleware=middleware,
+            )
+            index += 1
+            if result.errors:
+                raise CommandError(f"{name} failed: {result.errors[0]}")
+
+        for _ in range(options["warmup"]):
+            execute()
+
+        stub.reset_stats()
+        latencies = []
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                operation_start = time.perf_counter()
+                execute()
+                latencies.append(time.perf_counter() - operation_start)
+            elapsed = time.perf_counter() - start
+        spotify_requests = sum(stub.stats()["requests"].values())
+
+        # Separate pass, tracing allocations slows everything down
+        allocated = []
+        tracemalloc.start()
+        for _ in range(min(iterations, 20)):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            execute()
+            _, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - before)
+        tracemalloc.stop()
+
+        latencies.sort()
+        return {
+            "iterations": iterations,
+            "ops_per_second": iterations / elapsed,
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "p50_ms": self.percentile(latencies, 50) * 1000,
+            "p90_ms": self.percentile(latencies, 90) * 1000,
+            "p99_ms": self.percentile(latencies, 99) * 1000,
+            "max_ms": latencies[-1] * 1000,
+            "db_queries_per_op": len(queries) / iterations,
+            "db_time_ms_per_op": sum(float(query["time"]) for query in queries.captured_queries) * 1000 / iterations,
+            "spotify_requests_per_op": spotify_requests / iterations,
+            "peak_alloc_kib_per_op": statistics.mean(allocated) / 1024,
+        }
+
+    @staticmethod
+    def request(token: Optional[str]):
+        headers = {"HTTP_AUTHORIZATION": f"JWT {token}"} if token else {}
+        request = RequestFactory().post("/graphql/", **headers)
+        # loginUser opens a session
+        SessionMiddleware(lambda request: None).process_request(request)
+        request.user = AnonymousUser()
+        return request
+
+    @staticmethod
+    def clear_spotify_cache() -> None:
+        if playlist_cache.store.local is not None:
+            playlist_cache.store.local.clear()
+        cache.clear()
+
+    @staticmethod
+    def percentile(ordered: List[float], percent: float) -> float:
+        index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+        return ordered[index]
+
+    @staticmethod
+    def meta(options) -> Dict[str, Any]:
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "commit": commit,
+            "date": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "options": {
+                key: options[key]
+                for key in ("iterations", "warmup", "users", "latency_ms", "cold_cache", "fast_hashing")
+            },
+        }
+
+    def print_table(self, results: Dict[str, Dict[str, Any]]) -> None:
+        self.stdout.write(
+            f"{'operation':>22} {'ops/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+            f"{'queries':>8} {'spotify':>8} {'alloc KiB':>10}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:>22} {result['ops_per_second']:9.1f} {result['p50_ms']:8.2f} "
+                f"{result['p90_ms']:8.2f} {result['p99_ms']:8.2f} {result['db_queries_per_op']:8.1f} "
+                f"{result['spotify_requests_per_op']:8.1f} {result['peak_alloc_kib_per_op']:10.1f}"
+            )
@@ -0,0 +1,56 @@
+import json
+import time
+
+from typing import Callable
+
+from django.core.management.base import BaseCommand
+from graphql import parse, validate
+
+from apps.management.commands.bench_graphql import OPERATIONS
+from apps.schema.documents import VALIDATION_RULES, DocumentCache, query_hash
+from backend.schema import schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the parse and validation cost saved per request by the document cache, "
+        "and the request size saved by sending persisted queries as hashes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=2000)
+        parser.add_argument("--operations", nargs="+", choices=list(OPERATIONS), default=list(OPERATIONS))
+
+    def handle(self, *args, **options):
+        graphql_schema = schema.graphql_schema
+        iterations = options["iterations"]
+        documents = DocumentCache()
+
+        self.stdout.write(
+            f"{'operation':>22} {'parse us':>9} {'validate us':>12} {'cached us':>10} "
+            f"{'saved us':>9} {'body B':>7} {'hash body B':>12}"
+        )
+        for name in options["operations"]:
+            query = OPERATIONS[name].query
+            document = parse(query)
+            parse_us = self._measure(lambda: parse(query), iterations)
+            validate_us = self._measure(lambda: validate(graphql_schema, document, rules=VALIDATION_RULES), iterations)
+            documents.get(graphql_schema, query)
+            cached_us = self._measure(lambda: documents.get(graphql_schema, query), iterations)
+            # graphene-django parsed and validated in the view, then again in schema.execute()
+            saved_us = 2 * (parse_us + validate_us) - cached_us
+
+            persisted = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+            body = len(json.dumps({"query": query, "variables": {}, "operationName": name}))
+            hash_body = len(json.dumps({"extensions": persisted, "variables": {}, "operationName": name}))
+            self.stdout.write(
+                f"{name:>22} {parse_us:9.1f} {validate_us:12.1f} {cached_us:10.2f} "
+                f"{saved_us:9.1f} {body:7d} {hash_body:12d}"
+            )
+
+    @staticmethod
+    def _measure(call: Callable[[], object], iterations: int) -> float:
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            call()
+        return (time.perf_counter_ns() - start) / iterations / 1000
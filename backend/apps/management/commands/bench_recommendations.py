@@ -0,0 +1,184 @@
+import random
+import time
+import tracemalloc
+
+from itertools import accumulate
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_relay import offset_to_cursor
+
+from apps.api.recommendations import recommender
+from apps.models import Artist, Playlist, PlaylistTrack, Track, User
+from backend.schema import schema
+
+
+RECOMMENDED_TRACKS_QUERY = """
+    query recommendedTracks($first: Int, $after: String) {
+        recommendedTracks(first: $first, after: $after) {
+            pageInfo { hasNextPage endCursor }
+            edges { node { id title artist } }
+        }
+    }
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the recommendations batch job on a test database of made-up playlists, "
+        "tracks picked with a Zipf popularity, and the `recommendedTracks` windows it serves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="Playlist tracks in the test database")
+        parser.add_argument("--playlist-size", type=int, default=100)
+        parser.add_argument("--tracks", type=int, default=100_000)
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--library", type=int, default=3, help="Playlists in each user's library")
+        parser.add_argument("--first", type=int, default=20, help="Suggestions per window")
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            start = time.perf_counter()
+            self.create_catalog(options)
+            self.stdout.write(
+                f"{PlaylistTrack.objects.count()} playlist tracks, {Track.objects.count()} tracks, "
+                f"{options['users']} users created in {time.perf_counter() - start:.1f}s"
+            )
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @staticmethod
+    def create_catalog(options) -> None:
+        rand = random.Random(options["seed"])
+        batch_size = 5000
+        track_count = options["tracks"]
+        playlist_count = options["rows"] // options["playlist_size"]
+        now = timezone.now()
+
+        artists = Artist.objects.bulk_create(
+            (Artist(spotify_id=f"artist{index}", name=f"Artist {index}") for index in range(max(1, track_count // 10))),
+            batch_size=batch_size,
+        )
+        tracks = Track.objects.bulk_create(
+            (
+                Track(
+                    spotify_id=f"track{index}",
+                    name=f"Track {index}",
+                    title=f"Track {index}",
+                    artist=f"Artist {index % len(artists)}",
+                    link=f"https://open.spotify.com/track/track{index}",
+                    cover="https://i.scdn.co/image/bench",
+                )
+                for index in range(track_count)
+            ),
+            batch_size=batch_size,
+        )
+        Track.artists.through.objects.bulk_create(
+            (
+                Track.artists.through(track_id=track.pk, artist_id=artists[index % len(artists)].pk)
+                for index, track in enumerate(tracks)
+            ),
+            batch_size=batch_size,
+        )
+        playlists = Playlist.objects.bulk_create(
+            (
+                Playlist(
+                    spotify_id=f"playlist{index}",
+                    snapshot_id="bench",
+                    name=f"Playlist {index}",
+                    url=f"https://open.spotify.com/playlist/playlist{index}",
+                    total=options["playlist_size"],
+                    synced_at=now,
+                )
+                for index in range(playlist_count)
+            ),
+            batch_size=batch_size,
+        )
+
+        # A few tracks are in many playlists, most in a handful
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(track_count)))
+
+        def playlist_tracks(playlist: Playlist):
+            picked = {}
+            while len(picked) < options["playlist_size"]:
+                picked.update(dict.fromkeys(rand.choices(tracks, cum_weights=cum_weights, k=options["playlist_size"] - len(picked))))
+            for position, track in enumerate(picked):
+                yield PlaylistTrack(playlist_id=playlist.pk, position=position, track_id=track.pk)
+
+        PlaylistTrack.objects.bulk_create(
+            (row for playlist in playlists for row in playlist_tracks(playlist)),
+            batch_size=batch_size,
+        )
+        users = User.objects.bulk_create(
+            (
+                User(username=f"user{index}", email=f"user{index}@bench.local", password="!" + "x" * 87, accepted_account=True)
+                for index in range(options["users"])
+            ),
+            batch_size=batch_size,
+        )
+        Playlist.users.through.objects.bulk_create(
+            (
+                Playlist.users.through(user_id=user.pk, playlist_id=playlist.pk)
+                for user in users
+                for playlist in rand.sample(playlists, min(options["library"], len(playlists)))
+            ),
+            batch_size=batch_size,
+        )
+
+    def run(self, options) -> None:
+        first = options["first"]
+        user = User.objects.order_by("pk").first()
+        matrix = recommender.load()
+
+        self.stdout.write(f"{'case':>28} {'ms':>9} {'peak KiB':>10} {'queries':>8}")
+        self.report("load matrix", recommender.load, {**options, "iterations": 1})
+        self.report(
+            "score one user",
+            lambda: matrix.top(
+                Playlist.users.through.objects.filter(user=user).values_list("playlist_id", flat=True),
+                settings.RECOMMENDATIONS_TOP_K,
+                settings.RECOMMENDATIONS_NEIGHBOURS,
+                settings.RECOMMENDATIONS_ARTIST_WEIGHT,
+            ),
+            {**options, "iterations": 5},
+        )
+        self.report("refresh every user", recommender.refresh, {**options, "iterations": 1})
+        self.report("first window", lambda: self.window(user, first, None), options)
+        self.report("last window", lambda: self.window(user, first, offset_to_cursor(settings.RECOMMENDATIONS_TOP_K - first - 1)), options)
+
+    def report(self, case: str, call: Callable[[], object], options) -> None:
+        iterations = options["iterations"]
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                call()
+            elapsed = (time.perf_counter() - start) / iterations
+        tracemalloc.start()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f"{case:>28} {elapsed * 1000:9.2f} {peak / 1024:10.1f} {len(queries) / iterations:8.1f}"
+        )
+
+    @staticmethod
+    def window(user: User, first: int, after: Optional[str]) -> bool:
+        request = RequestFactory().post("/graphql/")
+        request.user = user
+        result = schema.execute(RECOMMENDED_TRACKS_QUERY, variable_values={"first": first, "after": after}, context_value=request)
+        if result.errors:
+            raise CommandError(f"recommendedTracks failed: {result.errors[0]}")
+        if not result.data["recommendedTracks"]["edges"]:
+            raise CommandError("recommendedTracks is empty")
+        return result.data["recommendedTracks"]["pageInfo"]["hasNextPage"]
@@ -0,0 +1,82 @@
+import threading
+import time
+import spotipy
+
+from typing import Callable, Dict, List
+
+from django.core.management.base import BaseCommand
+
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+
+
+def _percentile(samples: List[float], percent: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = "Compare per-call spotipy clients with the pooled SpotifyClient against a local stub server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--threads", type=int, default=4)
+
+    def handle(self, *args, **options):
+        stub = SpotifyStub().start()
+        api_url = stub.api_url
+
+        def per_call():
+            # What every resolver used to do: a brand new client and session
+            client = spotipy.Spotify(auth="token")
+            client.prefix = api_url
+            client.playlist_items("playlist", limit=20, offset=0)
+
+        def pooled():
+            # Concurrent identical requests would share one call
+            SpotifyClient.api(auth=f"token{threading.get_ident()}").playlist_items("playlist", limit=20, offset=0)
+
+        results = {}
+        # Measure the connections alone, not the rate limit scheduler
+        with stub, stub.override_settings(SPOTIFY_RATE_LIMIT_REQUESTS=0):
+            for name, call in (("per_call", per_call), ("pooled", pooled)):
+                SpotifyClient.reset()
+                stub.reset_stats()
+                results[name] = self._run(call, options["requests"], options["threads"])
+                results[name]["connections"] = stub.stats()["connections"]
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:>9}: {result['connections']:5d} connections "
+                f"p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms "
+                f"{result['rps']:.0f} req/s"
+            )
+
+    @staticmethod
+    def _run(call: Callable[[], None], total: int, threads: int) -> Dict[str, float]:
+        samples: List[float] = []
+        lock = threading.Lock()
+
+        def worker(count: int):
+            local = []
+            for _ in range(count):
+                start = time.perf_counter()
+                call()
+                local.append(time.perf_counter() - start)
+            with lock:
+                samples.extend(local)
+
+        workers = [threading.Thread(target=worker, args=(total // threads,)) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        return {
+            "p50_ms": _percentile(samples, 50) * 1000,
+            "p99_ms": _percentile(samples, 99) * 1000,
+            "rps": len(samples) / elapsed,
+        }
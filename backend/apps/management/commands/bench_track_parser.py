@@ -0,0 +1,71 @@
+import gc
+import time
+import tracemalloc
+
+from typing import Any, Callable, Dict, List
+
+from django.core.management.base import BaseCommand
+
+from apps.api.titles import normalize_title
+from apps.api.tracks import parse_tracks
+
+
+def legacy_parse_tracks(songs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Six-key dict per track, as the parsing loops used to build
+    tracks = []
+    for song in songs:
+        tracks.append({
+            "id": song['track']['id'],
+            "artist": song['track']['artists'][0]['name'],
+            "title": normalize_title(song['track']['name']),
+            "link": song['track']['external_urls']['spotify'],
+            "cover": song['track']['album']['images'][0]["url"],
+            "preview": song['track']['preview_url'],
+        })
+    return tracks
+
+
+class Command(BaseCommand):
+    help = "Measure time and memory of parsing a large playlist into track records."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tracks", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        songs = [
+            {"track": {
+                "id": f"{index:022d}",
+                "name": f"Track {index} (feat. Someone)",
+                "duration_ms": 1000,
+                "preview_url": f"https://p.scdn.co/mp3-preview/{index}",
+                "external_urls": {"spotify": f"https://open.spotify.com/track/{index:022d}"},
+                "artists": [{"name": f"Artist {index % 500}"}],
+                "album": {"images": [{"url": f"https://i.scdn.co/image/{index}"}]},
+            }}
+            for index in range(options["tracks"])
+        ]
+
+        for name, parse in (("dicts", legacy_parse_tracks), ("records", parse_tracks)):
+            normalize_title.cache_clear()
+            retained, peak, blocks, elapsed = self._measure(parse, songs)
+            self.stdout.write(
+                f"{name:>8}: retained {retained / 1024:8.1f} KiB, peak {peak / 1024:8.1f} KiB, "
+                f"{blocks} live blocks, {elapsed * 1000:.1f}ms"
+            )
+
+    @staticmethod
+    def _measure(parse: Callable, songs: List[Dict[str, Any]]):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        tracks = parse(songs)
+        elapsed = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = snapshot.statistics("filename")
+        retained = sum(stat.size for stat in stats)
+        blocks = sum(stat.count for stat in stats)
+        del tracks
+        return retained, peak, blocks, elapsed
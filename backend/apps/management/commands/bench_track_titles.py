@@ -0,0 +1,69 @@
+import random
+import re
+import time
+
+from typing import Callable, List
+
+from django.core.management.base import BaseCommand
+
+from apps.api.titles import TITLE_NOISE, normalize_title
+
+
+SONGS = [
+    "Blinding Lights", "Bohemian Rhapsody", "Get Lucky", "Nightcall", "Smells Like Teen Spirit",
+    "Around the World", "Midnight City", "Le Temps Des Cerises", "Superstition", "Hey Ya!",
+]
+SUFFIXES = [
+    "", " (feat. Pharrell Williams)", " - Remastered 2011", " [Live at Wembley]", " | From the Film",
+    " (Radio Edit) - Single Version", " (with Someone) [Extended Mix]", " - Acoustic",
+]
+
+
+def legacy_normalize_title(title: str) -> str:
+    title = re.sub("[\(\[].*?[\)\]]", "", title)  # pylint: disable=W1401
+    title = re.sub(r'\-.*', "", title)
+    return re.sub(r'\|.*', "", title)
+
+
+class Command(BaseCommand):
+    help = "Measure the per-title cost of the track title normalizer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--titles", type=int, default=200000)
+        parser.add_argument("--distinct", type=int, default=5000)
+        parser.add_argument(
+            "--corpus",
+            help="File with one real-world title per line, replaces the generated corpus",
+        )
+
+    def handle(self, *args, **options):
+        if options["corpus"]:
+            with open(options["corpus"], encoding="utf-8") as corpus:
+                distinct = [line.rstrip("\n") for line in corpus if line.strip()]
+        else:
+            distinct = [
+                f"{random.choice(SONGS)} {index}{random.choice(SUFFIXES)}"
+                for index in range(options["distinct"])
+            ]
+        # Popular tracks recur across users and playlists
+        titles = random.choices(distinct, k=options["titles"])
+
+        normalize_title.cache_clear()
+        runs = [
+            ("legacy", legacy_normalize_title),
+            ("compiled", lambda title: TITLE_NOISE.sub("", title)),
+            ("memoized", normalize_title),
+        ]
+        for name, normalize in runs:
+            per_title = self._measure(normalize, titles)
+            self.stdout.write(f"{name:>9}: {per_title:7.0f} ns/title")
+
+        info = normalize_title.cache_info()
+        self.stdout.write(f"memo: {info.hits} hits, {info.misses} misses, {info.currsize} entries")
+
+    @staticmethod
+    def _measure(normalize: Callable[[str], str], titles: List[str]) -> float:
+        start = time.perf_counter_ns()
+        for title in titles:
+            normalize(title)
+        return (time.perf_counter_ns() - start) / len(titles)
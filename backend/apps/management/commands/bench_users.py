@@ -0,0 +1,119 @@
+import time
+import tracemalloc
+
+from datetime import timedelta
+from typing import Callable, Tuple
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.models import User
+from apps.schema.connections import key_to_cursor
+from backend.schema import schema
+
+
+USERS_QUERY = """
+    query users($first: Int, $after: String) {
+        users(first: $first, after: $after) {
+            pageInfo { hasNextPage endCursor }
+            edges { node { id username hasSpotifyToken } }
+        }
+    }
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare loading every user, as the former `users` list did, with windows of the "
+        "`users` connection (keyset pagination and column projection) on a test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100_000, help="Users in the test database")
+        parser.add_argument("--first", type=int, default=100, help="Users per window")
+        parser.add_argument("--iterations", type=int, default=20)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.create_users(options["users"])
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @staticmethod
+    def create_users(count: int) -> None:
+        joined = timezone.now() - timedelta(days=365)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f"user{index}",
+                    email=f"user{index}@bench.local",
+                    password="!" + "x" * 87,
+                    accepted_account=index % 2 == 0,
+                    spotify_access_token=f"access{index}" * 20,
+                    spotify_refresh_token=f"refresh{index}" * 20,
+                    date_joined=joined + timedelta(minutes=index),
+                )
+                for index in range(count)
+            ),
+            batch_size=5000,
+        )
+
+    def run(self, options) -> None:
+        first = options["first"]
+        count = options["users"]
+        ids = list(User.objects.order_by("pk").values_list("pk", flat=True)[::max(1, count // 2)])
+        middle = ids[1] if len(ids) > 1 else ids[0]
+
+        self.stdout.write(f"{'case':>28} {'ms':>9} {'peak KiB':>10} {'queries':>8}")
+        self.report("all users (former list)", lambda: list(User.objects.all()), options)
+        self.report("first window", lambda: self.window(first, None), options)
+        self.report("middle window", lambda: self.window(first, key_to_cursor(middle)), options)
+        # The queries alone, against the OFFSET a page number would need
+        self.report(
+            "middle rows, OFFSET",
+            lambda: list(User.objects.order_by("pk")[count // 2:count // 2 + first]),
+            options,
+        )
+        self.report(
+            "middle rows, keyset",
+            lambda: list(User.objects.filter(pk__gt=middle).order_by("pk").only("id", "username")[:first]),
+            options,
+        )
+        self.report("every window", lambda: self.walk(first), {**options, "iterations": 1})
+
+    def report(self, case: str, call: Callable[[], object], options) -> None:
+        iterations = options["iterations"]
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                call()
+            elapsed = (time.perf_counter() - start) / iterations
+        tracemalloc.start()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(
+            f"{case:>28} {elapsed * 1000:9.2f} {peak / 1024:10.1f} {len(queries) / iterations:8.1f}"
+        )
+
+    @staticmethod
+    def window(first: int, after) -> Tuple[bool, str]:
+        request = RequestFactory().post("/graphql/")
+        request.user = AnonymousUser()
+        result = schema.execute(USERS_QUERY, variable_values={"first": first, "after": after}, context_value=request)
+        if result.errors:
+            raise CommandError(f"users failed: {result.errors[0]}")
+        page_info = result.data["users"]["pageInfo"]
+        return page_info["hasNextPage"], page_info["endCursor"]
+
+    def walk(self, first: int) -> None:
+        has_next, after = True, None
+        while has_next:
+            has_next, after = self.window(first, after)
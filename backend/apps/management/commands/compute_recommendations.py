@@ -0,0 +1,55 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.api.catalog import catalog
+from apps.api.recommendations import recommender
+from apps.models import User
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Store the suggested tracks of every accepted user, computed from the playlists of "
+        "their libraries and of the catalog. With --sync-libraries, the Spotify libraries of "
+        "users with a token are synced first. Runs forever with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sync-libraries", action="store_true", help="Sync the libraries of accepted users first")
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Seconds between two runs, 0 runs once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            if options["sync_libraries"]:
+                self.sync_libraries()
+
+            start = time.perf_counter()
+            done = recommender.refresh()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{done['recommendations']} recommendations for {done['users']} users "
+                f"from {done['cells']} playlist tracks in {elapsed:.2f}s"
+            )
+            if options["interval"] <= 0:
+                break
+            time.sleep(options["interval"])
+
+    def sync_libraries(self) -> None:
+        users = User.objects.filter(accepted_account=True, spotify_access_token__isnull=False)
+        failed = 0
+        for user in users:
+            try:
+                catalog.sync_library(user)
+            except Exception:
+                logger.exception("Library sync failed for user %s", user.pk)
+                failed += 1
+        self.stdout.write(f"{len(users) - failed} libraries synced, {failed} failures")
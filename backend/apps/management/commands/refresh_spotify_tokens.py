@@ -0,0 +1,81 @@
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+from typing import Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from apps.api.spotify_token import user_tokens
+from apps.models import User
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh the Spotify access tokens expiring within the next --window seconds, "
+        "so that user requests never wait on a refresh. Runs forever with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--window", type=int, default=settings.SPOTIFY_TOKEN_SCHEDULER_WINDOW)
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Seconds between two scans, 0 scans once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            refreshed, failed = self.scan(options["window"], options["batch_size"], options["workers"])
+            elapsed = time.perf_counter() - start
+
+            self.stdout.write(
+                f"{refreshed} tokens refreshed, {failed} failures in {elapsed:.2f}s "
+                f"({refreshed / elapsed if elapsed else 0:.1f} tokens/s)"
+            )
+            if options["interval"] <= 0:
+                break
+            time.sleep(options["interval"])
+
+    def scan(self, window: int, batch_size: int, workers: int) -> Tuple[int, int]:
+        users = User.objects.filter(
+            accepted_account=True,
+            spotify_refresh_token__isnull=False,
+            spotify_token_expires_at__lte=timezone.now() + timedelta(seconds=window),
+        ).only("id", "spotify_token_expires_at").order_by("spotify_token_expires_at")
+
+        refreshed = failed = 0
+        iterator = users.iterator(chunk_size=batch_size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                batch = list(islice(iterator, batch_size))
+                if not batch:
+                    break
+                succeeded = sum(executor.map(lambda user: self.refresh(user, window), batch))
+                refreshed, failed = refreshed + succeeded, failed + len(batch) - succeeded
+
+        return refreshed, failed
+
+    @staticmethod
+    def refresh(user: User, window: int) -> bool:
+        try:
+            user_tokens.refresh(user, margin=window)
+            return True
+        except Exception:
+            logger.exception("Spotify token refresh failed for user %s", user.pk)
+            return False
+        finally:
+            # Executor threads open their own DB connection
+            connection.close()
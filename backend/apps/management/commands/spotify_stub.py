@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from apps.api.spotify_stub import SpotifyStub
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the Spotify Web and Accounts APIs from the recorded "
+        "fixtures. Run the backend with SPOTIFY_STUB_URL set to its address."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8090)
+        parser.add_argument("--latency-ms", type=float, default=0)
+        parser.add_argument("--jitter-ms", type=float, default=0, help="Random extra latency, up to this value")
+        parser.add_argument("--error-rate", type=float, default=0, help="Share of 5xx responses")
+        parser.add_argument("--rate-limit-rate", type=float, default=0, help="Share of 429 responses")
+        parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of 429 responses, in seconds")
+        parser.add_argument("--tracks", type=int, default=None, help="Tracks per playlist, defaults to the recorded ones")
+        parser.add_argument("--seed", type=int, default=None)
+        parser.add_argument("--fixtures-dir", default=None)
+
+    def handle(self, *args, **options):
+        stub = SpotifyStub(
+            latency=options["latency_ms"] / 1000,
+            jitter=options["jitter_ms"] / 1000,
+            error_rate=options["error_rate"],
+            rate_limit_rate=options["rate_limit_rate"],
+            retry_after=options["retry_after"],
+            tracks=options["tracks"],
+            seed=options["seed"],
+            fixtures_dir=options["fixtures_dir"],
+        )
+        server = stub.bind(options["host"], options["port"])
+        self.stdout.write(f"Spotify stub listening, run the backend with SPOTIFY_STUB_URL={stub.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            stats = stub.stats()
+            self.stdout.write(f"requests: {stats['requests']} statuses: {stats['statuses']}")
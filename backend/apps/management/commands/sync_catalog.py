@@ -0,0 +1,53 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.api.catalog import catalog
+from apps.models import Playlist
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy Spotify playlists into the catalog models: the given ids, or every synced "
+        "playlist, least recently synced first. Unchanged snapshots are skipped. "
+        "Runs forever with --interval."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("playlist_ids", nargs="*")
+        parser.add_argument("--force", action="store_true", help="Compare every position, even of unchanged snapshots")
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=0,
+            help="Seconds between two syncs, 0 syncs once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            playlist_ids = options["playlist_ids"] or list(
+                Playlist.objects.order_by("synced_at").values_list("spotify_id", flat=True)
+            )
+            catalog.reset_stats()
+            failed = 0
+            start = time.perf_counter()
+            for playlist_id in playlist_ids:
+                try:
+                    catalog.sync(playlist_id, force=options["force"])
+                except Exception:
+                    logger.exception("Catalog sync failed for playlist %s", playlist_id)
+                    failed += 1
+            elapsed = time.perf_counter() - start
+
+            stats = catalog.stats()
+            self.stdout.write(
+                f"{stats['synced']} playlists synced ({stats['positions']} positions changed), "
+                f"{stats['skipped']} unchanged, {failed} failures in {elapsed:.2f}s"
+            )
+            if options["interval"] <= 0:
+                break
+            time.sleep(options["interval"])
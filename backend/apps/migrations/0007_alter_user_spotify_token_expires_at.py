@@ -0,0 +1,18 @@
+# Generated by Django 4.1.5 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0006_user_accepted_account'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='spotify_token_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, default=None, null=True),
+        ),
+    ]
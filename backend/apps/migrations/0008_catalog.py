@@ -0,0 +1,72 @@
+# Generated by Django 4.1.5 on 2026-10-18 15:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0007_alter_user_spotify_token_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=400)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Playlist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('snapshot_id', models.CharField(max_length=128)),
+                ('name', models.CharField(max_length=400)),
+                ('description', models.TextField(blank=True, default='')),
+                ('url', models.URLField(max_length=400)),
+                ('owner_name', models.CharField(blank=True, default='', max_length=400)),
+                ('owner_url', models.URLField(blank=True, default='', max_length=400)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('synced_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spotify_id', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=400)),
+                ('title', models.CharField(max_length=400)),
+                ('artist', models.CharField(max_length=400)),
+                ('artist_ids', models.JSONField(default=list)),
+                ('album_id', models.CharField(blank=True, default=None, max_length=64, null=True)),
+                ('link', models.URLField(max_length=400)),
+                ('cover', models.URLField(max_length=400)),
+                ('preview', models.URLField(blank=True, default=None, max_length=400, null=True)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('artists', models.ManyToManyField(related_name='tracks', to='apps.artist')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlaylistTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='apps.playlist')),
+                ('track', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='items', to='apps.track')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='tracks',
+            field=models.ManyToManyField(related_name='playlists', through='apps.PlaylistTrack', to='apps.track'),
+        ),
+        migrations.AddConstraint(
+            model_name='playlisttrack',
+            constraint=models.UniqueConstraint(fields=('playlist', 'position'), name='playlist_track_position'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+
+# Searched columns, see apps.api.search
+SEARCH_TABLES = {
+    "Track": ("apps_track_search", ("title", "artist")),
+    "Playlist": ("apps_playlist_search", ("name", "owner_name", "description")),
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        create_postgres_indexes(apps, schema_editor)
+    elif schema_editor.connection.vendor == "sqlite":
+        for model_name, (table, columns) in SEARCH_TABLES.items():
+            create_fts5_table(schema_editor, apps.get_model("apps", model_name)._meta.db_table, table, columns)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        for model_name, (table, columns) in SEARCH_TABLES.items():
+            schema_editor.execute(f'DROP INDEX IF EXISTS "{table}_vector"')
+            for column in columns[:2]:
+                schema_editor.execute(f'DROP INDEX IF EXISTS "{table}_{column}_trgm"')
+    elif schema_editor.connection.vendor == "sqlite":
+        for model_name, (table, columns) in SEARCH_TABLES.items():
+            for trigger in ("insert", "delete", "update"):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS "{table}_{trigger}"')
+            schema_editor.execute(f'DROP TABLE IF EXISTS "{table}"')
+
+
+def create_postgres_indexes(apps, schema_editor):
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for model_name, (table, columns) in SEARCH_TABLES.items():
+        model = apps.get_model("apps", model_name)
+        # Same expression as the searches, for the planner to use it
+        schema_editor.add_index(model, GinIndex(SearchVector(*columns, config="simple"), name=f"{table}_vector"))
+        # Trigrams of the names, not of the long descriptions
+        for column in columns[:2]:
+            schema_editor.add_index(
+                model,
+                GinIndex(fields=[column], opclasses=["gin_trgm_ops"], name=f"{table}_{column}_trgm"),
+            )
+
+
+def create_fts5_table(schema_editor, content: str, table: str, columns):
+    """ External content FTS5 table of `content`, kept up to date by triggers. """
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    insert = f"INSERT INTO {table}(rowid, {names}) VALUES (new.id, {new});"
+    delete = f"INSERT INTO {table}({table}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {table} USING fts5({names}, content='{content}', content_rowid='id', tokenize='trigram')"
+    )
+    schema_editor.execute(f"CREATE TRIGGER {table}_insert AFTER INSERT ON {content} BEGIN {insert} END")
+    schema_editor.execute(f"CREATE TRIGGER {table}_delete AFTER DELETE ON {content} BEGIN {delete} END")
+    schema_editor.execute(f"CREATE TRIGGER {table}_update AFTER UPDATE ON {content} BEGIN {delete} {insert} END")
+    schema_editor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apps', '0008_catalog'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -1 +1,3 @@
 from .user import User
+from .catalog import Artist, Playlist, PlaylistTrack, Track
+from .recommendation import Recommendation
@@ -0,0 +1,57 @@
+from django.db import models
+
+from .user import User
+
+
+class Artist(models.Model):
+    """ Spotify artist, of the tracks of synced playlists. """
+    spotify_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=400)
+
+
+class Track(models.Model):
+    """ Spotify track, stored as apps.api.tracks.Track serves it. """
+    spotify_id = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=400)
+    # Normalized name, see apps.api.titles
+    title = models.CharField(max_length=400)
+    # Name of the first artist, so a page of tracks is one query
+    artist = models.CharField(max_length=400)
+    artists = models.ManyToManyField(Artist, related_name="tracks")
+    # Spotify ids of all the artists, in order, same reason
+    artist_ids = models.JSONField(default=list)
+    album_id = models.CharField(max_length=64, default=None, blank=True, null=True)
+    link = models.URLField(max_length=400)
+    cover = models.URLField(max_length=400)
+    preview = models.URLField(max_length=400, default=None, blank=True, null=True)
+    duration_ms = models.PositiveIntegerField(default=0)
+
+
+class Playlist(models.Model):
+    """ Spotify playlist copied by apps.api.catalog, as of its snapshot_id. """
+    spotify_id = models.CharField(max_length=64, unique=True)
+    snapshot_id = models.CharField(max_length=128)
+    name = models.CharField(max_length=400)
+    description = models.TextField(blank=True, default="")
+    url = models.URLField(max_length=400)
+    owner_name = models.CharField(max_length=400, blank=True, default="")
+    owner_url = models.URLField(max_length=400, blank=True, default="")
+    # Items on Spotify, empty ones included
+    total = models.PositiveIntegerField(default=0)
+    synced_at = models.DateTimeField(db_index=True)
+    tracks = models.ManyToManyField(Track, through="PlaylistTrack", related_name="playlists")
+    # Users whose Spotify library holds it, see CatalogSync.sync_library
+    users = models.ManyToManyField(User, blank=True, related_name="library")
+
+
+class PlaylistTrack(models.Model):
+    """ Track at a position of a playlist, none for local and unavailable items. """
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name="items")
+    position = models.PositiveIntegerField()
+    track = models.ForeignKey(Track, on_delete=models.SET_NULL, blank=True, null=True, related_name="items")
+
+    class Meta:
+        constraints = [
+            # Also the index of page queries: playlist, then a range of positions
+            models.UniqueConstraint(fields=["playlist", "position"], name="playlist_track_position"),
+        ]
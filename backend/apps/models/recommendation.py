@@ -0,0 +1,19 @@
+from django.db import models
+
+from .catalog import Track
+from .user import User
+
+
+class Recommendation(models.Model):
+    """ Track suggested to a user, precomputed by apps.api.recommendations. """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="recommendations")
+    # 0 for the best suggestion
+    rank = models.PositiveIntegerField()
+    track = models.ForeignKey(Track, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Also the index of window queries: user, then a range of ranks
+            models.UniqueConstraint(fields=["user", "rank"], name="recommendation_rank"),
+        ]
@@ -7,6 +7,6 @@ class User(AbstractUser):
     accepted_account = models.BooleanField(default=False)
     spotify_access_token = models.CharField(max_length=400, default=None, blank=True, null=True)
     spotify_refresh_token = models.CharField(max_length=400, default=None, blank=True, null=True)
-    spotify_token_expires_at = models.DateTimeField(default=None, blank=True, null=True)
+    spotify_token_expires_at = models.DateTimeField(default=None, blank=True, null=True, db_index=True)
     profile_picture = models.URLField(default=None, blank=True, null=True)
 
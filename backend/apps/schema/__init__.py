@@ -1,6 +1,7 @@
 from apps.schema.nodes.user import UserNode
 from apps.schema.operations import user
 from apps.schema.operations import spotify
+from apps.schema.operations import catalog
 
 TYPES = [
     UserNode
@@ -15,6 +16,15 @@ class Mutation(
 class Query(
     user.Query,
     spotify.Query,
+    catalog.Query,
+):
+
+    pass
+
+class AsyncQuery(
+    user.Query,
+    spotify.AsyncQuery,
+    catalog.Query,
 ):
 
     pass
@@ -0,0 +1,89 @@
+from typing import Any, Callable, List, Optional, Tuple, Type
+
+import graphene
+
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+from graphql_relay import cursor_to_offset, offset_to_cursor
+from graphql_relay.utils import base64, unbase64
+
+
+# Page size of the former offset-based fields
+DEFAULT_FIRST = 20
+
+
+def window_args(info, first: Optional[int], after: Optional[str]) -> Tuple[int, int]:
+    """
+    Upstream offset and size of the window asked by the `first` and `after`
+    arguments of a connection. Cursors are the offsets of items on Spotify.
+    """
+    first = _first(info, first)
+    if after is None:
+        return 0, first
+    offset = cursor_to_offset(after)
+    if offset is None or offset < 0:
+        raise GraphQLError(f"Invalid cursor on the `{info.field_name}` connection.")
+    return offset + 1, first
+
+
+KEY_CURSOR_PREFIX = "key:"
+
+
+def key_to_cursor(key: int) -> str:
+    return base64(f"{KEY_CURSOR_PREFIX}{key}")
+
+
+def keyset_args(info, first: Optional[int], after: Optional[str]) -> Tuple[Optional[int], int]:
+    """
+    Primary key after which the window asked by `first` and `after` starts,
+    and its size. Cursors are primary keys rather than offsets: windows are
+    an index range scan however deep, and stay stable as rows are added.
+    """
+    first = _first(info, first)
+    if after is None:
+        return None, first
+    cursor = unbase64(after)
+    try:
+        if not cursor.startswith(KEY_CURSOR_PREFIX):
+            raise ValueError(cursor)
+        return int(cursor[len(KEY_CURSOR_PREFIX):]), first
+    except ValueError:
+        raise GraphQLError(f"Invalid cursor on the `{info.field_name}` connection.")
+
+
+def _first(info, first: Optional[int]) -> int:
+    if first is None:
+        return DEFAULT_FIRST
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    if first < 1:
+        raise GraphQLError(f"`first` must be positive on the `{info.field_name}` connection.")
+    if first > max_limit:
+        raise GraphQLError(
+            f"Requesting {first} records on the `{info.field_name}` connection exceeds the `first` limit of {max_limit} records."
+        )
+    return first
+
+
+def build_connection(
+    connection_type: Type[graphene.relay.Connection],
+    items: List[Tuple[int, Any]],
+    start: int,
+    has_next_page: bool,
+    to_cursor: Callable[[int], str] = offset_to_cursor,
+    **fields,
+) -> graphene.relay.Connection:
+    """
+    Connection of (upstream offset, node) items, the window starting at
+    `start`. With `to_cursor=key_to_cursor`, items are (primary key, node).
+    """
+    edges = [connection_type.Edge(node=node, cursor=to_cursor(offset)) for offset, node in items]
+    return connection_type(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=start > 0,
+            has_next_page=has_next_page,
+        ),
+        **fields,
+    )
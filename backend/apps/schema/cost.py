@@ -0,0 +1,218 @@
+import math
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, FrozenSet, Iterator, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLList,
+    GraphQLNamedType,
+    GraphQLObjectType,
+    GraphQLInterfaceType,
+    InlineFragmentNode,
+    IntValueNode,
+    OperationDefinitionNode,
+    OperationType,
+    SelectionSetNode,
+    ValidationRule,
+    get_named_type,
+    get_nullable_type,
+)
+from graphql.language.visitor import SKIP
+
+from apps.schema.connections import DEFAULT_FIRST
+
+
+# Weight of a field, for one item of its parent, by "Type.field". Composite
+# fields weigh 1 and scalars 0 unless listed. A Spotify call weighs 10: the
+# batched track fields weigh their share of a multi-id call (100 audio
+# features, 50 artists for ~2 per track, 20 albums), see apps.api.spotify_loaders.
+FIELD_COSTS = {
+    "Query.mySuggestions": 10,
+    "Query.specificPlaylistData": 10,
+    "Query.fullPlaylistData": 200,
+    "Query.userPlaylistsData": 10,
+    "Query.suggestedTracks": 10,
+    "Query.playlistTracks": 10,
+    "Query.userPlaylists": 10,
+    # A page of users is an index range scan, counting them scans the table
+    "Query.users": 2,
+    "UserConnection.totalCount": 10,
+    "Query.searchTracks": 2,
+    "Query.searchPlaylists": 2,
+    "Query.recommendedTracks": 2,
+    "TrackData.audioFeatures": 0.1,
+    "TrackData.artistGenres": 0.4,
+    "TrackData.album": 0.5,
+}
+
+# Expected items of list fields, multiplying the cost of their selection.
+# "Parent.field.list" entries take precedence over "Type.list" ones.
+LIST_SIZES = {
+    "PlaylistData.tracks": 20,
+    "SpecificPlaylistData.tracks": 20,
+    "Query.fullPlaylistData.tracks": 1000,
+    "UserPlaylistsData.playlists": 50,
+}
+DEFAULT_LIST_SIZE = 10
+
+
+class QueryCost(NamedTuple):
+    cost: int
+    depth: int
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "requested": self.cost,
+            "maximum": settings.GRAPHQL_MAX_COST,
+            "depth": self.depth,
+            "maxDepth": settings.GRAPHQL_MAX_DEPTH,
+        }
+
+
+# Costs of the operations of the document being validated, by operation name
+current_costs: ContextVar[Optional[Dict[Optional[str], QueryCost]]] = ContextVar("graphql_costs", default=None)
+
+
+@contextmanager
+def track_costs() -> Iterator[Dict[Optional[str], QueryCost]]:
+    costs: Dict[Optional[str], QueryCost] = {}
+    token = current_costs.set(costs)
+    try:
+        yield costs
+    finally:
+        current_costs.reset(token)
+
+
+class QueryCostRule(ValidationRule):
+    """
+    Rejects operations deeper than GRAPHQL_MAX_DEPTH fields, or costlier than
+    GRAPHQL_MAX_COST, before anything is executed.
+
+    The cost is static: the weight of every field (FIELD_COSTS), multiplied
+    by the expected size of the lists around it (LIST_SIZES, `first` for
+    connections, at its cap when it is a variable without default).
+    """
+
+    def enter_operation_definition(self, node: OperationDefinitionNode, *_args):
+        cost = self.estimate(node)
+        costs = current_costs.get()
+        if costs is not None:
+            costs[node.name.value if node.name else None] = cost
+
+        name = node.name.value if node.name else "anonymous"
+        extensions = {"cost": cost.as_dict()}
+        if cost.depth > settings.GRAPHQL_MAX_DEPTH:
+            self.report_error(GraphQLError(
+                f"Operation `{name}` is {cost.depth} fields deep, more than the maximum of {settings.GRAPHQL_MAX_DEPTH}.",
+                node,
+                extensions={"code": "QUERY_TOO_DEEP", **extensions},
+            ))
+        if cost.cost > settings.GRAPHQL_MAX_COST:
+            self.report_error(GraphQLError(
+                f"Operation `{name}` costs {cost.cost}, more than the maximum of {settings.GRAPHQL_MAX_COST}.",
+                node,
+                extensions={"code": "QUERY_TOO_COMPLEX", **extensions},
+            ))
+        return SKIP
+
+    def estimate(self, operation: OperationDefinitionNode) -> QueryCost:
+        schema = self.context.schema
+        root = {
+            OperationType.QUERY: schema.query_type,
+            OperationType.MUTATION: schema.mutation_type,
+            OperationType.SUBSCRIPTION: schema.subscription_type,
+        }[operation.operation]
+        if root is None:
+            return QueryCost(0, 0)
+        cost, depth = self._selection(root, operation.selection_set, None, None, 0, frozenset())
+        return QueryCost(math.ceil(round(cost, 6)), depth)
+
+    def _selection(
+        self,
+        parent_type: GraphQLNamedType,
+        selection_set: SelectionSetNode,
+        parent_key: Optional[str],
+        first: Optional[int],
+        depth: int,
+        fragments: FrozenSet[str],
+    ) -> Tuple[float, int]:
+        cost, max_depth = 0.0, depth
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field_cost, field_depth = self._field(parent_type, selection, parent_key, first, depth, fragments)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.context.schema.get_type(selection.type_condition.name.value) or parent_type
+                field_cost, field_depth = self._selection(
+                    fragment_type, selection.selection_set, parent_key, first, depth, fragments
+                )
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.context.get_fragment(name)
+                # Cycles are reported by NoFragmentCyclesRule
+                if fragment is None or name in fragments:
+                    continue
+                fragment_type = self.context.schema.get_type(fragment.type_condition.name.value) or parent_type
+                field_cost, field_depth = self._selection(
+                    fragment_type, fragment.selection_set, parent_key, first, depth, fragments | {name}
+                )
+            else:
+                continue
+            cost += field_cost
+            max_depth = max(max_depth, field_depth)
+        return cost, max_depth
+
+    def _field(
+        self,
+        parent_type: GraphQLNamedType,
+        node: FieldNode,
+        parent_key: Optional[str],
+        first: Optional[int],
+        depth: int,
+        fragments: FrozenSet[str],
+    ) -> Tuple[float, int]:
+        name = node.name.value
+        # Introspection, GraphiQL's query is deep but cheap
+        if name.startswith("__") or not isinstance(parent_type, (GraphQLObjectType, GraphQLInterfaceType)):
+            return 0, depth
+        field = parent_type.fields.get(name)
+        if field is None:
+            return 0, depth
+
+        key = f"{parent_type.name}.{name}"
+        weight = FIELD_COSTS.get(key, 1 if node.selection_set else 0)
+        size = 1
+        if isinstance(get_nullable_type(field.type), GraphQLList):
+            if name == "edges" and first is not None:
+                size = first
+            else:
+                size = LIST_SIZES.get(f"{parent_key}.{name}", LIST_SIZES.get(key, DEFAULT_LIST_SIZE))
+        if node.selection_set is None:
+            return weight * size, depth + 1
+
+        child_first = self._first(node) if "first" in field.args else None
+        child_cost, child_depth = self._selection(
+            get_named_type(field.type), node.selection_set, key, child_first, depth + 1, fragments
+        )
+        return weight + size * child_cost, child_depth
+
+    def _first(self, node: FieldNode) -> int:
+        """ Items asked to a connection field. """
+        maximum = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        for argument in node.arguments or ():
+            if argument.name.value != "first":
+                continue
+            value: Any = argument.value
+            if isinstance(value, IntValueNode):
+                return min(int(value.value), maximum)
+            # Variables are known at execution only, and the cost is cached
+            # per document: not even their default value, assume the worst
+            return maximum
+        return DEFAULT_FIRST
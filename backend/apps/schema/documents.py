@@ -0,0 +1,200 @@
+import hashlib
+import json
+import threading
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import DocumentNode, GraphQLError, GraphQLSchema, get_operation_ast, parse, specified_rules, validate
+
+from apps.api.metrics import CACHE_REQUESTS
+from apps.api.spotify_cache import LRUCache
+from apps.schema.cost import QueryCost, QueryCostRule, track_costs
+
+
+VALIDATION_RULES = (*specified_rules, QueryCostRule)
+
+
+class Document(NamedTuple):
+    """ Parsed and validated document, with the cost of its operations. """
+    node: DocumentNode
+    costs: Dict[Optional[str], QueryCost]
+
+    def cost(self, operation_name: Optional[str]) -> Optional[QueryCost]:
+        operation = get_operation_ast(self.node, operation_name)
+        if operation is None:
+            return None
+        return self.costs.get(operation.name.value if operation.name else None)
+
+
+class DocumentCache:
+    """
+    Parsed and validated documents, by schema and query text.
+
+    A handful of frontend operations make up nearly all the traffic: they are
+    parsed and validated once per worker instead of on every request. Only
+    valid documents are kept, in an LRU of GRAPHQL_DOCUMENT_CACHE_SIZE.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents: Optional[LRUCache] = None
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, schema: GraphQLSchema, query: str) -> Tuple[Optional[Document], List[GraphQLError]]:
+        """ The document of `query`, or the syntax, validation or cost errors of it. """
+        documents = self._store()
+        key = (id(schema), query)
+        document = documents.get(key)
+        if document is not None:
+            self._count("hits")
+            return document, []
+
+        self._count("misses")
+        try:
+            node = parse(query)
+        except GraphQLError as error:
+            return None, [error]
+        with track_costs() as costs:
+            errors = validate(schema, node, rules=VALIDATION_RULES)
+        if errors:
+            return None, errors
+        document = Document(node, costs)
+        # Documents never expire, only make room for others
+        documents.set(key, document, timeout=float("inf"))
+        return document, []
+
+    def clear(self) -> None:
+        with self._lock:
+            self._documents = None
+            self._stats = {"hits": 0, "misses": 0}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _store(self) -> LRUCache:
+        with self._lock:
+            if self._documents is None:
+                self._documents = LRUCache(maxsize=settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+            return self._documents
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+        CACHE_REQUESTS.labels("graphql_documents", stat).inc()
+
+
+documents = DocumentCache()
+
+
+class PersistedQueryError(GraphQLError):
+    """ Refused persisted query, with the codes Apollo clients act upon. """
+
+    def __init__(self, message: str, code: str, status_code: int = 400):
+        super().__init__(message, extensions={"code": code})
+        self.status_code = status_code
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class PersistedQueries:
+    """
+    Query texts stored server side, sent by clients as their sha256 hash.
+
+    Two sources: the manifest of the frontend operations
+    (GRAPHQL_PERSISTED_QUERIES_FILE, a JSON object of hash to query), and
+    automatic persisted queries (GRAPHQL_APQ): a client sends the hash alone,
+    and the full query along with the hash only when it is not known yet,
+    which stores it in the shared cache for GRAPHQL_APQ_TTL seconds.
+    With GRAPHQL_PERSISTED_QUERIES_ONLY, only manifest queries are executed.
+    """
+
+    def __init__(self, local_size: int = 256):
+        self._lock = threading.Lock()
+        self._manifest: Tuple[Optional[str], Dict[str, str]] = (None, {})
+        # Registered queries seen by this worker, saves a shared cache round trip
+        self._local = LRUCache(maxsize=local_size)
+
+    def resolve(self, query: Optional[str], extensions: Any) -> Optional[str]:
+        """ Query text of a request, given its query and its `extensions` (a dict or JSON). """
+        persisted = self._persisted_query(extensions)
+        if persisted is None:
+            if query and settings.GRAPHQL_PERSISTED_QUERIES_ONLY and query_hash(query) not in self.manifest():
+                raise PersistedQueryError("Only persisted queries are allowed.", "PERSISTED_QUERY_REQUIRED")
+            return query
+
+        sha256_hash = persisted.get("sha256Hash")
+        if persisted.get("version") != 1 or not isinstance(sha256_hash, str):
+            raise PersistedQueryError("Unsupported persisted query version.", "PERSISTED_QUERY_NOT_SUPPORTED")
+
+        known = self.get(sha256_hash)
+        if query is None:
+            if known is None:
+                # Apollo clients send the query along on this error
+                raise PersistedQueryError("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND", status_code=200)
+            return known
+        if query == known:
+            return query
+
+        if query_hash(query) != sha256_hash:
+            raise PersistedQueryError("provided sha does not match query", "INVALID_SHA256_HASH")
+        if settings.GRAPHQL_PERSISTED_QUERIES_ONLY or not settings.GRAPHQL_APQ:
+            raise PersistedQueryError("PersistedQueryNotSupported", "PERSISTED_QUERY_NOT_SUPPORTED")
+        self._register(sha256_hash, query)
+        return query
+
+    def get(self, sha256_hash: str) -> Optional[str]:
+        query = self.manifest().get(sha256_hash)
+        if query is not None or not settings.GRAPHQL_APQ or settings.GRAPHQL_PERSISTED_QUERIES_ONLY:
+            return query
+        query = self._local.get(sha256_hash)
+        if query is None:
+            query = caches[settings.GRAPHQL_APQ_CACHE_ALIAS].get(self._cache_key(sha256_hash))
+            if query is not None:
+                self._local.set(sha256_hash, query, settings.GRAPHQL_APQ_TTL)
+        return query
+
+    def manifest(self) -> Dict[str, str]:
+        path = settings.GRAPHQL_PERSISTED_QUERIES_FILE
+        with self._lock:
+            loaded_path, manifest = self._manifest
+            if path != loaded_path:
+                manifest = {}
+                if path:
+                    with open(path) as manifest_file:
+                        manifest = json.load(manifest_file)
+                self._manifest = (path, manifest)
+            return manifest
+
+    def clear(self) -> None:
+        with self._lock:
+            self._manifest = (None, {})
+        self._local.clear()
+
+    def _register(self, sha256_hash: str, query: str) -> None:
+        caches[settings.GRAPHQL_APQ_CACHE_ALIAS].set(self._cache_key(sha256_hash), query, settings.GRAPHQL_APQ_TTL)
+        self._local.set(sha256_hash, query, settings.GRAPHQL_APQ_TTL)
+
+    @staticmethod
+    def _persisted_query(extensions: Any) -> Optional[Dict[str, Any]]:
+        if isinstance(extensions, str):
+            # GET requests carry it as JSON
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise PersistedQueryError("Extensions are invalid JSON.", "BAD_REQUEST")
+        if not isinstance(extensions, dict):
+            return None
+        persisted = extensions.get("persistedQuery")
+        return persisted if isinstance(persisted, dict) else None
+
+    @staticmethod
+    def _cache_key(sha256_hash: str) -> str:
+        return f"graphql:apq:{sha256_hash}"
+
+
+persisted_queries = PersistedQueries()
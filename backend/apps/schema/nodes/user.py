@@ -1,4 +1,5 @@
 import graphene
+from django.db.models import BooleanField, ExpressionWrapper, Q
 from graphene_django import DjangoObjectType
 
 from apps.models import User
@@ -23,10 +24,36 @@ class UserNode(DjangoObjectType):
     has_spotify_refresh_token = graphene.NonNull(graphene.Boolean)
     is_access_token_expired = graphene.NonNull(graphene.Boolean)
 
+    # Columns read by each field, the only ones the `users` connection loads
+    COLUMNS = {
+        "id": ("id",),
+        "username": ("username",),
+        "firstName": ("first_name",),
+        "lastName": ("last_name",),
+        "email": ("email",),
+        "spotifyTokenExpiresAt": ("spotify_token_expires_at",),
+        "isAccessTokenExpired": ("spotify_token_expires_at",),
+    }
+    # Fields computed by the database instead, tokens never leave it
+    ANNOTATIONS = {
+        "hasSpotifyToken": (
+            "has_access_token",
+            ExpressionWrapper(Q(spotify_access_token__isnull=False), output_field=BooleanField()),
+        ),
+        "hasSpotifyRefreshToken": (
+            "has_refresh_token",
+            ExpressionWrapper(Q(spotify_refresh_token__isnull=False), output_field=BooleanField()),
+        ),
+    }
+
     def resolve_has_spotify_token(self: User, context: graphene.ResolveInfo) -> bool:
+        if hasattr(self, "has_access_token"):
+            return self.has_access_token
         return self.spotify_access_token is not None
 
     def resolve_has_spotify_refresh_token(self: User, context: graphene.ResolveInfo) -> bool:
+        if hasattr(self, "has_refresh_token"):
+            return self.has_refresh_token
         return self.spotify_refresh_token is not None
 
     def resolve_is_access_token_expired(self: User, context: graphene.ResolveInfo) -> bool:
@@ -0,0 +1,53 @@
+import graphene
+
+from apps.api.pagination import Window
+from apps.api.recommendations import recommender
+from apps.api.search import catalog_search
+from apps.schema.connections import window_args
+from apps.schema.operations.spotify import PlaylistConnection, TrackConnection, playlists_connection, tracks_connection
+
+
+class Query(graphene.ObjectType):
+    # Ranked over the synced catalog (see sync_catalog), `first` results `after` a cursor
+    search_tracks = graphene.Field(
+        TrackConnection,
+        args={
+            'query': graphene.String(required=True),
+            'first': graphene.Int(),
+            'after': graphene.String(),
+        })
+
+    search_playlists = graphene.Field(
+        PlaylistConnection,
+        args={
+            'query': graphene.String(required=True),
+            'first': graphene.Int(),
+            'after': graphene.String(),
+        })
+
+    # Precomputed for the current user (see compute_recommendations), best first
+    recommended_tracks = graphene.Field(
+        TrackConnection,
+        args={
+            'first': graphene.Int(),
+            'after': graphene.String(),
+        })
+
+    def resolve_search_tracks(self, info, query, first=None, after=None):
+        start, count = window_args(info, first, after)
+        window = catalog_search.tracks(query, start, count)
+        return tracks_connection({"tracks": window.items, "has_next_page": window.has_next}, start)
+
+    def resolve_search_playlists(self, info, query, first=None, after=None):
+        start, count = window_args(info, first, after)
+        window = catalog_search.playlists(query, start, count)
+        return playlists_connection({"success": True, "playlists": window.items, "has_next_page": window.has_next}, start)
+
+    def resolve_recommended_tracks(self, info, first=None, after=None):
+        start, count = window_args(info, first, after)
+        user = info.context.user
+        if getattr(user, "accepted_account", False):
+            window = recommender.window(user, start, count)
+        else:
+            window = Window([], False, None)
+        return tracks_connection({"tracks": window.items, "has_next_page": window.has_next}, start)
@@ -1,6 +1,10 @@
 import graphene
 
 from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_async import AsyncSpotifyAPI
+from apps.api.spotify_loaders import genres, spotify_loaders, then
+from apps.schema.connections import build_connection, window_args
+from apps.schema.selections import selected_fields
 
 
 # DEFINE DATA TYPE AND STRUCTURE
@@ -14,6 +18,28 @@ class PlaylistInfo(graphene.ObjectType):
     def resolve_playlist_info(self, parent, info):
         return f"{parent.playlist_name} made by {parent.owner_name}"
 
+class AudioFeatures(graphene.ObjectType):
+    danceability = graphene.Float()
+    energy = graphene.Float()
+    valence = graphene.Float()
+    tempo = graphene.Float()
+    loudness = graphene.Float()
+    acousticness = graphene.Float()
+    instrumentalness = graphene.Float()
+    speechiness = graphene.Float()
+    liveness = graphene.Float()
+    key = graphene.Int()
+    mode = graphene.Int()
+    time_signature = graphene.Int()
+
+class AlbumData(graphene.ObjectType):
+    id = graphene.String()
+    name = graphene.String()
+    release_date = graphene.String()
+    label = graphene.String()
+    popularity = graphene.Int()
+    total_tracks = graphene.Int()
+
 class TrackData(graphene.ObjectType):
     id = graphene.String()
     artist = graphene.String()
@@ -21,10 +47,29 @@ class TrackData(graphene.ObjectType):
     link = graphene.String()
     cover = graphene.String()
     preview = graphene.String()
+    # Fetched for the whole page at once, see apps.api.spotify_loaders
+    audio_features = graphene.Field(AudioFeatures)
+    artist_genres = graphene.List(graphene.String, description="Genres of the artists of the track")
+    album = graphene.Field(AlbumData)
 
     def resolve_track(self, parent, info):
         return f"{parent.artist} - {parent.title}"
 
+    def resolve_audio_features(parent, info):
+        return spotify_loaders(info.context).audio_features.load(parent.id)
+
+    def resolve_artist_genres(parent, info):
+        return then(spotify_loaders(info.context).artists.load_many(parent.artist_ids), genres)
+
+    def resolve_album(parent, info):
+        return spotify_loaders(info.context).albums.load(parent.album_id)
+
+
+def resolve_page_tracks(parent, info):
+    # Resolved one by one, the tracks of the page are batched on the first load
+    spotify_loaders(info.context).expect(parent.tracks or ())
+    return parent.tracks
+
 class PlaylistsData(graphene.ObjectType):
     id = graphene.String()
     name = graphene.String()
@@ -45,14 +90,16 @@ class UserData(graphene.ObjectType):
 
 class PlaylistData(graphene.ObjectType):
     success = graphene.Boolean()
-    tracks = graphene.List(TrackData)
+    tracks = graphene.List(TrackData, resolver=resolve_page_tracks)
     last_page = graphene.Boolean()
+    stale = graphene.Boolean(description="Served from cache while Spotify is unavailable")
 
 class SpecificPlaylistData(graphene.ObjectType):
     success = graphene.Boolean()
     playlist =  graphene.Field(PlaylistInfo)
-    tracks = graphene.List(TrackData)
+    tracks = graphene.List(TrackData, resolver=resolve_page_tracks)
     last_page = graphene.Boolean()
+    stale = graphene.Boolean(description="Served from cache while Spotify is unavailable")
 
 class UserPlaylistsData(graphene.ObjectType):
     success = graphene.Boolean()
@@ -61,6 +108,28 @@ class UserPlaylistsData(graphene.ObjectType):
     playlists = graphene.List(PlaylistsData)
     last_page = graphene.Boolean()
 
+class TrackConnection(graphene.relay.Connection):
+    class Meta:
+        node = TrackData
+
+    playlist = graphene.Field(PlaylistInfo)
+    total_count = graphene.Int(description="Tracks of the playlist on Spotify, empty ones included")
+    stale = graphene.Boolean(description="Served from cache while Spotify is unavailable")
+
+    def resolve_edges(parent, info):
+        # Resolved one by one, the tracks of the window are batched on the first load
+        spotify_loaders(info.context).expect(edge.node for edge in parent.edges)
+        return parent.edges
+
+class PlaylistConnection(graphene.relay.Connection):
+    class Meta:
+        node = PlaylistsData
+
+    success = graphene.Boolean()
+    details = graphene.String()
+    owner = graphene.Field(UserData)
+    total_count = graphene.Int(description="Playlists of the user on Spotify, skipped ones included")
+
 class AuthLink(graphene.ObjectType):
     success = graphene.Boolean()
     href = graphene.String()
@@ -82,6 +151,12 @@ class Query(graphene.ObjectType):
             'offset': graphene.Int(),
         })
 
+    full_playlist_data = graphene.Field(
+        SpecificPlaylistData,
+        args={
+            'playlist_id': graphene.String(),
+        })
+
     user_playlists_data = graphene.Field(
         UserPlaylistsData,
         args={
@@ -90,6 +165,30 @@ class Query(graphene.ObjectType):
 
     auth_link = graphene.Field(AuthLink)
 
+    # Relay connections, forward only: `first` items (up to RELAY_CONNECTION_MAX_LIMIT) `after` a cursor
+    suggested_tracks = graphene.Field(
+        TrackConnection,
+        args={
+            'playlist_id': graphene.String(required=True),
+            'first': graphene.Int(),
+            'after': graphene.String(),
+        })
+
+    playlist_tracks = graphene.Field(
+        TrackConnection,
+        args={
+            'playlist_id': graphene.String(required=True),
+            'first': graphene.Int(),
+            'after': graphene.String(),
+        })
+
+    user_playlists = graphene.Field(
+        PlaylistConnection,
+        args={
+            'first': graphene.Int(),
+            'after': graphene.String(),
+        })
+
     def resolve_my_suggestions(self, info, playlist_id, offset):
         playlist = SpotifyAPI.get_tracks_from_my_suggestions(
             playlist_id=playlist_id,
@@ -100,19 +199,36 @@ class Query(graphene.ObjectType):
             success=playlist.get("success"),
             tracks=playlist.get("tracks"),
             last_page=playlist.get("last_page"),
+            stale=playlist.get("stale"),
         )
 
     def resolve_specific_playlist_data(self, info, playlist_id, offset):
         playlist = SpotifyAPI.get_playlist_data(
             playlist_id=playlist_id,
             offset=offset,
-            context=info.context
+            context=info.context,
+            **playlist_parts(info)
+        )
+        return SpecificPlaylistData(
+            success=playlist.get("success"),
+            playlist=playlist.get("playlist"),
+            tracks=playlist.get("tracks"),
+            last_page=playlist.get("last_page"),
+            stale=playlist.get("stale"),
+        )
+
+    def resolve_full_playlist_data(self, info, playlist_id):
+        playlist = SpotifyAPI.get_full_playlist_data(
+            playlist_id=playlist_id,
+            context=info.context,
+            **playlist_parts(info)
         )
         return SpecificPlaylistData(
             success=playlist.get("success"),
             playlist=playlist.get("playlist"),
             tracks=playlist.get("tracks"),
             last_page=playlist.get("last_page"),
+            stale=playlist.get("stale"),
         )
 
     def resolve_user_playlists_data(self, info, offset):
@@ -129,6 +245,37 @@ class Query(graphene.ObjectType):
             last_page=playlists.get("last_page"),
         )
 
+    def resolve_suggested_tracks(self, info, playlist_id, first=None, after=None):
+        start, count = window_args(info, first, after)
+        window = SpotifyAPI.get_tracks_window(
+            playlist_id=playlist_id,
+            start=start,
+            count=count,
+            skip_empty=False,
+            context=info.context
+        )
+        return tracks_connection(window, start)
+
+    def resolve_playlist_tracks(self, info, playlist_id, first=None, after=None):
+        start, count = window_args(info, first, after)
+        window = SpotifyAPI.get_tracks_window(
+            playlist_id=playlist_id,
+            start=start,
+            count=count,
+            skip_empty=True,
+            context=info.context
+        )
+        return tracks_connection(window, start)
+
+    def resolve_user_playlists(self, info, first=None, after=None):
+        start, count = window_args(info, first, after)
+        window = SpotifyAPI.get_user_playlists_window(
+            start=start,
+            count=count,
+            context=info.context
+        )
+        return playlists_connection(window, start)
+
     def resolve_auth_link(self, info):
         auth_link = SpotifyAPI.get_spotify_oauth_link(context=info.context)
 
@@ -138,5 +285,117 @@ class Query(graphene.ObjectType):
         )
 
 
+class AsyncQuery(Query):
+    """ Same fields as Query, Spotify ones awaited on the event loop (ASGI). """
+
+    async def resolve_my_suggestions(self, info, playlist_id, offset):
+        playlist = await AsyncSpotifyAPI.get_tracks_from_my_suggestions(
+            playlist_id=playlist_id,
+            offset=offset,
+            context=info.context
+        )
+        return PlaylistData(
+            success=playlist.get("success"),
+            tracks=playlist.get("tracks"),
+            last_page=playlist.get("last_page"),
+            stale=playlist.get("stale"),
+        )
+
+    async def resolve_specific_playlist_data(self, info, playlist_id, offset):
+        playlist = await AsyncSpotifyAPI.get_playlist_data(
+            playlist_id=playlist_id,
+            offset=offset,
+            context=info.context,
+            **playlist_parts(info)
+        )
+        return SpecificPlaylistData(
+            success=playlist.get("success"),
+            playlist=playlist.get("playlist"),
+            tracks=playlist.get("tracks"),
+            last_page=playlist.get("last_page"),
+            stale=playlist.get("stale"),
+        )
+
+    async def resolve_user_playlists_data(self, info, offset):
+        playlists = await AsyncSpotifyAPI.get_user_playlists(
+            offset=offset,
+            context=info.context
+        )
+
+        return UserPlaylistsData(
+            success=playlists.get("success"),
+            details=playlists.get("details"),
+            owner=playlists.get("owner"),
+            playlists=playlists.get("playlists"),
+            last_page=playlists.get("last_page"),
+        )
+
+    async def resolve_suggested_tracks(self, info, playlist_id, first=None, after=None):
+        start, count = window_args(info, first, after)
+        window = await AsyncSpotifyAPI.get_tracks_window(
+            playlist_id=playlist_id,
+            start=start,
+            count=count,
+            skip_empty=False,
+            context=info.context
+        )
+        return tracks_connection(window, start)
+
+    async def resolve_playlist_tracks(self, info, playlist_id, first=None, after=None):
+        start, count = window_args(info, first, after)
+        window = await AsyncSpotifyAPI.get_tracks_window(
+            playlist_id=playlist_id,
+            start=start,
+            count=count,
+            skip_empty=True,
+            context=info.context
+        )
+        return tracks_connection(window, start)
+
+    async def resolve_user_playlists(self, info, first=None, after=None):
+        start, count = window_args(info, first, after)
+        window = await AsyncSpotifyAPI.get_user_playlists_window(
+            start=start,
+            count=count,
+            context=info.context
+        )
+        return playlists_connection(window, start)
+
+
+def playlist_parts(info):
+    """
+    Parts of a playlist its selection needs: a header-only query (`playlist`,
+    `success`, `stale`) costs one Spotify call, the tracks page another.
+    """
+    fields = selected_fields(info)
+    with_tracks = bool(fields & {"tracks", "lastPage"})
+    return {"with_info": "playlist" in fields, "with_tracks": with_tracks}
+
+
+def tracks_connection(window, start):
+    return build_connection(
+        TrackConnection,
+        window.get("tracks"),
+        start,
+        window.get("has_next_page"),
+        playlist=window.get("playlist"),
+        total_count=window.get("total"),
+        stale=window.get("stale"),
+    )
+
+
+def playlists_connection(window, start):
+    return build_connection(
+        PlaylistConnection,
+        window.get("playlists"),
+        start,
+        window.get("has_next_page"),
+        success=window.get("success"),
+        details=window.get("details"),
+        owner=window.get("owner"),
+        total_count=window.get("total"),
+    )
+
+
 class Mutation(graphene.ObjectType):
     pass
@@ -2,14 +2,35 @@ import graphene
 
 from graphene import ResolveInfo
 
+from apps.schema.connections import build_connection, key_to_cursor, keyset_args
 from apps.schema.nodes.user import UserNode
+from apps.schema.selections import selected_fields
 from apps.api.user import UserAPI
 from apps.models import User
 
 
+class UserConnection(graphene.relay.Connection):
+    class Meta:
+        node = UserNode
+
+    total_count = graphene.Int(description="Users matching the filters, counted only when asked")
+
+    def resolve_total_count(self, info):
+        return self.users.count()
+
+
 class Query(graphene.ObjectType):
     whoami = graphene.Field(UserNode)
-    users = graphene.List(UserNode)
+    # Ordered by id, `first` users (up to RELAY_CONNECTION_MAX_LIMIT) `after` a cursor
+    users = graphene.Field(
+        UserConnection,
+        args={
+            'first': graphene.Int(),
+            'after': graphene.String(),
+            'accepted_account': graphene.Boolean(),
+            'joined_after': graphene.DateTime(),
+            'joined_before': graphene.DateTime(),
+        })
 
     def resolve_whoami(self, info):
         user = info.context.user
@@ -18,8 +39,44 @@ class Query(graphene.ObjectType):
             raise Exception('Authentication Failure: Your must be signed in')
         return user
 
-    def resolve_users(self, info):
-        return User.objects.all()
+    def resolve_users(self, info, first=None, after=None, accepted_account=None, joined_after=None, joined_before=None):
+        after_id, first = keyset_args(info, first, after)
+        users = User.objects.all()
+        if accepted_account is not None:
+            users = users.filter(accepted_account=accepted_account)
+        if joined_after is not None:
+            users = users.filter(date_joined__gte=joined_after)
+        if joined_before is not None:
+            users = users.filter(date_joined__lt=joined_before)
+
+        window = users_window(info, users)
+        if after_id is not None:
+            window = window.filter(pk__gt=after_id)
+        # One more row tells whether there is a next page
+        page = list(window.order_by("pk")[:first + 1])
+
+        connection = build_connection(
+            UserConnection,
+            [(user.pk, user) for user in page[:first]],
+            start=0 if after_id is None else after_id + 1,
+            has_next_page=len(page) > first,
+            to_cursor=key_to_cursor,
+        )
+        connection.users = users
+        return connection
+
+
+def users_window(info, users):
+    """ `users` loading only the columns of the fields selected on their nodes. """
+    fields = selected_fields(info, "edges", "node")
+    columns = {"id"}
+    annotations = {}
+    for field in fields:
+        columns.update(UserNode.COLUMNS.get(field, ()))
+        if field in UserNode.ANNOTATIONS:
+            name, expression = UserNode.ANNOTATIONS[field]
+            annotations[name] = expression
+    return users.only(*sorted(columns)).annotate(**annotations)
 
 
 class CreateUser(graphene.Mutation):
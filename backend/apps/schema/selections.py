@@ -0,0 +1,32 @@
+from typing import Iterable, Iterator, Set
+
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode, SelectionSetNode
+
+
+def selected_fields(info, *path: str) -> Set[str]:
+    """
+    Names of the fields selected under the resolved field, following `path`
+    (e.g. "edges", "node" for the nodes of a connection). Fragments are
+    expanded, aliases resolved to their field.
+    """
+    selection_sets = [node.selection_set for node in info.field_nodes if node.selection_set]
+    for name in path:
+        selection_sets = [
+            field.selection_set
+            for field in _fields(info, selection_sets)
+            if field.name.value == name and field.selection_set
+        ]
+    return {field.name.value for field in _fields(info, selection_sets)}
+
+
+def _fields(info, selection_sets: Iterable[SelectionSetNode]) -> Iterator[FieldNode]:
+    for selection_set in selection_sets:
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection
+            elif isinstance(selection, InlineFragmentNode):
+                yield from _fields(info, [selection.selection_set])
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = info.fragments.get(selection.name.value)
+                if fragment is not None:
+                    yield from _fields(info, [fragment.selection_set])
@@ -0,0 +1,37 @@
+import json
+
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from apps.management.commands.bench_graphql import OPERATIONS
+
+
+class TestBenchGraphQL(TransactionTestCase):
+
+    def test_every_operation_is_benchmarked(self):
+        out = StringIO()
+
+        # The command creates and destroys its own test database
+        call_command(
+            "bench_graphql",
+            iterations=1,
+            warmup=0,
+            users=2,
+            cold_cache=True,
+            fast_hashing=True,
+            output="-",
+            stdout=out,
+        )
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(OPERATIONS), set(report["operations"]))
+        self.assertEqual(1, report["meta"]["options"]["iterations"])
+        for name, result in report["operations"].items():
+            with self.subTest(name):
+                self.assertEqual(1, result["iterations"])
+                self.assertGreater(result["ops_per_second"], 0)
+        # Cold caches: playlists come from the stub, users from the database
+        self.assertGreater(report["operations"]["specificPlaylistData"]["spotify_requests_per_op"], 0)
+        self.assertEqual(0, report["operations"]["users"]["spotify_requests_per_op"])
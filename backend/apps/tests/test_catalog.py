@@ -0,0 +1,129 @@
+import json
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from graphene_django.utils.testing import GraphQLTestCase
+
+from apps.api.catalog import catalog
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.api.spotify_token import app_token
+from apps.models import Artist, Playlist, PlaylistTrack, Track
+
+
+PLAYLIST_QUERY = """
+    query specificPlaylistData($playlistId: String, $offset: Int){
+        specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+            tracks {
+                id
+                artist
+                title
+                cover
+            }
+            lastPage
+        }
+    }
+"""
+
+
+class TestCatalogSync(GraphQLTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        # 25 recorded tracks cycled, the 22nd of each cycle is empty
+        self.stub = SpotifyStub(tracks=250, seed=0).start()
+        self.addCleanup(self.stub.stop)
+        settings = self.stub.override_settings()
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        app_token.get_access_token()
+        catalog.reset_stats()
+        self.stub.reset_stats()
+
+    def new_snapshot(self, tracks) -> None:
+        self.stub.tracks = tracks
+        self.stub.snapshot_id = f"{self.stub.snapshot_id}+"
+
+    def test_playlist_is_copied(self):
+        self.assertTrue(catalog.sync("foo"))
+
+        playlist = Playlist.objects.get(spotify_id="foo")
+        self.assertEqual((self.stub.snapshot_id, 250), (playlist.snapshot_id, playlist.total))
+        self.assertEqual(250, PlaylistTrack.objects.filter(playlist=playlist).count())
+        self.assertEqual(10, PlaylistTrack.objects.filter(playlist=playlist, track__isnull=True).count())
+        self.assertEqual(240, Track.objects.count())
+        self.assertEqual(len(self.stub.artists), Artist.objects.count())
+        first = PlaylistTrack.objects.get(playlist=playlist, position=0).track
+        self.assertEqual(self.stub.tracks[0]["track"]["id"], first.spotify_id)
+        self.assertEqual(
+            [artist["id"] for artist in self.stub.tracks[0]["track"]["artists"]],
+            list(first.artists.values_list("spotify_id", flat=True)),
+        )
+        requests = self.stub.stats()["requests"]
+        self.assertEqual(3, requests["playlist_items"])
+        # The snapshot is read again after each page, the last two are fetched together and may share it
+        self.assertIn(requests["playlist"], (3, 4))
+
+    def test_unchanged_snapshot_is_skipped(self):
+        catalog.sync("foo")
+        self.stub.reset_stats()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(catalog.sync("foo"))
+
+        self.assertEqual({"playlist": 1}, self.stub.stats()["requests"])
+        self.assertEqual(1, len(queries))
+        self.assertEqual({"skipped": 1, "synced": 1, "positions": 250}, catalog.stats())
+
+    def test_only_changed_positions_are_upserted(self):
+        catalog.sync("foo")
+        tracks = list(self.stub.tracks[:200])
+        tracks[3], tracks[4] = tracks[4], tracks[3]
+        self.new_snapshot(tracks)
+
+        self.assertTrue(catalog.sync("foo"))
+
+        self.assertEqual(250 + 2, catalog.stats()["positions"])
+        rows = PlaylistTrack.objects.filter(playlist__spotify_id="foo").order_by("position")
+        self.assertEqual(
+            [item["track"]["id"] if item["track"]["duration_ms"] else None for item in tracks],
+            [row.track.spotify_id if row.track else None for row in rows.select_related("track")],
+        )
+        self.assertEqual(200, Playlist.objects.get(spotify_id="foo").total)
+
+    @override_settings(SPOTIFY_CATALOG=True)
+    def test_synced_playlists_are_served_from_the_catalog(self):
+        expected = self.query(PLAYLIST_QUERY, variables={"playlistId": "foo", "offset": 240})
+        catalog.sync("foo")
+        cache.clear()
+        playlist_cache.store.local.clear()
+        app_token.get_access_token()
+        self.stub.reset_stats()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.query(PLAYLIST_QUERY, variables={"playlistId": "foo", "offset": 240})
+
+        self.assertResponseNoErrors(response)
+        self.assertEqual(json.loads(expected.content), json.loads(response.content))
+        # The playlist for its snapshot_id, its tracks from one query
+        self.assertEqual({"playlist": 1}, self.stub.stats()["requests"])
+        self.assertEqual(1, len(queries))
+
+    @override_settings(SPOTIFY_CATALOG=True)
+    def test_new_snapshots_are_served_by_spotify(self):
+        catalog.sync("foo")
+        self.new_snapshot(self.stub.tracks[:30])
+        self.stub.reset_stats()
+
+        response = self.query(PLAYLIST_QUERY, variables={"playlistId": "foo", "offset": 20})
+
+        content = json.loads(response.content)["data"]["specificPlaylistData"]
+        self.assertEqual(9, len(content["tracks"]))
+        self.assertTrue(content["lastPage"])
+        self.assertEqual({"playlist": 2, "playlist_items": 1}, self.stub.stats()["requests"])
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from apps.api.single_flight import SingleFlight
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_cache import TieredCache, playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.api.spotify_token import app_token
+
+
+class TestSingleFlight(SimpleTestCase):
+
+    def test_concurrent_calls_share_one_result(self):
+        flights = SingleFlight("test")
+        calls = mock.Mock(side_effect=lambda: time.sleep(0.2) or object())
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(lambda _: flights.do("key", calls), range(5)))
+
+        calls.assert_called_once()
+        self.assertEqual(1, len({id(result) for result in results}))
+        self.assertEqual({"calls": 5, "shared": 4}, flights.stats())
+
+    def test_followers_get_the_leader_exception(self):
+        flights = SingleFlight("test")
+        started = threading.Event()
+
+        def fail():
+            started.set()
+            time.sleep(0.2)
+            raise ValueError("upstream")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(flights.do, "key", fail)
+            started.wait()
+            follower = executor.submit(flights.do, "key", mock.Mock())
+
+        for future in (leader, follower):
+            with self.assertRaisesMessage(ValueError, "upstream"):
+                future.result()
+
+    def test_sequential_calls_are_not_shared(self):
+        flights = SingleFlight("test")
+        calls = mock.Mock(return_value="result")
+
+        flights.do("key", calls)
+        flights.do("key", calls)
+        flights.do("other", calls)
+
+        self.assertEqual(3, calls.call_count)
+
+    def test_concurrent_async_calls_share_one_result(self):
+        flights = SingleFlight("test")
+        calls = 0
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return calls
+
+        async def main():
+            return await asyncio.gather(*(flights.ado("key", call) for _ in range(5)))
+
+        self.assertEqual([1] * 5, asyncio.run(main()))
+
+
+class TestPlaylistQueriesCoalescing(TestCase):
+    """ Many users opening the same shared playlist at once. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(latency=0.2, tracks=50, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(SPOTIFY_USER_CLIENT_ID="user_client")
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        app_token.get_access_token()
+        self.stub.reset_stats()
+
+    def test_identical_queries_share_one_upstream_call_and_result(self):
+        def load(_):
+            return SpotifyAPI.get_tracks_from_my_suggestions(playlist_id="shared", offset=0, context=None)
+
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(load, range(10)))
+
+        # The playlist, its page and the snapshot checked after it
+        self.assertEqual({"playlist": 2, "playlist_items": 1}, self.stub.stats()["requests"])
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_other_offsets_are_fetched(self):
+        def load(offset):
+            return SpotifyAPI.get_tracks_from_my_suggestions(playlist_id="shared", offset=offset, context=None)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(load, (0, 0, 20, 20)))
+
+        requests = self.stub.stats()["requests"]
+        self.assertEqual(2, requests["playlist_items"])
+        # Snapshot checks of pages fetched together may be one request
+        self.assertIn(requests["playlist"], (2, 3))
+
+
+@override_settings(SPOTIFY_CACHE_LOCK=True, SPOTIFY_CACHE_LOCK_TIMEOUT=2)
+class TestCacheLock(TestCase):
+    """ The cache lock stands for another worker fetching the same key. """
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.store = TieredCache(local=None, shared_alias="default", local_timeout=0, name="test")
+        self.fetch = mock.Mock(return_value={"fetched": True})
+
+    def test_value_fetched_by_lock_holder_is_awaited(self):
+        cache.add("key:lock", True)
+        timer = threading.Timer(0.2, cache.set, args=("key", {"fetched": "elsewhere"}))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        value = self.store.get_or_set("key", self.fetch, timeout=60)
+
+        self.assertEqual({"fetched": "elsewhere"}, value)
+        self.fetch.assert_not_called()
+
+    def test_key_is_fetched_when_lock_holder_gives_up(self):
+        cache.add("key:lock", True)
+        timer = threading.Timer(0.2, cache.delete, args=("key:lock",))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        value = self.store.get_or_set("key", self.fetch, timeout=60)
+
+        self.assertEqual({"fetched": True}, value)
+        self.fetch.assert_called_once()
+
+    def test_lock_is_released_after_fetch(self):
+        self.store.get_or_set("key", self.fetch, timeout=60)
+
+        self.assertIsNone(cache.get("key:lock"))
+        self.assertEqual({"fetched": True}, cache.get("key"))
@@ -0,0 +1,193 @@
+import json
+
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, SimpleTestCase
+from django.utils import timezone
+from graphene_django.utils.testing import GraphQLTestCase
+from graphql_relay import offset_to_cursor
+
+from apps.api.pagination import page_offsets, take
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.api.spotify_token import app_token
+from backend.schema import async_schema
+from backend.views import AsyncGraphQLView
+
+
+PLAYLIST_TRACKS_QUERY = """
+    query playlistTracks($playlistId: String!, $first: Int, $after: String){
+        playlistTracks(playlistId: $playlistId, first: $first, after: $after) {
+            totalCount
+            playlist {
+                playlistName
+            }
+            pageInfo {
+                hasNextPage
+                hasPreviousPage
+                endCursor
+            }
+            edges {
+                cursor
+                node {
+                    id
+                }
+            }
+        }
+    }
+"""
+
+
+def page(offset: int, size: int, total: int) -> dict:
+    end = min(offset + size, total)
+    return {"items": list(range(offset, end)), "next": "next" if end < total else None, "total": total}
+
+
+def skip_odd(items):
+    return [None if item % 2 else item for item in items]
+
+
+class TestPagination(SimpleTestCase):
+
+    def test_aligned_pages_cover_the_window(self):
+        self.assertEqual([0], page_offsets(10, 30, 100))
+        self.assertEqual([0, 100], page_offsets(50, 100, 100))
+        self.assertEqual([50, 100], page_offsets(50, 100, 50, aligned=False))
+
+    def test_window_splits_and_merges_pages(self):
+        window = take({0: page(0, 100, 250), 100: page(100, 100, 250)}, start=90, count=20, parse=list)
+
+        self.assertEqual(list(range(90, 110)), [index for index, _ in window.items])
+        self.assertTrue(window.has_next)
+        self.assertIsNone(window.next_offset)
+
+    def test_skipped_items_ask_for_the_next_page(self):
+        window = take({0: page(0, 100, 250)}, start=0, count=60, parse=skip_odd)
+
+        self.assertEqual(50, len(window.items))
+        self.assertEqual(100, window.next_offset)
+
+    def test_last_window(self):
+        window = take({200: page(200, 100, 250)}, start=240, count=20, parse=list)
+
+        self.assertEqual(list(range(240, 250)), [item for _, item in window.items])
+        self.assertFalse(window.has_next)
+
+
+class TestTrackConnections(GraphQLTestCase):
+    """ Windows of any size over the 100-track pages cached by snapshot. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 25 recorded tracks cycled, the 22nd of each cycle is empty
+        cls.stub = SpotifyStub(tracks=250, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(SPOTIFY_USER_CLIENT_ID="user_client")
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        app_token.get_access_token()
+        self.stub.reset_stats()
+
+    def window(self, first=None, after=None) -> dict:
+        response = self.query(PLAYLIST_TRACKS_QUERY, variables={"playlistId": "foo", "first": first, "after": after})
+        self.assertResponseNoErrors(response)
+        return json.loads(response.content)["data"]["playlistTracks"]
+
+    def test_windows_follow_cursors(self):
+        expected = [track["track"]["id"] for track in self.stub.tracks if track["track"]["duration_ms"]]
+
+        first = self.window(first=40)
+        # The playlist, its first page and the snapshot checked after it
+        self.assertEqual({"playlist": 2, "playlist_items": 1}, self.stub.stats()["requests"])
+        second = self.window(first=100, after=first["pageInfo"]["endCursor"])
+        # Crosses into the second page, the first one is cached
+        self.assertEqual(2, self.stub.stats()["requests"]["playlist_items"])
+        last = self.window(first=100, after=second["pageInfo"]["endCursor"])
+
+        ids = [edge["node"]["id"] for window in (first, second, last) for edge in window["edges"]]
+        self.assertEqual(expected, ids)
+        self.assertEqual([True, True, False], [window["pageInfo"]["hasNextPage"] for window in (first, second, last)])
+        self.assertFalse(first["pageInfo"]["hasPreviousPage"])
+        self.assertEqual(250, first["totalCount"])
+        self.assertEqual("Jolify Suggestions", first["playlist"]["playlistName"])
+
+    def test_cursors_are_spotify_offsets(self):
+        window = self.window(first=25)
+
+        # The empty 22nd track is skipped, not its offset
+        self.assertEqual(offset_to_cursor(25), window["pageInfo"]["endCursor"])
+        self.assertEqual(25, len(window["edges"]))
+
+    async def test_async_window(self):
+        request = AsyncRequestFactory().post(
+            "/graphql/",
+            data={"query": PLAYLIST_TRACKS_QUERY, "variables": {"playlistId": "foo", "first": 100, "after": offset_to_cursor(49)}},
+            content_type="application/json",
+        )
+        request.user = mock.Mock(is_anonymous=True)
+
+        response = await AsyncGraphQLView.as_view(schema=async_schema)(request)
+
+        window = json.loads(response.content)["data"]["playlistTracks"]
+        self.assertEqual(100, len(window["edges"]))
+        self.assertTrue(window["pageInfo"]["hasPreviousPage"])
+        # Both pages of the window fetched at once, their snapshot checks may be one request
+        requests = self.stub.stats()["requests"]
+        self.assertEqual(2, requests["playlist_items"])
+        self.assertIn(requests["playlist"], (2, 3))
+
+    def test_first_is_capped(self):
+        response = self.query(PLAYLIST_TRACKS_QUERY, variables={"playlistId": "foo", "first": 101})
+
+        self.assertIn("exceeds the `first` limit of 100", json.loads(response.content)["errors"][0]["message"])
+        self.assertEqual({}, self.stub.stats()["requests"])
+
+    def test_invalid_cursor(self):
+        response = self.query(PLAYLIST_TRACKS_QUERY, variables={"playlistId": "foo", "after": "foo"})
+
+        self.assertIn("Invalid cursor", json.loads(response.content)["errors"][0]["message"])
+
+
+class TestUserPlaylistsWindow(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings()
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        SpotifyClient.reset()
+        self.stub.reset_stats()
+        self.context = mock.Mock(user=mock.Mock(
+            accepted_account=True,
+            spotify_access_token="token",
+            spotify_token_expires_at=timezone.now() + timedelta(hours=1),
+        ))
+
+    def test_skipped_playlists_keep_their_offsets(self):
+        # The 3rd playlist has no name, the 6th no image
+        first = SpotifyAPI.get_user_playlists_window(start=0, count=3, context=self.context)
+        second = SpotifyAPI.get_user_playlists_window(start=4, count=3, context=self.context)
+
+        self.assertEqual([0, 1, 3], [offset for offset, _ in first["playlists"]])
+        self.assertTrue(first["has_next_page"])
+        self.assertEqual([4, 6], [offset for offset, _ in second["playlists"]])
+        self.assertFalse(second["has_next_page"])
+        self.assertEqual("jolify_listener", first["owner"]["id"])
+        self.assertEqual({"current_user_playlists": 2}, self.stub.stats()["requests"])
@@ -0,0 +1,83 @@
+from prometheus_client import REGISTRY
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from apps.api.metrics import MAX_OPERATION_LABELS, endpoint_label, operation_label
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(
+            SPOTIFY_USER_CLIENT_ID="user_client",
+            SPOTIFY_HTTP_BACKOFF_FACTOR=0,
+        )
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+
+    def test_endpoint_label_hides_ids(self):
+        self.assertEqual("playlists/{id}/tracks", endpoint_label("https://api.spotify.com/v1/playlists/37i9dQZF1/tracks?limit=20"))
+        self.assertEqual("playlists/{id}", endpoint_label("/v1/playlists/37i9dQZF1"))
+        self.assertEqual("me/playlists", endpoint_label("https://api.spotify.com/v1/me/playlists"))
+        self.assertEqual("api/token", endpoint_label("https://accounts.spotify.com/api/token"))
+
+    def test_operation_label_is_bounded(self):
+        seen = {f"operation{index}" for index in range(MAX_OPERATION_LABELS)}
+
+        with mock.patch("apps.api.metrics._operation_labels", seen):
+            self.assertEqual("operation0", operation_label("operation0"))
+            self.assertEqual("other", operation_label("neverSeenBefore"))
+        self.assertEqual("anonymous", operation_label(None))
+
+    def test_spotify_requests_and_cache_are_counted(self):
+        self.stub.fail(429, times=1, retry_after=0)
+        before = {
+            "tracks": sample("jolify_spotify_responses_total", endpoint="playlists/{id}/tracks", status="200"),
+            "retries": sample("jolify_spotify_retries_total", endpoint="api/token", status="429"),
+            "refreshes": sample("jolify_spotify_token_refreshes_total", kind="app"),
+            "misses": sample("jolify_cache_requests_total", cache="playlist", result="misses"),
+            "hits": sample("jolify_cache_requests_total", cache="playlist", result="local_hits"),
+        }
+
+        SpotifyAPI.get_playlist_data(playlist_id="foo", offset=0, context=None)
+        SpotifyAPI.get_playlist_data(playlist_id="foo", offset=0, context=None)
+
+        self.assertEqual(1, sample("jolify_spotify_responses_total", endpoint="playlists/{id}/tracks", status="200") - before["tracks"])
+        # The first request (for the app token) was rate limited then retried
+        self.assertEqual(1, sample("jolify_spotify_retries_total", endpoint="api/token", status="429") - before["retries"])
+        self.assertEqual(1, sample("jolify_spotify_token_refreshes_total", kind="app") - before["refreshes"])
+        self.assertEqual(2, sample("jolify_cache_requests_total", cache="playlist", result="misses") - before["misses"])
+        self.assertEqual(2, sample("jolify_cache_requests_total", cache="playlist", result="local_hits") - before["hits"])
+
+    def test_metrics_view(self):
+        self.client.post("/graphql/", {"query": "query users { users { totalCount } }"}, content_type="application/json")
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn('jolify_graphql_operation_seconds_count{operation="users"}', response.content.decode())
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_view_requires_token(self):
+        self.assertEqual(403, self.client.get("/metrics").status_code)
+        self.assertEqual(200, self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code)
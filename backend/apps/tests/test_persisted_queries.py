@@ -0,0 +1,121 @@
+import json
+import tempfile
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from apps.schema import documents as documents_module
+from apps.schema.documents import documents, persisted_queries, query_hash
+
+
+QUERY = "query ping { __typename }"
+
+
+class TestPersistedQueries(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        persisted_queries.clear()
+        documents.clear()
+        self.addCleanup(persisted_queries.clear)
+
+    def post(self, query=None, sha256_hash=None):
+        data = {"query": query} if query is not None else {}
+        if sha256_hash is not None:
+            data["extensions"] = {"persistedQuery": {"version": 1, "sha256Hash": sha256_hash}}
+        return self.client.post("/graphql/", data, content_type="application/json")
+
+    def test_unknown_hash_asks_for_the_query(self):
+        response = self.post(sha256_hash=query_hash(QUERY))
+
+        self.assertEqual(200, response.status_code)
+        error = response.json()["errors"][0]
+        self.assertEqual("PersistedQueryNotFound", error["message"])
+        self.assertEqual("PERSISTED_QUERY_NOT_FOUND", error["extensions"]["code"])
+
+    def test_registered_query_is_sent_as_hash(self):
+        registered = self.post(QUERY, sha256_hash=query_hash(QUERY))
+        self.assertEqual({"__typename": "Query"}, registered.json()["data"])
+
+        response = self.post(sha256_hash=query_hash(QUERY))
+
+        self.assertEqual({"__typename": "Query"}, response.json()["data"])
+
+    def test_get_request_with_hash(self):
+        self.post(QUERY, sha256_hash=query_hash(QUERY))
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(QUERY)}}
+
+        response = self.client.get("/graphql/", {"extensions": json.dumps(extensions)}, HTTP_ACCEPT="application/json")
+
+        self.assertEqual({"__typename": "Query"}, response.json()["data"])
+
+    def test_queries_are_resolved_once_per_request(self):
+        self.post(QUERY, sha256_hash=query_hash(QUERY))
+
+        with mock.patch.object(persisted_queries, "resolve", wraps=persisted_queries.resolve) as resolve:
+            response = self.post(sha256_hash=query_hash(QUERY))
+
+        self.assertEqual({"__typename": "Query"}, response.json()["data"])
+        resolve.assert_called_once()
+
+    def test_hash_must_match_query(self):
+        response = self.post(QUERY, sha256_hash=query_hash("query other { __typename }"))
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual("INVALID_SHA256_HASH", response.json()["errors"][0]["extensions"]["code"])
+
+    def test_documents_are_parsed_and_validated_once(self):
+        with mock.patch.object(documents_module, "parse", wraps=documents_module.parse) as parse, \
+                mock.patch.object(documents_module, "validate", wraps=documents_module.validate) as validate:
+            for _ in range(3):
+                self.assertEqual({"__typename": "Query"}, self.post(QUERY).json()["data"])
+
+        parse.assert_called_once()
+        validate.assert_called_once()
+        self.assertEqual({"hits": 2, "misses": 1}, documents.stats())
+
+    def test_invalid_documents_are_not_cached(self):
+        for _ in range(2):
+            response = self.post("query broken { missingField }")
+            self.assertEqual(400, response.status_code)
+
+        self.assertEqual({"hits": 0, "misses": 2}, documents.stats())
+
+
+class TestPersistedQueriesOnly(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        persisted_queries.clear()
+        self.addCleanup(persisted_queries.clear)
+        manifest = tempfile.NamedTemporaryFile("w", suffix=".json")
+        self.addCleanup(manifest.close)
+        json.dump({query_hash(QUERY): QUERY}, manifest)
+        manifest.flush()
+        settings = override_settings(GRAPHQL_PERSISTED_QUERIES_FILE=manifest.name, GRAPHQL_PERSISTED_QUERIES_ONLY=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def post(self, data):
+        return self.client.post("/graphql/", data, content_type="application/json")
+
+    def test_manifest_queries_are_executed(self):
+        persisted = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(QUERY)}}
+
+        self.assertEqual({"__typename": "Query"}, self.post({"extensions": persisted}).json()["data"])
+        # Full text of a manifest query too
+        self.assertEqual({"__typename": "Query"}, self.post({"query": QUERY}).json()["data"])
+
+    def test_other_queries_are_refused(self):
+        other = "query other { __typename }"
+        persisted = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(other)}}
+
+        refused = self.post({"query": other})
+        not_registered = self.post({"query": other, "extensions": persisted})
+
+        self.assertEqual("PERSISTED_QUERY_REQUIRED", refused.json()["errors"][0]["extensions"]["code"])
+        self.assertEqual("PERSISTED_QUERY_NOT_SUPPORTED", not_registered.json()["errors"][0]["extensions"]["code"])
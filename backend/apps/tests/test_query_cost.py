@@ -0,0 +1,159 @@
+import json
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, override_settings
+from graphene_django.utils.testing import GraphQLTestCase
+
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.api.spotify_token import app_token
+from apps.schema.documents import documents
+from backend.schema import async_schema
+from backend.views import AsyncGraphQLView
+
+
+TRACKS_QUERY = """
+    query playlistTracks($playlistId: String!, $first: Int){
+        playlistTracks(playlistId: $playlistId, first: $first) {
+            edges {
+                node {
+                    id
+                    audioFeatures {
+                        energy
+                    }
+                    album {
+                        name
+                    }
+                }
+            }
+        }
+    }
+"""
+
+FULL_PLAYLIST_QUERY = """
+    query fullPlaylistData($playlistId: String){
+        fullPlaylistData(playlistId: $playlistId) {
+            tracks {
+                id
+                audioFeatures {
+                    energy
+                }
+            }
+        }
+    }
+"""
+
+
+class TestQueryCost(GraphQLTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(tracks=250, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings()
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        documents.clear()
+        SpotifyClient.reset()
+        app_token.get_access_token()
+        self.stub.reset_stats()
+
+    def test_cost_is_reported(self):
+        response = self.query(TRACKS_QUERY, variables={"playlistId": "foo", "first": 5})
+
+        self.assertResponseNoErrors(response)
+        # playlistTracks 10, edges 1, and 1.6 per node (audioFeatures 0.1, album 0.5) for a `first` of 100
+        self.assertEqual(
+            {"requested": 171, "maximum": 5000, "depth": 5, "maxDepth": 10},
+            json.loads(response.content)["extensions"]["cost"],
+        )
+
+    def test_literal_first_is_counted(self):
+        query = TRACKS_QUERY.replace("first: $first", "first: 5").replace(", $first: Int", "")
+
+        response = self.query(query, variables={"playlistId": "foo"})
+
+        self.assertEqual(19, json.loads(response.content)["extensions"]["cost"]["requested"])
+
+    @override_settings(GRAPHQL_MAX_COST=100)
+    def test_variables_are_costed_at_the_limit(self):
+        query = TRACKS_QUERY.replace("$first: Int", "$first: Int = 1")
+
+        # The cost of a document is cached, before its variables are known
+        for first in (1, 100):
+            response = self.query(query, variables={"playlistId": "foo", "first": first})
+
+            self.assertEqual(400, response.status_code)
+            self.assertEqual(171, json.loads(response.content)["errors"][0]["extensions"]["cost"]["requested"])
+        self.assertEqual({}, self.stub.stats()["requests"])
+
+    @override_settings(GRAPHQL_MAX_COST=250)
+    def test_costly_operations_are_refused(self):
+        response = self.query(FULL_PLAYLIST_QUERY, variables={"playlistId": "foo"})
+
+        self.assertEqual(400, response.status_code)
+        error = json.loads(response.content)["errors"][0]
+        self.assertEqual("QUERY_TOO_COMPLEX", error["extensions"]["code"])
+        self.assertEqual(301, error["extensions"]["cost"]["requested"])
+        # Nothing was asked to Spotify
+        self.assertEqual({}, self.stub.stats()["requests"])
+
+    @override_settings(GRAPHQL_MAX_DEPTH=4)
+    def test_deep_operations_are_refused(self):
+        response = self.query(TRACKS_QUERY, variables={"playlistId": "foo", "first": 5})
+
+        self.assertEqual(400, response.status_code)
+        error = json.loads(response.content)["errors"][0]
+        self.assertEqual("QUERY_TOO_DEEP", error["extensions"]["code"])
+        self.assertIn("is 5 fields deep", error["message"])
+
+    def test_fragments_are_counted(self):
+        query = """
+            query userPlaylists {
+                userPlaylists(first: 10) { ...playlists }
+            }
+            fragment playlists on PlaylistConnection {
+                edges { node { name } }
+            }
+        """
+
+        with mock.patch("apps.api.spotify.SpotifyAPI.get_user_playlists_window") as window:
+            window.return_value = {"success": False}
+            response = self.query(query)
+
+        cost = json.loads(response.content)["extensions"]["cost"]
+        # userPlaylists 10, edges 1 and 10 nodes
+        self.assertEqual({"requested": 21, "depth": 4}, {key: cost[key] for key in ("requested", "depth")})
+
+    def test_introspection_is_free(self):
+        response = self.query("query { __schema { types { name fields { name type { name ofType { name } } } } } }")
+
+        self.assertResponseNoErrors(response)
+        self.assertEqual(0, json.loads(response.content)["extensions"]["cost"]["requested"])
+
+    @override_settings(GRAPHQL_COST_EXTENSIONS=False)
+    def test_extensions_can_be_disabled(self):
+        response = self.query("query { __typename }")
+
+        self.assertNotIn("extensions", json.loads(response.content))
+
+    async def test_async_cost(self):
+        request = AsyncRequestFactory().post(
+            "/graphql/",
+            data={"query": TRACKS_QUERY, "variables": {"playlistId": "foo", "first": 5}},
+            content_type="application/json",
+        )
+        request.user = mock.Mock(is_anonymous=True)
+
+        response = await AsyncGraphQLView.as_view(schema=async_schema)(request)
+
+        self.assertEqual(171, json.loads(response.content)["extensions"]["cost"]["requested"])
@@ -0,0 +1,210 @@
+import json
+
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphene_django.utils.testing import GraphQLTestCase
+from graphql_jwt.shortcuts import get_token
+from spotipy.exceptions import SpotifyException
+
+from apps.api.catalog import catalog
+from apps.api.recommendations import recommender
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.models import Artist, Playlist, PlaylistTrack, Recommendation, Track, User
+
+
+RECOMMENDED_TRACKS_QUERY = """
+    query recommendedTracks($first: Int, $after: String){
+        recommendedTracks(first: $first, after: $after) {
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+            edges {
+                node {
+                    id
+                    title
+                }
+            }
+        }
+    }
+"""
+
+
+class TestRecommendations(GraphQLTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        recommender.reset_stats()
+        self.user = User.objects.create(username="foo", email="foo@bar.com", accepted_account=True)
+        self.tracks = {}
+        # The user's library, then playlists sharing its tracks or not
+        self.library = self.playlist("library", "ab")
+        self.user.library.add(self.library)
+        self.playlist("p1", "abcd")
+        self.playlist("p2", "ac")
+        self.playlist("p3", "be")
+        self.playlist("p4", "xy")
+
+    def track(self, name: str) -> Track:
+        if name not in self.tracks:
+            track = Track.objects.create(
+                spotify_id=name,
+                name=name,
+                title=name,
+                artist="",
+                link=f"https://open.spotify.com/track/{name}",
+                cover="https://i.scdn.co/image/foo",
+            )
+            self.tracks[name] = track
+        return self.tracks[name]
+
+    def playlist(self, spotify_id: str, track_names: str) -> Playlist:
+        playlist = Playlist.objects.create(
+            spotify_id=spotify_id,
+            snapshot_id="snapshot",
+            name=spotify_id,
+            url=f"https://open.spotify.com/playlist/{spotify_id}",
+            total=len(track_names),
+            synced_at=timezone.now(),
+        )
+        PlaylistTrack.objects.bulk_create(
+            PlaylistTrack(playlist=playlist, position=position, track=self.track(name))
+            for position, name in enumerate(track_names)
+        )
+        return playlist
+
+    def recommended(self, user: User) -> list:
+        return list(
+            Recommendation.objects.filter(user=user).order_by("rank").values_list("track__spotify_id", flat=True)
+        )
+
+    def query_as(self, user: User, variables: dict = None):
+        return self.query(
+            RECOMMENDED_TRACKS_QUERY,
+            variables=variables,
+            headers={"HTTP_AUTHORIZATION": f"JWT {get_token(user)}"},
+        )
+
+    def test_tracks_sharing_playlists_are_recommended(self):
+        done = recommender.refresh()
+
+        # c shares 3 playlists with a and b, but is in 2 of them, d 2 for 1
+        self.assertEqual(["c", "d", "e"], self.recommended(self.user))
+        self.assertEqual({"users": 1, "recommendations": 3, "cells": 12}, done)
+        self.assertEqual({"runs": 1, "users": 1, "recommendations": 3}, recommender.stats())
+
+    @override_settings(RECOMMENDATIONS_ARTIST_WEIGHT=4.0)
+    def test_artists_of_the_library_weigh_more(self):
+        artist = Artist.objects.create(spotify_id="alto", name="Alto")
+        self.track("a").artists.add(artist)
+        self.track("e").artists.add(artist)
+
+        recommender.refresh()
+
+        self.assertEqual(["e", "c", "d"], self.recommended(self.user))
+
+    @override_settings(RECOMMENDATIONS_TOP_K=2)
+    def test_suggestions_are_replaced(self):
+        other = User.objects.create(username="bar", email="bar@foo.com", accepted_account=False)
+        other.library.add(self.library)
+        Recommendation.objects.create(user=other, rank=0, track=self.track("x"), score=1.0)
+
+        recommender.refresh()
+
+        self.assertEqual(["c", "d"], self.recommended(self.user))
+        self.assertEqual([], self.recommended(other))
+
+    def test_suggestions_are_served_in_windows(self):
+        recommender.refresh()
+
+        first = self.query_as(self.user, {"first": 2})
+        self.assertResponseNoErrors(first)
+        first = json.loads(first.content)["data"]["recommendedTracks"]
+        second = self.query_as(self.user, {"first": 2, "after": first["pageInfo"]["endCursor"]})
+        second = json.loads(second.content)["data"]["recommendedTracks"]
+
+        self.assertEqual(["c", "d"], [edge["node"]["id"] for edge in first["edges"]])
+        self.assertTrue(first["pageInfo"]["hasNextPage"])
+        self.assertEqual(["e"], [edge["node"]["id"] for edge in second["edges"]])
+        self.assertFalse(second["pageInfo"]["hasNextPage"])
+
+    def test_windows_are_one_query(self):
+        recommender.refresh()
+
+        with CaptureQueriesContext(connection) as queries:
+            window = recommender.window(self.user, 1, 1)
+
+        self.assertEqual(["d"], [track.id for _, track in window.items])
+        self.assertTrue(window.has_next)
+        self.assertEqual(1, len(queries))
+
+    def test_not_accepted_users_get_no_suggestions(self):
+        recommender.refresh()
+        self.user.accepted_account = False
+        self.user.save()
+
+        response = self.query_as(self.user)
+
+        self.assertResponseNoErrors(response)
+        self.assertEqual([], json.loads(response.content)["data"]["recommendedTracks"]["edges"])
+
+
+class TestLibrarySync(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings()
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        self.user = User.objects.create(
+            username="foo",
+            email="foo@bar.com",
+            accepted_account=True,
+            spotify_access_token="access",
+            spotify_token_expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.stub.reset_stats()
+
+    def test_library_playlists_are_synced_and_linked(self):
+        stale = Playlist.objects.create(spotify_id="stale", snapshot_id="stale", url="https://open.spotify.com/", synced_at=timezone.now())
+        self.user.library.add(stale)
+
+        playlist_ids = catalog.sync_library(self.user)
+
+        self.assertEqual([playlist["id"] for playlist in self.stub.user_playlists], playlist_ids)
+        self.assertEqual(set(playlist_ids), set(self.user.library.values_list("spotify_id", flat=True)))
+        # One page each, its snapshot checked after it
+        self.assertEqual(2 * len(playlist_ids), self.stub.stats()["requests"]["playlist"])
+
+    def test_failed_playlists_are_skipped(self):
+        private = self.stub.user_playlists[1]["id"]
+        sync = catalog.sync
+
+        def sync_or_fail(playlist_id, force=False):
+            if playlist_id == private:
+                raise SpotifyException(404, -1, "Not found.")
+            return sync(playlist_id, force=force)
+
+        with mock.patch.object(catalog, "sync", side_effect=sync_or_fail), self.assertLogs("apps.api.catalog", "ERROR") as logs:
+            playlist_ids = catalog.sync_library(self.user)
+
+        self.assertIn(private, playlist_ids)
+        self.assertEqual(set(playlist_ids) - {private}, set(self.user.library.values_list("spotify_id", flat=True)))
+        self.assertIn(private, logs.output[0])
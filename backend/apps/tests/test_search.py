@@ -0,0 +1,103 @@
+import json
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from graphene_django.utils.testing import GraphQLTestCase
+
+from apps.api.catalog import catalog
+from apps.api.search import fts5_query
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.models import Track
+
+
+SEARCH_TRACKS_QUERY = """
+    query searchTracks($query: String!, $first: Int, $after: String){
+        searchTracks(query: $query, first: $first, after: $after) {
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+            edges {
+                node {
+                    title
+                    artist
+                }
+            }
+        }
+    }
+"""
+
+
+class TestSearch(GraphQLTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings()
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        catalog.sync("foo")
+        self.stub.reset_stats()
+
+    def search(self, query: str, **variables) -> dict:
+        response = self.query(SEARCH_TRACKS_QUERY, variables={"query": query, **variables})
+        self.assertResponseNoErrors(response)
+        return json.loads(response.content)["data"]["searchTracks"]
+
+    @staticmethod
+    def titles(results: dict) -> list:
+        return [edge["node"]["title"] for edge in results["edges"]]
+
+    def test_words_are_matched(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = self.search("harbour")
+
+        self.assertEqual({"Midnight Harbour", "Harbour Lights "}, set(self.titles(results)[:2]))
+        # Served from the catalog only, by one query
+        self.assertEqual(1, len([query for query in queries if "apps_track" in query["sql"]]))
+        self.assertEqual({}, self.stub.stats()["requests"])
+
+    def test_misspelled_words_are_matched(self):
+        self.assertEqual("Foxglove", self.titles(self.search("foxgolve"))[0])
+
+    def test_artists_are_matched(self):
+        results = self.search("lowland choir", first=4)
+
+        self.assertEqual({"The Lowland Choir"}, {edge["node"]["artist"] for edge in results["edges"]})
+
+    def test_results_are_paginated(self):
+        first = self.search("static", first=1)
+        second = self.search("static", first=1, after=first["pageInfo"]["endCursor"])
+
+        self.assertEqual({"Slow Static", "Golden Static "}, set(self.titles(first) + self.titles(second)))
+        self.assertTrue(first["pageInfo"]["hasNextPage"])
+
+    def test_index_follows_the_catalog(self):
+        Track.objects.filter(title="Foxglove").update(title="Nightshade")
+
+        self.assertEqual([], [title for title in self.titles(self.search("foxglove")) if title == "Foxglove"])
+        self.assertEqual("Nightshade", self.titles(self.search("nightshade"))[0])
+
+    def test_short_queries_match_nothing(self):
+        self.assertIsNone(fts5_query("a b"))
+        self.assertEqual([], self.search("ab")["edges"])
+
+    def test_playlists_are_searched(self):
+        response = self.query('query { searchPlaylists(query: "jolify curators") { edges { node { id name } } } }')
+
+        self.assertResponseNoErrors(response)
+        self.assertEqual(
+            [{"id": "foo", "name": "Jolify Suggestions"}],
+            [edge["node"] for edge in json.loads(response.content)["data"]["searchPlaylists"]["edges"]],
+        )
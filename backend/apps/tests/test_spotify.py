@@ -0,0 +1,555 @@
+import gc
+import httpx
+import json
+import threading
+import time
+
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from datetime import timedelta
+from io import StringIO
+from spotipy.exceptions import SpotifyException
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from graphene_django.utils.testing import GraphQLTestCase
+
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_async import AsyncSpotify, AsyncSpotifyAPI, AsyncSpotifyClient
+from apps.api.spotify_cache import LRUCache, PlaylistCache, TieredCache, playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_token import AppTokenProvider, user_tokens
+from apps.models.user import User
+from backend.schema import async_schema
+from backend.views import AsyncGraphQLView
+
+
+def track_item(index: int) -> dict:
+    return {
+        "track": {
+            "id": f"track{index}",
+            "name": f"Song {index} (Remastered) - Live",
+            "duration_ms": 1000,
+            "preview_url": None,
+            "external_urls": {"spotify": f"https://open.spotify.com/track/track{index}"},
+            "artists": [{"id": f"artist{index}", "name": f"Artist {index}"}],
+            "album": {"id": f"album{index}", "images": [{"url": f"https://i.scdn.co/image/{index}"}]},
+        }
+    }
+
+
+def playlist_item(snapshot_id: str = "snapshot1") -> dict:
+    return {
+        "name": "Foo playlist",
+        "description": "Bar",
+        "external_urls": {"spotify": "https://open.spotify.com/playlist/foo"},
+        "owner": {"display_name": "foo", "external_urls": {"spotify": "https://open.spotify.com/user/foo"}},
+        "snapshot_id": snapshot_id,
+    }
+
+
+class FakeSpotify:
+    """ Stands for a spotipy client over a playlist of `total` tracks. """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.calls = []
+
+    def playlist(self, playlist_id, fields=None, **kwargs):
+        self.calls.append(("playlist", playlist_id))
+        return playlist_item()
+
+    def current_user_playlists(self, limit=50, offset=0):
+        self.calls.append(("current_user_playlists", offset))
+        owner = {"id": "foo", "display_name": "foo", "external_urls": {"spotify": "https://open.spotify.com/user/foo"}}
+        return {
+            "items": [{
+                "id": "playlist1",
+                "name": "Foo playlist",
+                "description": "",
+                "owner": owner,
+                "external_urls": {"spotify": "https://open.spotify.com/playlist/playlist1"},
+                "images": [{"url": "https://i.scdn.co/image/playlist1"}],
+            }],
+            "next": None,
+        }
+
+    def playlist_items(self, playlist_id, fields=None, limit=100, offset=0, **kwargs):
+        self.calls.append(("playlist_items", offset))
+        end = min(offset + limit, self.total)
+        return {
+            "items": [track_item(index) for index in range(offset, end)],
+            "next": "next" if end < self.total else None,
+            "total": self.total,
+        }
+
+
+class FakeAsyncSpotify:
+    """ Async wrapper of FakeSpotify, standing for AsyncSpotify. """
+
+    def __init__(self, spotify: FakeSpotify):
+        self.spotify = spotify
+
+    async def playlist(self, *args, **kwargs):
+        return self.spotify.playlist(*args, **kwargs)
+
+    async def playlist_items(self, *args, **kwargs):
+        return self.spotify.playlist_items(*args, **kwargs)
+
+    async def current_user_playlists(self, *args, **kwargs):
+        return self.spotify.current_user_playlists(*args, **kwargs)
+
+
+class TestSpotifyClient(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        SpotifyClient.reset()
+
+    def test_api_clients_share_session(self):
+        first = SpotifyClient.api(auth="foo")
+        second = SpotifyClient.api(auth="bar")
+
+        self.assertIs(first._session, second._session)
+        self.assertIs(SpotifyClient.session(), first._session)
+
+    def test_session_survives_client_garbage_collection(self):
+        session = SpotifyClient.session()
+        adapter = session.get_adapter("https://api.spotify.com/")
+        SpotifyClient.api(auth="foo")
+        gc.collect()
+
+        self.assertIs(SpotifyClient.session(), session)
+        self.assertIs(session.get_adapter("https://api.spotify.com/"), adapter)
+
+    @override_settings(SPOTIFY_API_URL="http://127.0.0.1:9/v1/")
+    def test_api_uses_configured_prefix(self):
+        client = SpotifyClient.api(auth="foo")
+
+        self.assertEqual("http://127.0.0.1:9/v1/", client.prefix)
+
+    def test_oauth_link_is_built_without_request(self):
+        user = User.objects.create(username="foo", email="foo@bar.com")
+        context = mock.Mock(user=user)
+
+        with mock.patch.object(SpotifyClient.session(), "request") as request:
+            auth_link = SpotifyAPI.get_spotify_oauth_link(context=context)
+
+        request.assert_not_called()
+        self.assertTrue(auth_link["success"])
+        query = parse_qs(urlparse(auth_link["href"]).query)
+        self.assertEqual([str(user.id)], query["state"])
+        self.assertEqual(["code"], query["response_type"])
+
+
+class TestAppTokenProvider(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.provider = AppTokenProvider()
+        self.response = mock.Mock()
+        self.response.json.return_value = {"access_token": "app_token", "expires_in": 3600}
+
+    def test_token_is_fetched_once_then_served_from_cache(self):
+        with mock.patch.object(SpotifyClient, "post", return_value=self.response) as post:
+            self.assertEqual("app_token", self.provider.get_access_token())
+            self.assertEqual("app_token", self.provider.get_access_token())
+
+        post.assert_called_once()
+        self.assertEqual(
+            {"hits": 1, "misses": 1, "refreshes": 1},
+            self.provider.stats()
+        )
+
+    def test_concurrent_misses_share_one_token_request(self):
+        def slow_post(*args, **kwargs):
+            time.sleep(0.1)
+            return self.response
+
+        with mock.patch.object(SpotifyClient, "post", side_effect=slow_post) as post:
+            threads = [threading.Thread(target=self.provider.get_access_token) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        post.assert_called_once()
+
+    @override_settings(SPOTIFY_TOKEN_REFRESH_MARGIN=300)
+    def test_expiring_token_is_refreshed_proactively(self):
+        cache.set(
+            AppTokenProvider._cache_key(),
+            {"access_token": "old_token", "expires_at": time.time() + 60},
+        )
+
+        with mock.patch.object(SpotifyClient, "post", return_value=self.response) as post:
+            # The still valid token is served while a fresh one is fetched
+            self.assertEqual("old_token", self.provider.get_access_token())
+            self.assertEqual("app_token", self.provider.get_access_token())
+
+        post.assert_called_once()
+
+
+class TestPlaylistCache(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.playlist_cache = PlaylistCache(TieredCache(
+            local=LRUCache(maxsize=16),
+            shared_alias="default",
+            local_timeout=30,
+        ))
+        self.spotipy_auth = mock.Mock()
+        self.spotipy_auth.playlist.return_value = playlist_item()
+        self.spotipy_auth.playlist_items.return_value = {
+            "items": [track_item(index) for index in range(20)],
+            "next": None,
+            "total": 20,
+        }
+
+    def test_repeat_views_are_served_from_cache(self):
+        for _ in range(3):
+            playlist = self.playlist_cache.playlist(self.spotipy_auth, "foo")
+            self.playlist_cache.tracks(self.spotipy_auth, "foo", playlist["snapshot_id"], limit=20, offset=0)
+
+        # The metadata, then the snapshot checked after the page
+        self.assertEqual(2, self.spotipy_auth.playlist.call_count)
+        self.spotipy_auth.playlist_items.assert_called_once()
+        self.assertEqual(
+            {"local_hits": 4, "shared_hits": 0, "misses": 2, "stale_hits": 0},
+            self.playlist_cache.store.stats()
+        )
+
+    def test_shared_tier_is_used_when_local_tier_misses(self):
+        self.playlist_cache.playlist(self.spotipy_auth, "foo")
+        self.playlist_cache.store.local.clear()
+        self.playlist_cache.playlist(self.spotipy_auth, "foo")
+
+        self.spotipy_auth.playlist.assert_called_once()
+        self.assertEqual(1, self.playlist_cache.store.stats()["shared_hits"])
+
+    def test_new_snapshot_is_fetched_after_invalidation(self):
+        playlist = self.playlist_cache.playlist(self.spotipy_auth, "foo")
+        self.playlist_cache.tracks(self.spotipy_auth, "foo", playlist["snapshot_id"], limit=20, offset=0)
+
+        self.spotipy_auth.playlist.return_value = playlist_item(snapshot_id="snapshot2")
+        self.playlist_cache.invalidate("foo")
+        playlist = self.playlist_cache.playlist(self.spotipy_auth, "foo")
+        self.playlist_cache.tracks(self.spotipy_auth, "foo", playlist["snapshot_id"], limit=20, offset=0)
+
+        self.assertEqual("snapshot2", playlist["snapshot_id"])
+        self.assertEqual(2, self.spotipy_auth.playlist_items.call_count)
+
+    def test_pages_of_an_edited_playlist_are_not_cached(self):
+        playlist = self.playlist_cache.playlist(self.spotipy_auth, "foo")
+        # Edited since its metadata was cached
+        self.spotipy_auth.playlist.return_value = playlist_item(snapshot_id="snapshot2")
+
+        for _ in range(2):
+            page = self.playlist_cache.tracks(self.spotipy_auth, "foo", playlist["snapshot_id"], limit=20, offset=0)
+
+        self.assertEqual(20, len(page["items"]))
+        self.assertEqual(2, self.spotipy_auth.playlist_items.call_count)
+        self.assertIsNone(cache.get("spotify:tracks:foo:snapshot1:0:20"))
+
+    async def test_async_pages_of_an_edited_playlist_are_not_cached(self):
+        spotify_async = mock.Mock(
+            playlist=mock.AsyncMock(return_value=playlist_item(snapshot_id="snapshot2")),
+            playlist_items=mock.AsyncMock(return_value=self.spotipy_auth.playlist_items.return_value),
+        )
+
+        for _ in range(2):
+            page = await self.playlist_cache.atracks(spotify_async, "foo", "snapshot1", limit=20, offset=0)
+
+        self.assertEqual(20, len(page["items"]))
+        self.assertEqual(2, spotify_async.playlist_items.await_count)
+        self.assertIsNone(await cache.aget("spotify:tracks:foo:snapshot1:0:20"))
+
+
+class TestSpotifyQueries(GraphQLTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        self.spotify = FakeSpotify(total=250)
+        patcher = mock.patch.object(SpotifyClient, "api", return_value=self.spotify)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_full_playlist_data_fetches_every_page(self):
+        response = self.query(
+            """
+            query fullPlaylistData($playlistId: String){
+                fullPlaylistData(playlistId: $playlistId) {
+                    success
+                    playlist {
+                        playlistName
+                    }
+                    tracks {
+                        id
+                        title
+                    }
+                    lastPage
+                }
+            }
+            """,
+            operation_name="fullPlaylistData",
+            variables={"playlistId": "foo"}
+        )
+
+        self.assertResponseNoErrors(response)
+
+        content = json.loads(response.content)["data"]["fullPlaylistData"]
+
+        self.assertTrue(content["success"])
+        self.assertTrue(content["lastPage"])
+        self.assertEqual("Foo playlist", content["playlist"]["playlistName"])
+        self.assertEqual(
+            [f"track{index}" for index in range(250)],
+            [track["id"] for track in content["tracks"]]
+        )
+        self.assertEqual("Song 0  ", content["tracks"][0]["title"])
+        self.assertEqual(
+            [0, 100, 200],
+            sorted(offset for call, offset in self.spotify.calls if call == "playlist_items")
+        )
+
+    def specific_playlist_data(self, selection: str) -> dict:
+        response = self.query(
+            """
+            query specificPlaylistData($playlistId: String, $offset: Int){
+                specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+                    %s
+                }
+            }
+            """ % selection,
+            operation_name="specificPlaylistData",
+            variables={"playlistId": "foo", "offset": 0}
+        )
+        self.assertResponseNoErrors(response)
+        return json.loads(response.content)["data"]["specificPlaylistData"]
+
+    def test_header_only_query_skips_the_tracks(self):
+        content = self.specific_playlist_data("success playlist { playlistName ownerName }")
+
+        self.assertEqual("Foo playlist", content["playlist"]["playlistName"])
+        self.assertEqual([("playlist", "foo")], self.spotify.calls)
+
+    def test_tracks_only_query_skips_the_details(self):
+        content = self.specific_playlist_data("tracks { id } lastPage")
+
+        self.assertEqual([f"track{index}" for index in range(20)], [track["id"] for track in content["tracks"]])
+        # The playlist still gives the snapshot_id of its tracks, checked again after them
+        self.assertEqual([("playlist", "foo"), ("playlist_items", 0), ("playlist", "foo")], self.spotify.calls)
+
+    def test_header_only_full_playlist_data_skips_every_page(self):
+        response = self.query(
+            """
+            query fullPlaylistData($playlistId: String){
+                fullPlaylistData(playlistId: $playlistId) {
+                    ...header
+                }
+            }
+            fragment header on SpecificPlaylistData {
+                playlist { playlistName }
+            }
+            """,
+            operation_name="fullPlaylistData",
+            variables={"playlistId": "foo"}
+        )
+
+        self.assertResponseNoErrors(response)
+        self.assertEqual([("playlist", "foo")], self.spotify.calls)
+
+
+class TestUserTokenRefresh(TransactionTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.user = User.objects.create(
+            username="foo",
+            email="foo@bar.com",
+            accepted_account=True,
+            spotify_access_token="expired_token",
+            spotify_refresh_token="refresh_token",
+            spotify_token_expires_at=timezone.now() - timedelta(minutes=5),
+        )
+        self.response = mock.Mock()
+        self.response.json.return_value = {"access_token": "fresh_token", "expires_in": 3600}
+
+    def test_parallel_requests_refresh_token_once(self):
+        spotify = FakeSpotify(total=0)
+        access_tokens = []
+        # One User instance per request, as the JWT middleware would load it
+        contexts = [mock.Mock(user=User.objects.get(pk=self.user.pk)) for _ in range(50)]
+
+        def slow_post(*args, **kwargs):
+            time.sleep(0.2)
+            return self.response
+
+        def request(context):
+            try:
+                SpotifyAPI.get_user_playlists(offset=0, context=context)
+                access_tokens.append(context.user.spotify_access_token)
+            finally:
+                connection.close()
+
+        with mock.patch.object(SpotifyClient, "post", side_effect=slow_post) as post, \
+                mock.patch.object(SpotifyClient, "api", return_value=spotify):
+            threads = [threading.Thread(target=request, args=(context,)) for context in contexts]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        post.assert_called_once()
+        self.assertEqual(["fresh_token"] * 50, access_tokens)
+        self.assertEqual("fresh_token", User.objects.get(pk=self.user.pk).spotify_access_token)
+
+    @override_settings(SPOTIFY_USER_TOKEN_REFRESH_MARGIN=60)
+    def test_token_is_refreshed_before_expiry(self):
+        self.user.spotify_token_expires_at = timezone.now() + timedelta(seconds=30)
+        self.user.save()
+
+        with mock.patch.object(SpotifyClient, "post", return_value=self.response) as post, \
+                mock.patch.object(SpotifyClient, "api", return_value=FakeSpotify(total=0)):
+            SpotifyAPI.get_user_playlists(offset=0, context=mock.Mock(user=self.user))
+
+        post.assert_called_once()
+        self.assertEqual("fresh_token", self.user.spotify_access_token)
+
+    def test_rotated_refresh_token_is_saved(self):
+        self.response.json.return_value = {"access_token": "fresh_token", "refresh_token": "rotated_token", "expires_in": 3600}
+
+        with mock.patch.object(SpotifyClient, "post", return_value=self.response):
+            user_tokens.refresh(self.user)
+
+        self.assertEqual("rotated_token", self.user.spotify_refresh_token)
+        self.assertEqual("rotated_token", User.objects.get(pk=self.user.pk).spotify_refresh_token)
+
+    def test_refresh_token_is_kept_when_not_rotated(self):
+        with mock.patch.object(SpotifyClient, "post", return_value=self.response):
+            user_tokens.refresh(self.user)
+
+        self.assertEqual("refresh_token", User.objects.get(pk=self.user.pk).spotify_refresh_token)
+
+    def test_scheduler_refreshes_tokens_expiring_within_window(self):
+        later = User.objects.create(
+            username="later",
+            accepted_account=True,
+            spotify_access_token="later_token",
+            spotify_refresh_token="refresh_token",
+            spotify_token_expires_at=timezone.now() + timedelta(hours=2),
+        )
+        soon = User.objects.create(
+            username="soon",
+            accepted_account=True,
+            spotify_access_token="soon_token",
+            spotify_refresh_token="refresh_token",
+            spotify_token_expires_at=timezone.now() + timedelta(minutes=5),
+        )
+        out = StringIO()
+
+        with mock.patch.object(SpotifyClient, "post", return_value=self.response) as post:
+            call_command("refresh_spotify_tokens", window=600, workers=1, stdout=out)
+
+        self.assertEqual(2, post.call_count)
+        self.assertIn("2 tokens refreshed, 0 failures", out.getvalue())
+        self.assertEqual("fresh_token", User.objects.get(pk=self.user.pk).spotify_access_token)
+        self.assertEqual("fresh_token", User.objects.get(pk=soon.pk).spotify_access_token)
+        self.assertEqual("later_token", User.objects.get(pk=later.pk).spotify_access_token)
+
+
+class TestAsyncGraphQLView(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        self.spotify = FakeSpotify(total=30)
+        self.view = AsyncGraphQLView.as_view(schema=async_schema)
+        patchers = [
+            mock.patch.object(AsyncSpotifyClient, "api", return_value=FakeAsyncSpotify(self.spotify)),
+            mock.patch.object(AsyncSpotifyAPI, "_app_token", new=mock.AsyncMock(return_value="app_token")),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def post(self, query: str, variables: dict = None):
+        request = AsyncRequestFactory().post(
+            "/graphql/",
+            data={"query": query, "variables": variables or {}},
+            content_type="application/json",
+        )
+        request.user = mock.Mock(is_anonymous=True)
+        response = await self.view(request)
+        return json.loads(response.content)
+
+    async def test_spotify_query_runs_on_event_loop(self):
+        with mock.patch.object(SpotifyClient, "api") as sync_api:
+            content = await self.post(
+                """
+                query specificPlaylistData($playlistId: String, $offset: Int){
+                    specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+                        success
+                        playlist {
+                            playlistName
+                        }
+                        tracks {
+                            id
+                        }
+                        lastPage
+                    }
+                }
+                """,
+                {"playlistId": "foo", "offset": 20},
+            )
+
+        sync_api.assert_not_called()
+        self.assertNotIn("errors", content)
+        data = content["data"]["specificPlaylistData"]
+        self.assertEqual("Foo playlist", data["playlist"]["playlistName"])
+        self.assertEqual([f"track{index}" for index in range(20, 30)], [track["id"] for track in data["tracks"]])
+        self.assertTrue(data["lastPage"])
+
+    async def test_header_only_query_skips_the_tracks(self):
+        content = await self.post(
+            """
+            query specificPlaylistData($playlistId: String, $offset: Int){
+                specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+                    playlist {
+                        playlistName
+                    }
+                }
+            }
+            """,
+            {"playlistId": "foo", "offset": 0},
+        )
+
+        self.assertEqual("Foo playlist", content["data"]["specificPlaylistData"]["playlist"]["playlistName"])
+        self.assertEqual([("playlist", "foo")], self.spotify.calls)
+
+    async def test_other_queries_use_sync_view(self):
+        content = await self.post("query { whoami { username } }")
+
+        self.assertEqual(
+            "Authentication Failure: Your must be signed in",
+            content["errors"][0]["message"]
+        )
+
+    async def test_async_client_raises_spotify_errors(self):
+        transport = httpx.MockTransport(lambda request: httpx.Response(404, json={"error": {}}))
+        spotify_async = AsyncSpotify(httpx.AsyncClient(transport=transport), auth="foo")
+
+        with self.assertRaises(SpotifyException) as error:
+            await spotify_async.playlist("missing")
+
+        self.assertEqual(404, error.exception.http_status)
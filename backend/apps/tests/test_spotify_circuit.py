@@ -0,0 +1,134 @@
+import json
+import time
+
+from spotipy.exceptions import SpotifyException
+
+from django.core.cache import cache
+from graphene_django.utils.testing import GraphQLTestCase
+
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_circuit import SpotifyUnavailable, spotify_circuit
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.api.spotify_token import app_token
+
+
+PLAYLIST_QUERY = """
+    query specificPlaylistData($playlistId: String, $offset: Int){
+        specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+            success
+            stale
+            playlist {
+                playlistName
+            }
+            tracks {
+                id
+            }
+        }
+    }
+"""
+
+
+class TestSpotifyCircuit(GraphQLTestCase):
+    """ Spotify outages, simulated with 503s of the Spotify stub. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(tracks=50, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(
+            SPOTIFY_USER_CLIENT_ID="user_client",
+            SPOTIFY_USER_CLIENT_SECRET="user_secret",
+            SPOTIFY_HTTP_RETRIES=0,
+            SPOTIFY_CIRCUIT_FAILURES=2,
+            SPOTIFY_CIRCUIT_RESET_TIMEOUT=30,
+        )
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        spotify_circuit.reset()
+        self.addCleanup(spotify_circuit.reset)
+        SpotifyClient.reset()
+        # Failures hit the next requests, whatever they are, not the token one
+        app_token.get_access_token()
+        self.stub.reset_stats()
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.stub.fail(503, times=2)
+
+        for _ in range(2):
+            with self.assertRaises(SpotifyException):
+                SpotifyClient.api(auth_manager=app_token).playlist("foo")
+        self.assertEqual("open", spotify_circuit.state("playlists/{id}"))
+
+        with self.assertRaises(SpotifyUnavailable):
+            SpotifyClient.api(auth_manager=app_token).playlist("foo")
+        self.assertEqual(2, self.stub.stats()["requests"]["playlist"])
+
+        # Other endpoints keep their own circuit
+        SpotifyClient.api(auth_manager=app_token).playlist_items("foo")
+
+    def test_trial_call_closes_circuit(self):
+        self.stub.fail(503, times=2)
+        with self.settings(SPOTIFY_CIRCUIT_RESET_TIMEOUT=0.2):
+            for _ in range(2):
+                with self.assertRaises(SpotifyException):
+                    SpotifyClient.api(auth_manager=app_token).playlist("foo")
+
+            time.sleep(0.25)
+            self.assertEqual("half_open", spotify_circuit.state("playlists/{id}"))
+            SpotifyClient.api(auth_manager=app_token).playlist("foo")
+
+        self.assertEqual("closed", spotify_circuit.state("playlists/{id}"))
+
+    def test_failed_trial_call_opens_circuit_again(self):
+        self.stub.fail(503, times=3)
+        with self.settings(SPOTIFY_CIRCUIT_RESET_TIMEOUT=0.2):
+            for _ in range(2):
+                with self.assertRaises(SpotifyException):
+                    SpotifyClient.api(auth_manager=app_token).playlist("foo")
+
+            time.sleep(0.25)
+            with self.assertRaises(SpotifyException):
+                SpotifyClient.api(auth_manager=app_token).playlist("foo")
+
+            self.assertEqual("open", spotify_circuit.state("playlists/{id}"))
+
+    def test_stale_playlist_is_served_during_outage(self):
+        fresh = json.loads(self.query(PLAYLIST_QUERY, variables={"playlistId": "foo", "offset": 0}).content)
+        self.assertFalse(fresh["data"]["specificPlaylistData"]["stale"])
+
+        # Playlist metadata expired, Spotify down
+        playlist_cache.invalidate("foo")
+        self.stub.fail(503, times=2)
+        stale_hits = playlist_cache.store.stats()["stale_hits"]
+        for _ in range(3):
+            response = self.query(PLAYLIST_QUERY, variables={"playlistId": "foo", "offset": 0})
+
+            self.assertResponseNoErrors(response)
+            data = json.loads(response.content)["data"]["specificPlaylistData"]
+            self.assertTrue(data["stale"])
+            self.assertEqual(fresh["data"]["specificPlaylistData"]["tracks"], data["tracks"])
+            self.assertEqual("Jolify Suggestions", data["playlist"]["playlistName"])
+
+        self.assertEqual(3, playlist_cache.store.stats()["stale_hits"] - stale_hits)
+        # The fresh query and its snapshot check, then 2 failures open the circuit, Spotify is left alone
+        self.assertEqual(4, self.stub.stats()["requests"]["playlist"])
+
+    def test_outage_without_cached_copy_is_a_graphql_error(self):
+        self.stub.fail(503, times=2)
+        for _ in range(2):
+            with self.assertRaises(SpotifyException):
+                SpotifyAPI.get_playlist_data(playlist_id="foo", offset=0, context=None)
+
+        response = self.query(PLAYLIST_QUERY, variables={"playlistId": "foo", "offset": 0})
+
+        error = json.loads(response.content)["errors"][0]
+        self.assertEqual("SPOTIFY_UNAVAILABLE", error["extensions"]["code"])
+        self.assertGreater(error["extensions"]["retryAfter"], 0)
@@ -0,0 +1,156 @@
+import json
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, SimpleTestCase
+from graphene_django.utils.testing import GraphQLTestCase
+
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_loaders import BatchLoader
+from apps.api.spotify_stub import SpotifyStub
+from apps.api.spotify_token import app_token
+from backend.schema import async_schema
+from backend.views import AsyncGraphQLView
+
+
+TRACK_FIELDS = """
+    id
+    audioFeatures {
+        energy
+        tempo
+    }
+    artistGenres
+    album {
+        name
+        label
+    }
+"""
+
+FULL_PLAYLIST_QUERY = """
+    query fullPlaylistData($playlistId: String){
+        fullPlaylistData(playlistId: $playlistId) {
+            tracks {
+                %s
+            }
+        }
+    }
+""" % TRACK_FIELDS
+
+PLAYLIST_QUERY = """
+    query specificPlaylistData($playlistId: String, $offset: Int){
+        specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+            tracks {
+                %s
+            }
+        }
+    }
+""" % TRACK_FIELDS
+
+
+class TestBatchLoader(SimpleTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+
+    def test_expected_ids_are_fetched_in_batches(self):
+        batch = mock.Mock(side_effect=lambda ids: [{"id": id} for id in ids])
+        loader = BatchLoader("test", batch, max_batch_size=2)
+
+        loader.expect(["a", "b", "c", None])
+
+        self.assertEqual({"id": "b"}, loader.load("b"))
+        self.assertEqual({"id": "c"}, loader.load("c"))
+        self.assertEqual([mock.call(["a", "b"]), mock.call(["c"])], batch.call_args_list)
+
+    def test_cached_ids_are_not_fetched(self):
+        BatchLoader("test", lambda ids: [{"id": id} for id in ids], max_batch_size=2).load_many(["a", "b"])
+        batch = mock.Mock(side_effect=lambda ids: [{"id": id} for id in ids])
+
+        BatchLoader("test", batch, max_batch_size=2).load_many(["a", "b", "c"])
+
+        batch.assert_called_once_with(["c"])
+
+    def test_failed_batch_is_not_repeated(self):
+        batch = mock.Mock(side_effect=ValueError("upstream"))
+        loader = BatchLoader("test", batch, max_batch_size=2)
+        loader.expect(["a", "b"])
+
+        for key in ("a", "b"):
+            with self.assertRaisesMessage(ValueError, "upstream"):
+                loader.load(key)
+        batch.assert_called_once()
+
+
+class TestTrackCatalogFields(GraphQLTestCase):
+    """ Catalog fields of a page of tracks cost a few multi-id calls. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(tracks=100, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(SPOTIFY_USER_CLIENT_ID="user_client")
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        app_token.get_access_token()
+        self.stub.reset_stats()
+
+    def test_page_of_100_tracks_is_batched(self):
+        response = self.query(FULL_PLAYLIST_QUERY, variables={"playlistId": "foo"})
+
+        self.assertResponseNoErrors(response)
+        tracks = json.loads(response.content)["data"]["fullPlaylistData"]["tracks"]
+        self.assertTrue(all(track["audioFeatures"]["tempo"] for track in tracks))
+        self.assertTrue(all(track["artistGenres"] for track in tracks))
+        self.assertTrue(all(track["album"]["label"] for track in tracks))
+        # 100 tracks, 8 artists and 25 albums: 1 + 1 + 2 calls instead of 1 per field and track
+        self.assertEqual(
+            {"playlist": 2, "playlist_items": 1, "audio_features": 1, "artists": 1, "albums": 2},
+            self.stub.stats()["requests"],
+        )
+
+    def test_catalog_is_cached_across_requests(self):
+        first = self.query(FULL_PLAYLIST_QUERY, variables={"playlistId": "foo"})
+        self.stub.reset_stats()
+
+        second = self.query(FULL_PLAYLIST_QUERY, variables={"playlistId": "foo"})
+
+        self.assertEqual(json.loads(first.content), json.loads(second.content))
+        self.assertEqual({}, self.stub.stats()["requests"])
+
+    def test_catalog_is_not_fetched_unless_selected(self):
+        response = self.query(
+            PLAYLIST_QUERY.replace(TRACK_FIELDS, "id"),
+            variables={"playlistId": "foo", "offset": 0},
+        )
+
+        self.assertResponseNoErrors(response)
+        self.assertEqual({"playlist": 2, "playlist_items": 1}, self.stub.stats()["requests"])
+
+    async def test_async_resolvers_are_batched(self):
+        request = AsyncRequestFactory().post(
+            "/graphql/",
+            data={"query": PLAYLIST_QUERY, "variables": {"playlistId": "foo", "offset": 0}},
+            content_type="application/json",
+        )
+        request.user = mock.Mock(is_anonymous=True)
+
+        response = await AsyncGraphQLView.as_view(schema=async_schema)(request)
+
+        content = json.loads(response.content)
+        self.assertNotIn("errors", content)
+        tracks = content["data"]["specificPlaylistData"]["tracks"]
+        self.assertTrue(all(track["audioFeatures"] and track["album"] for track in tracks))
+        self.assertEqual(
+            {"playlist": 2, "playlist_items": 1, "audio_features": 1, "artists": 1, "albums": 1},
+            self.stub.stats()["requests"],
+        )
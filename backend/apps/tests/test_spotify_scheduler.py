@@ -0,0 +1,151 @@
+import asyncio
+import json
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.test import TestCase
+from graphene_django.utils.testing import GraphQLTestCase
+
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_async import AsyncSpotifyClient
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_scheduler import SpotifyRateLimited, spotify_scheduler
+from apps.api.spotify_stub import SpotifyStub
+from apps.api.spotify_token import app_token
+
+
+PLAYLIST_QUERY = """
+    query specificPlaylistData($playlistId: String, $offset: Int){
+        specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+            success
+        }
+    }
+"""
+
+
+class TestSpotifyScheduler(GraphQLTestCase):
+    """ Rate limit handling against 429 bursts of the Spotify stub. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(tracks=250, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(
+            SPOTIFY_USER_CLIENT_ID="user_client",
+            SPOTIFY_USER_CLIENT_SECRET="user_secret",
+            SPOTIFY_HTTP_BACKOFF_FACTOR=0,
+            SPOTIFY_RATE_LIMIT_MAX_WAIT=2,
+        )
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        # Failures hit the next requests, whatever they are, not the token one
+        app_token.get_access_token()
+        self.stub.reset_stats()
+
+    def test_request_waits_for_retry_after(self):
+        self.stub.fail(429, times=1, retry_after=1)
+
+        start = time.monotonic()
+        playlist = SpotifyAPI.get_playlist_data(playlist_id="foo", offset=0, context=None)
+
+        self.assertTrue(playlist["success"])
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertEqual(1, self.stub.stats()["statuses"][429])
+
+    def test_long_retry_after_is_shed_with_graphql_error(self):
+        self.stub.fail(429, times=1, retry_after=30)
+
+        response = self.query(PLAYLIST_QUERY, variables={"playlistId": "foo", "offset": 0})
+
+        error = json.loads(response.content)["errors"][0]
+        self.assertEqual({"code": "SPOTIFY_RATE_LIMITED", "retryAfter": 30}, error["extensions"])
+        self.assertIn("retry in 30 seconds", error["message"])
+
+        # The credential stays paused, Spotify is not asked again meanwhile
+        self.stub.reset_stats()
+        response = self.query(PLAYLIST_QUERY, variables={"playlistId": "bar", "offset": 0})
+
+        self.assertEqual("SPOTIFY_RATE_LIMITED", json.loads(response.content)["errors"][0]["extensions"]["code"])
+        self.assertEqual({}, self.stub.stats()["requests"])
+
+    def test_429_burst_beyond_retries_is_shed(self):
+        self.stub.fail(429, times=3, retry_after=0)
+
+        with self.settings(SPOTIFY_HTTP_RETRIES=1):
+            with self.assertRaises(SpotifyRateLimited):
+                SpotifyAPI.get_playlist_data(playlist_id="foo", offset=0, context=None)
+
+        self.assertEqual(2, self.stub.stats()["statuses"][429])
+
+    def test_budget_is_shared_through_cache(self):
+        with self.settings(SPOTIFY_RATE_LIMIT_REQUESTS=2, SPOTIFY_RATE_LIMIT_WINDOW=30):
+            self.assertEqual(0, spotify_scheduler.reserve("client"))
+            self.assertEqual(0, spotify_scheduler.reserve("client"))
+            self.assertGreater(spotify_scheduler.reserve("client"), 0)
+            # Other apps have their own budget
+            self.assertEqual(0, spotify_scheduler.reserve("other_client"))
+
+    def test_requests_over_budget_are_shed(self):
+        with self.settings(SPOTIFY_RATE_LIMIT_REQUESTS=2, SPOTIFY_RATE_LIMIT_MAX_WAIT=0):
+            with self.assertRaises(SpotifyRateLimited):
+                # Playlist, then 3 pages of tracks
+                SpotifyAPI.get_full_playlist_data(playlist_id="foo", context=None)
+
+        self.assertEqual(2, sum(self.stub.stats()["requests"].values()))
+
+    def test_identical_concurrent_requests_share_one_call(self):
+        self.stub.latency = 0.2
+        self.addCleanup(setattr, self.stub, "latency", 0)
+
+        def fetch(_):
+            return SpotifyClient.api(auth_manager=app_token).playlist("foo")
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            playlists = list(executor.map(fetch, range(5)))
+
+        self.assertEqual(1, self.stub.stats()["requests"]["playlist"])
+        self.assertEqual(1, len({playlist["snapshot_id"] for playlist in playlists}))
+
+
+class TestAsyncSpotifyScheduler(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(tracks=50, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(SPOTIFY_RATE_LIMIT_MAX_WAIT=2)
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.stub.reset_stats()
+
+    async def test_async_request_is_retried_after_429(self):
+        self.stub.fail(429, times=1, retry_after=0)
+
+        playlist = await AsyncSpotifyClient.api(auth="token", client_id="client").playlist("foo")
+
+        self.assertEqual("Jolify Suggestions", playlist["name"])
+        self.assertEqual({200: 1, 429: 1}, self.stub.stats()["statuses"])
+
+    async def test_identical_async_requests_share_one_call(self):
+        self.stub.latency = 0.2
+        self.addCleanup(setattr, self.stub, "latency", 0)
+        spotify_async = AsyncSpotifyClient.api(auth="token", client_id="client")
+
+        await asyncio.gather(*(spotify_async.playlist("foo") for _ in range(5)))
+
+        self.assertEqual(1, self.stub.stats()["requests"]["playlist"])
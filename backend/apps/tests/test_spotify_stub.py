@@ -0,0 +1,120 @@
+import json
+
+from datetime import timedelta
+from spotipy.exceptions import SpotifyException
+
+from django.core.cache import cache
+from django.utils import timezone
+from graphene_django.utils.testing import GraphQLTestCase
+
+from apps.api.spotify import SpotifyAPI
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.api.spotify_token import app_token
+from apps.models.user import User
+
+
+class TestSpotifyStub(GraphQLTestCase):
+    """ Spotify query paths end to end, against the local Spotify stub. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(tracks=250, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(
+            SPOTIFY_USER_CLIENT_ID="user_client",
+            SPOTIFY_USER_CLIENT_SECRET="user_secret",
+            SPOTIFY_HTTP_BACKOFF_FACTOR=0,
+            FRONTEND_REDIRECT_URI="http://frontend.local/",
+        )
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        # Every test reads the same playlist ids from the stub
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        self.stub.reset_stats()
+
+    def test_specific_playlist_data_query(self):
+        response = self.query(
+            """
+            query specificPlaylistData($playlistId: String, $offset: Int){
+                specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+                    success
+                    playlist {
+                        playlistName
+                        ownerName
+                    }
+                    tracks {
+                        id
+                        title
+                    }
+                    lastPage
+                }
+            }
+            """,
+            variables={"playlistId": "37i9dQZF1DX2sUQwD7tbmL", "offset": 0},
+        )
+
+        self.assertResponseNoErrors(response)
+        data = json.loads(response.content)["data"]["specificPlaylistData"]
+        self.assertEqual("Jolify Suggestions", data["playlist"]["playlistName"])
+        self.assertEqual("Jolify Curator", data["playlist"]["ownerName"])
+        self.assertEqual(20, len(data["tracks"]))
+        self.assertEqual("Paper Lanterns ", data["tracks"][1]["title"])
+        self.assertFalse(data["lastPage"])
+        self.assertEqual(
+            {"token": 1, "playlist": 2, "playlist_items": 1},
+            self.stub.stats()["requests"]
+        )
+
+    def test_full_playlist_is_paginated(self):
+        playlist = SpotifyAPI.get_full_playlist_data(playlist_id="foo", context=None)
+
+        # 250 tracks, the recorded unavailable one comes back every 25 tracks
+        self.assertEqual(240, len(playlist["tracks"]))
+        self.assertEqual(3, self.stub.stats()["requests"]["playlist_items"])
+        self.assertTrue(playlist["last_page"])
+
+    def test_rate_limited_request_is_retried_after_delay(self):
+        self.stub.fail(429, times=1, retry_after=0)
+
+        playlist = SpotifyAPI.get_playlist_data(playlist_id="foo", offset=0, context=None)
+
+        self.assertTrue(playlist["success"])
+        self.assertEqual(1, self.stub.stats()["statuses"][429])
+
+    def test_server_errors_beyond_retries_raise(self):
+        with self.settings(SPOTIFY_HTTP_RETRIES=1):
+            SpotifyClient.reset()
+            app_token.get_access_token()
+            self.stub.fail(503, times=2)
+
+            with self.assertRaises(SpotifyException):
+                SpotifyAPI.get_playlist_data(playlist_id="foo", offset=0, context=None)
+        SpotifyClient.reset()
+
+    def test_callback_then_user_playlists(self):
+        user = User.objects.create(username="foo", email="foo@bar.com", accepted_account=True)
+
+        response = self.client.get("/spotify_callback/", {"state": user.id, "code": "code"})
+
+        self.assertEqual(301, response.status_code)
+        user.refresh_from_db()
+        self.assertTrue(user.spotify_refresh_token.startswith("stub-refresh-"))
+
+        # Expired token, refreshed before listing the playlists
+        user.spotify_token_expires_at = timezone.now() - timedelta(minutes=1)
+        user.save()
+        playlists = SpotifyAPI.get_user_playlists(offset=0, context=type("Context", (), {"user": user}))
+
+        self.assertTrue(user.spotify_access_token.startswith("stub-refresh_token-"))
+        self.assertEqual("Jolify Listener", playlists["owner"]["name"])
+        # The untitled and the imageless playlists are left out
+        self.assertEqual(5, len(playlists["playlists"]))
+        self.assertTrue(playlists["last_page"])
@@ -0,0 +1,39 @@
+import re
+
+from django.test import SimpleTestCase
+
+from apps.api.titles import normalize_title, normalize_titles
+
+
+def legacy_normalize_title(title: str) -> str:
+    # The three substitutions the parser used before the compiled pattern
+    title = re.sub("[\(\[].*?[\)\]]", "", title)  # pylint: disable=W1401
+    title = re.sub(r'\-.*', "", title)
+    return re.sub(r'\|.*', "", title)
+
+
+class TestTitles(SimpleTestCase):
+
+    def test_normalize_title(self):
+        self.assertEqual("Song  ", normalize_title("Song (feat. Foo) - 2011 Remaster"))
+        self.assertEqual("Song  ", normalize_title("Song [Live] | Bar"))
+        self.assertEqual("Song  Bar", normalize_title("Song (x - y) Bar"))
+        self.assertEqual("Song (unclosed ", normalize_title("Song (unclosed - Edit"))
+        self.assertEqual("", normalize_title(""))
+
+    def test_matches_legacy_substitutions(self):
+        titles = [
+            "Blinding Lights",
+            "Get Lucky (feat. Pharrell Williams & Nile Rodgers) - Radio Edit",
+            "Bohemian Rhapsody - Remastered 2011",
+            "Nightcall [Kavinsky] | Drive OST",
+            "A (B [C) D] - E | F",
+            "Intro - (Live)",
+            "((nested)) tail",
+            "no closing [bracket - here",
+        ]
+
+        self.assertEqual(
+            [legacy_normalize_title(title) for title in titles],
+            normalize_titles(titles)
+        )
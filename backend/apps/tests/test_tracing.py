@@ -0,0 +1,148 @@
+import json
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from graphene_django.utils.testing import GraphQLTestCase
+from graphql_jwt.shortcuts import get_token
+
+from apps.api import tracing
+from apps.api.spotify_async import AsyncSpotifyAPI, AsyncSpotifyClient
+from apps.api.spotify_cache import playlist_cache
+from apps.api.spotify_client import SpotifyClient
+from apps.api.spotify_stub import SpotifyStub
+from apps.models.user import User
+from apps.tests.test_spotify import FakeAsyncSpotify, FakeSpotify
+from backend.schema import async_schema
+from backend.views import AsyncGraphQLView
+
+
+PLAYLIST_QUERY = """
+    query specificPlaylistData($playlistId: String, $offset: Int){
+        specificPlaylistData(playlistId: $playlistId, offset: $offset) {
+            success
+            tracks {
+                id
+                title
+            }
+        }
+    }
+"""
+
+
+class TestTracing(GraphQLTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = SpotifyStub(tracks=250, seed=0).start()
+        cls.addClassCleanup(cls.stub.stop)
+        settings = cls.stub.override_settings(
+            SPOTIFY_USER_CLIENT_ID="user_client",
+            GRAPHQL_TRACING=True,
+            GRAPHQL_TRACING_EXTENSIONS=True,
+        )
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        playlist_cache.store.local.clear()
+        SpotifyClient.reset()
+        self.user = User.objects.create(username="foo", email="foo@bar.com")
+
+    def query_as(self, user: User, query: str, variables: dict = None):
+        return self.query(
+            query,
+            variables=variables,
+            headers={"HTTP_AUTHORIZATION": f"JWT {get_token(user)}"},
+        )
+
+    def test_staff_users_get_trace_extensions(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        with self.assertLogs("apps.api.tracing", level="INFO") as logs:
+            response = self.query_as(self.user, PLAYLIST_QUERY, {"playlistId": "foo", "offset": 0})
+
+        self.assertResponseNoErrors(response)
+        trace = json.loads(response.content)["extensions"]["tracing"]
+        self.assertEqual("specificPlaylistData", trace["operation"])
+        self.assertEqual(1, trace["resolvers"]["Query.specificPlaylistData"]["count"])
+        self.assertEqual(20, trace["resolvers"]["TrackData.title"]["count"])
+        # App token, playlist, its first tracks page and the snapshot checked after it
+        self.assertEqual(4, trace["http"]["requests"])
+        # The JWT user lookup
+        self.assertEqual(1, trace["db"]["queries"])
+        self.assertEqual({"auth", "execute"}, set(trace["phases"]))
+        self.assertEqual(1, len(logs.records))
+        self.assertEqual(trace["resolvers"].keys(), logs.records[0].graphql_trace["resolvers"].keys())
+
+    def test_other_users_only_get_logs(self):
+        with self.assertLogs("apps.api.tracing", level="INFO") as logs:
+            response = self.query_as(self.user, "query { whoami { username } }")
+
+        self.assertResponseNoErrors(response)
+        self.assertNotIn("tracing", json.loads(response.content).get("extensions", {}))
+        self.assertEqual(1, logs.records[0].graphql_trace["resolvers"]["Query.whoami"]["count"])
+
+    def test_fetch_all_threads_are_traced(self):
+        with self.assertLogs("apps.api.tracing", level="INFO") as logs:
+            response = self.query(
+                """
+                query fullPlaylistData($playlistId: String){
+                    fullPlaylistData(playlistId: $playlistId) {
+                        tracks {
+                            id
+                        }
+                    }
+                }
+                """,
+                variables={"playlistId": "foo"},
+            )
+
+        self.assertResponseNoErrors(response)
+        # App token, playlist and 3 pages of 100 tracks, each followed by a snapshot check
+        # (the last two pages are fetched together, their checks may be one request)
+        self.assertIn(logs.records[0].graphql_trace["http"]["requests"], (7, 8))
+
+    @override_settings(GRAPHQL_TRACING=False)
+    def test_nothing_is_traced_when_disabled(self):
+        with mock.patch.object(tracing.logger, "info") as log:
+            response = self.query_as(self.user, "query { whoami { username } }")
+
+        self.assertResponseNoErrors(response)
+        log.assert_not_called()
+        self.assertNotIn("tracing", json.loads(response.content).get("extensions", {}))
+
+
+@override_settings(GRAPHQL_TRACING=True)
+class TestAsyncTracing(TestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        patchers = [
+            mock.patch.object(AsyncSpotifyClient, "api", return_value=FakeAsyncSpotify(FakeSpotify(total=30))),
+            mock.patch.object(AsyncSpotifyAPI, "_app_token", new=mock.AsyncMock(return_value="app_token")),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_async_resolvers_are_traced(self):
+        request = AsyncRequestFactory().post(
+            "/graphql/",
+            data={"query": PLAYLIST_QUERY, "variables": {"playlistId": "async", "offset": 0}},
+            content_type="application/json",
+        )
+
+        with self.assertLogs("apps.api.tracing", level="INFO") as logs:
+            response = await AsyncGraphQLView.as_view(schema=async_schema)(request)
+
+        self.assertEqual(200, response.status_code)
+        resolvers = logs.records[0].graphql_trace["resolvers"]
+        self.assertEqual(1, resolvers["Query.specificPlaylistData"]["count"])
+        self.assertEqual(20, resolvers["TrackData.id"]["count"])
@@ -0,0 +1,34 @@
+from django.test import SimpleTestCase
+
+from apps.api.tracks import Track, parse_tracks
+from apps.tests.test_spotify import track_item
+
+
+class TestTracks(SimpleTestCase):
+
+    def test_parse_tracks(self):
+        [track] = parse_tracks([track_item(1)])
+
+        self.assertEqual(
+            Track(
+                id="track1",
+                artist="Artist 1",
+                title="Song 1  ",
+                link="https://open.spotify.com/track/track1",
+                cover="https://i.scdn.co/image/1",
+                preview=None,
+                artist_ids=("artist1",),
+                album_id="album1",
+            ),
+            track
+        )
+
+    def test_parse_tracks_skip_empty(self):
+        empty = track_item(2)
+        empty["track"]["duration_ms"] = 0
+
+        self.assertEqual(2, len(parse_tracks([track_item(1), empty])))
+        self.assertEqual(
+            ["track1"],
+            [track.id for track in parse_tracks([track_item(1), empty], skip_empty=True)]
+        )
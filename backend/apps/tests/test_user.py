@@ -1,5 +1,9 @@
 import json
 
+from datetime import datetime, timezone
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from graphene_django.utils.testing import GraphQLTestCase
 
 from apps.models.user import User
@@ -384,3 +388,89 @@ class TestUser(GraphQLTestCase):
             "Error in either password or username !",
             content["details"]
         )
+
+
+USERS_QUERY = """
+    query users($first: Int, $after: String, $acceptedAccount: Boolean, $joinedAfter: DateTime){
+        users(first: $first, after: $after, acceptedAccount: $acceptedAccount, joinedAfter: $joinedAfter) {
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+            edges {
+                node {
+                    username
+                    hasSpotifyToken
+                }
+            }
+        }
+    }
+"""
+
+
+class TestUsers(GraphQLTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        User.objects.bulk_create([
+            User(
+                username=f"user{index}",
+                email=f"user{index}@bar.com",
+                accepted_account=index % 2 == 0,
+                spotify_access_token="token" if index % 3 == 0 else None,
+                date_joined=datetime(2023, 1, 1 + index, tzinfo=timezone.utc),
+            )
+            for index in range(10)
+        ])
+
+    def users(self, **variables) -> dict:
+        response = self.query(USERS_QUERY, variables=variables)
+        self.assertResponseNoErrors(response)
+        return json.loads(response.content)["data"]["users"]
+
+    @staticmethod
+    def usernames(users: dict) -> list:
+        return [edge["node"]["username"] for edge in users["edges"]]
+
+    def test_pages_follow_cursors(self):
+        first = self.users(first=4)
+        second = self.users(first=4, after=first["pageInfo"]["endCursor"])
+        last = self.users(first=4, after=second["pageInfo"]["endCursor"])
+
+        self.assertEqual([f"user{index}" for index in range(10)], self.usernames(first) + self.usernames(second) + self.usernames(last))
+        self.assertEqual([True, True, False], [page["pageInfo"]["hasNextPage"] for page in (first, second, last)])
+        self.assertEqual([True, False, False, True], [edge["node"]["hasSpotifyToken"] for edge in first["edges"]])
+
+    def test_pages_are_stable_as_users_are_deleted(self):
+        first = self.users(first=4)
+        User.objects.filter(username__in=["user0", "user1"]).delete()
+
+        second = self.users(first=4, after=first["pageInfo"]["endCursor"])
+
+        self.assertEqual(["user4", "user5", "user6", "user7"], self.usernames(second))
+
+    def test_filters(self):
+        users = self.users(acceptedAccount=True, joinedAfter="2023-01-05T00:00:00+00:00")
+
+        self.assertEqual(["user4", "user6", "user8"], self.usernames(users))
+
+    def test_only_selected_columns_are_loaded(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.users(first=4)
+
+        [query] = queries.captured_queries
+        selected = query["sql"].split(" FROM ")[0]
+        self.assertIn('"username"', selected)
+        for column in ('"password"', '"email"', '"spotify_refresh_token"', '"spotify_access_token",'):
+            self.assertNotIn(column, selected)
+        self.assertIn("LIMIT 5", query["sql"])
+
+    def test_total_count(self):
+        response = self.query("query { users(first: 1, acceptedAccount: false) { totalCount } }")
+
+        self.assertEqual(5, json.loads(response.content)["data"]["users"]["totalCount"])
+
+    def test_invalid_cursor(self):
+        response = self.query(USERS_QUERY, variables={"after": "foo"})
+
+        self.assertIn("Invalid cursor", json.loads(response.content)["errors"][0]["message"])
@@ -14,4 +14,10 @@ class Mutation(schema.Mutation, graphene.ObjectType):
     refresh_token = graphql_jwt.Refresh.Field()
 
 
+class AsyncQuery(schema.AsyncQuery, graphene.ObjectType):
+    class Meta:
+        name = "Query"
+
+
 schema = graphene.Schema(query=Query, mutation=Mutation)
+async_schema = graphene.Schema(query=AsyncQuery, mutation=Mutation)
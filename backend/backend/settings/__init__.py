@@ -32,6 +32,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # Full-text and trigram search lookups, see apps.api.search
+    'django.contrib.postgres',
     'corsheaders',
     'graphene_django',
     'graphql_jwt.refresh_token.apps.RefreshTokenConfig',
@@ -139,6 +141,8 @@ GRAPHENE = {
         'graphql_jwt.middleware.JSONWebTokenMiddleware',
     ],
     "TESTING_ENDPOINT": "/graphql/",
+    # Cap of `first` on connections, a track page of Spotify
+    "RELAY_CONNECTION_MAX_LIMIT": int(os.getenv('GRAPHQL_CONNECTION_MAX_FIRST', 100)),
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -150,6 +154,24 @@ AUTHENTICATION_BACKENDS = [
 AUTH_USER_MODEL = 'apps.User'
 
 
+# Cache
+# Set REDIS_URL to share cached data (Spotify tokens...) between gunicorn workers
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Environment variables
 
 SECRET_KEY = os.getenv('SECRET_KEY')
@@ -164,3 +186,172 @@ EMAIL_PORT = 587
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = True
+
+
+# Spotify HTTP client
+# Pool size should match the number of threads of a gunicorn worker
+
+SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1/')
+SPOTIFY_ACCOUNTS_URL = os.getenv('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com/')
+SPOTIFY_HTTP_POOL_SIZE = int(os.getenv('SPOTIFY_HTTP_POOL_SIZE', 10))
+SPOTIFY_HTTP_TIMEOUT = float(os.getenv('SPOTIFY_HTTP_TIMEOUT', 5))
+SPOTIFY_HTTP_CONNECT_TIMEOUT = float(os.getenv('SPOTIFY_HTTP_CONNECT_TIMEOUT', 3))
+SPOTIFY_HTTP_RETRIES = int(os.getenv('SPOTIFY_HTTP_RETRIES', 3))
+SPOTIFY_HTTP_BACKOFF_FACTOR = float(os.getenv('SPOTIFY_HTTP_BACKOFF_FACTOR', 0.3))
+# Client-credentials tokens are refreshed this many seconds before they expire
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.getenv('SPOTIFY_TOKEN_REFRESH_MARGIN', 300))
+
+
+# Spotify rate limit
+# Every worker shares, through the cache, a budget of SPOTIFY_RATE_LIMIT_REQUESTS
+# API requests per SPOTIFY_RATE_LIMIT_WINDOW seconds and app (0 disables it), and
+# pauses when Spotify answers 429. Requests over budget wait in a queue of
+# SPOTIFY_RATE_LIMIT_QUEUE_SIZE per worker, for SPOTIFY_RATE_LIMIT_MAX_WAIT
+# seconds at most, then fail with a SPOTIFY_RATE_LIMITED GraphQL error.
+
+SPOTIFY_RATE_LIMIT_REQUESTS = int(os.getenv('SPOTIFY_RATE_LIMIT_REQUESTS', 180))
+SPOTIFY_RATE_LIMIT_WINDOW = int(os.getenv('SPOTIFY_RATE_LIMIT_WINDOW', 30))
+SPOTIFY_RATE_LIMIT_MAX_WAIT = float(os.getenv('SPOTIFY_RATE_LIMIT_MAX_WAIT', 5))
+SPOTIFY_RATE_LIMIT_QUEUE_SIZE = int(os.getenv('SPOTIFY_RATE_LIMIT_QUEUE_SIZE', 100))
+
+
+# Spotify outages
+# SPOTIFY_CIRCUIT_FAILURES consecutive failures of an endpoint (5xx, timeouts...)
+# stop its calls for SPOTIFY_CIRCUIT_RESET_TIMEOUT seconds in the worker. Cached
+# playlists and track pages are kept SPOTIFY_STALE_CACHE_TTL seconds past their
+# expiry, and served marked as stale while Spotify cannot answer.
+
+SPOTIFY_CIRCUIT_FAILURES = int(os.getenv('SPOTIFY_CIRCUIT_FAILURES', 5))
+SPOTIFY_CIRCUIT_RESET_TIMEOUT = float(os.getenv('SPOTIFY_CIRCUIT_RESET_TIMEOUT', 30))
+SPOTIFY_STALE_CACHE_TTL = int(os.getenv('SPOTIFY_STALE_CACHE_TTL', 7 * 86400))
+
+
+# Spotify stub
+# Set SPOTIFY_STUB_URL to the address of `python manage.py spotify_stub` to run
+# the backend (and load tests) against the local stand-in instead of Spotify.
+
+SPOTIFY_STUB_URL = os.getenv('SPOTIFY_STUB_URL')
+# Recorded responses served by the stub, defaults to apps/api/fixtures/spotify
+SPOTIFY_STUB_FIXTURES_DIR = os.getenv('SPOTIFY_STUB_FIXTURES_DIR')
+
+if SPOTIFY_STUB_URL:
+    SPOTIFY_API_URL = SPOTIFY_STUB_URL.rstrip('/') + '/v1/'
+    SPOTIFY_ACCOUNTS_URL = SPOTIFY_STUB_URL.rstrip('/') + '/'
+
+
+# Spotify cache
+# Playlist metadata (and its snapshot_id) expires quickly, track pages are keyed
+# by snapshot_id so they can be kept much longer. Set SPOTIFY_CACHE_LOCAL_SIZE
+# to 0 to disable the in-process LRU tier.
+
+SPOTIFY_CACHE_ALIAS = os.getenv('SPOTIFY_CACHE_ALIAS', 'default')
+SPOTIFY_CACHE_LOCAL_SIZE = int(os.getenv('SPOTIFY_CACHE_LOCAL_SIZE', 512))
+SPOTIFY_CACHE_LOCAL_TTL = int(os.getenv('SPOTIFY_CACHE_LOCAL_TTL', 30))
+SPOTIFY_PLAYLIST_CACHE_TTL = int(os.getenv('SPOTIFY_PLAYLIST_CACHE_TTL', 300))
+SPOTIFY_TRACKS_CACHE_TTL = int(os.getenv('SPOTIFY_TRACKS_CACHE_TTL', 86400))
+# Audio features, artists and albums, cached by id for the batched track fields
+SPOTIFY_CATALOG_CACHE_TTL = int(os.getenv('SPOTIFY_CATALOG_CACHE_TTL', 86400))
+# Concurrent misses share one Spotify call per worker. With SPOTIFY_CACHE_LOCK
+# (and a shared cache) workers also wait, up to SPOTIFY_CACHE_LOCK_TIMEOUT
+# seconds, for the one fetching a key instead of fetching it again.
+SPOTIFY_CACHE_LOCK = os.getenv('SPOTIFY_CACHE_LOCK', 'False') == 'True'
+SPOTIFY_CACHE_LOCK_TIMEOUT = float(os.getenv('SPOTIFY_CACHE_LOCK_TIMEOUT', 10))
+# Whole-playlist mode fetches 100-track pages with this many threads
+SPOTIFY_FETCH_ALL_WORKERS = int(os.getenv('SPOTIFY_FETCH_ALL_WORKERS', 8))
+SPOTIFY_FETCH_ALL_MAX_TRACKS = int(os.getenv('SPOTIFY_FETCH_ALL_MAX_TRACKS', 10000))
+# Users' access tokens are refreshed this many seconds before they expire
+SPOTIFY_USER_TOKEN_REFRESH_MARGIN = int(os.getenv('SPOTIFY_USER_TOKEN_REFRESH_MARGIN', 60))
+# refresh_spotify_tokens refreshes the tokens expiring within this many seconds
+SPOTIFY_TOKEN_SCHEDULER_WINDOW = int(os.getenv('SPOTIFY_TOKEN_SCHEDULER_WINDOW', 600))
+
+
+# Spotify catalog
+# `python manage.py sync_catalog` copies playlists into the catalog models,
+# skipping the ones whose snapshot_id did not change and upserting the changed
+# positions in batches of SPOTIFY_CATALOG_BATCH_SIZE. With SPOTIFY_CATALOG, the
+# tracks of synced playlists are served from the database while their snapshot
+# is the current one.
+
+SPOTIFY_CATALOG = os.getenv('SPOTIFY_CATALOG', 'False') == 'True'
+SPOTIFY_CATALOG_BATCH_SIZE = int(os.getenv('SPOTIFY_CATALOG_BATCH_SIZE', 500))
+
+
+# Recommendations
+# `python manage.py compute_recommendations` stores the RECOMMENDATIONS_TOP_K
+# tracks that most often share playlists of the catalog with those of each
+# accepted user's library, among the RECOMMENDATIONS_NEIGHBOURS playlists
+# sharing the most tracks with it, up to 1 + RECOMMENDATIONS_ARTIST_WEIGHT
+# times more for artists the user already collects. `recommendedTracks`
+# serves them.
+
+RECOMMENDATIONS_TOP_K = int(os.getenv('RECOMMENDATIONS_TOP_K', 100))
+RECOMMENDATIONS_NEIGHBOURS = int(os.getenv('RECOMMENDATIONS_NEIGHBOURS', 200))
+RECOMMENDATIONS_ARTIST_WEIGHT = float(os.getenv('RECOMMENDATIONS_ARTIST_WEIGHT', 0.5))
+
+# ASGI deployment
+# With GRAPHQL_ASYNC (set by backend/asgi.py) /graphql/ runs Spotify queries on
+# the event loop, sharing SPOTIFY_ASYNC_POOL_SIZE connections per worker.
+
+GRAPHQL_ASYNC = os.getenv('GRAPHQL_ASYNC', 'False') == 'True'
+SPOTIFY_ASYNC_POOL_SIZE = int(os.getenv('SPOTIFY_ASYNC_POOL_SIZE', 100))
+
+
+# GraphQL tracing
+# With GRAPHQL_TRACING every operation logs its resolver, DB and Spotify times
+# to the apps.api.tracing logger. GRAPHQL_TRACING_EXTENSIONS also returns them
+# to staff users in the response `extensions`. Both off by default.
+
+GRAPHQL_TRACING = os.getenv('GRAPHQL_TRACING', 'False') == 'True'
+GRAPHQL_TRACING_EXTENSIONS = os.getenv('GRAPHQL_TRACING_EXTENSIONS', 'False') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'apps.api.tracing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
+# GraphQL persisted queries
+# Documents are parsed and validated once, kept in an LRU of
+# GRAPHQL_DOCUMENT_CACHE_SIZE per worker. Clients may send the sha256 hash of a
+# query instead of its text: queries of GRAPHQL_PERSISTED_QUERIES_FILE (JSON
+# object of hash to query) and, with GRAPHQL_APQ, the ones registered by clients
+# (Apollo automatic persisted queries), kept GRAPHQL_APQ_TTL seconds in the cache.
+# GRAPHQL_PERSISTED_QUERIES_ONLY refuses any query missing from the file.
+
+GRAPHQL_DOCUMENT_CACHE_SIZE = int(os.getenv('GRAPHQL_DOCUMENT_CACHE_SIZE', 256))
+GRAPHQL_PERSISTED_QUERIES_FILE = os.getenv('GRAPHQL_PERSISTED_QUERIES_FILE')
+GRAPHQL_PERSISTED_QUERIES_ONLY = os.getenv('GRAPHQL_PERSISTED_QUERIES_ONLY', 'False') == 'True'
+GRAPHQL_APQ = os.getenv('GRAPHQL_APQ', 'True') == 'True'
+GRAPHQL_APQ_CACHE_ALIAS = os.getenv('GRAPHQL_APQ_CACHE_ALIAS', 'default')
+GRAPHQL_APQ_TTL = int(os.getenv('GRAPHQL_APQ_TTL', 7 * 86400))
+
+
+# GraphQL query cost
+# Operations deeper than GRAPHQL_MAX_DEPTH fields, or whose static cost (field
+# weights times expected list sizes, see apps/schema/cost.py) is over
+# GRAPHQL_MAX_COST, are refused before execution. With GRAPHQL_COST_EXTENSIONS
+# responses report the cost in their `extensions`.
+
+GRAPHQL_MAX_COST = int(os.getenv('GRAPHQL_MAX_COST', 5000))
+GRAPHQL_MAX_DEPTH = int(os.getenv('GRAPHQL_MAX_DEPTH', 10))
+GRAPHQL_COST_EXTENSIONS = os.getenv('GRAPHQL_COST_EXTENSIONS', 'True') == 'True'
+
+
+# Metrics
+# /metrics serves Prometheus metrics, to scrapers sending METRICS_TOKEN as a
+# bearer token when it is set. Under gunicorn also set PROMETHEUS_MULTIPROC_DIR
+# to an empty directory, cleared on deploy, to aggregate every worker.
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
@@ -13,13 +13,21 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from .views import spotify_callback_handle, AdminOnlyGraphiQLView
+from .schema import async_schema
+from .views import spotify_callback_handle, metrics_view, AdminOnlyGraphiQLView, AsyncGraphQLView
+
+if settings.GRAPHQL_ASYNC:
+    graphql_view = AsyncGraphQLView.as_view(graphiql=True, schema=async_schema)
+else:
+    graphql_view = AdminOnlyGraphiQLView.as_view(graphiql=True)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(AdminOnlyGraphiQLView.as_view(graphiql=True))),
-    path('spotify_callback/', spotify_callback_handle, name="spotify_callback")
+    path('graphql/', csrf_exempt(graphql_view)),
+    path('spotify_callback/', spotify_callback_handle, name="spotify_callback"),
+    path('metrics', metrics_view, name="metrics"),
 ]
@@ -1,14 +1,33 @@
 import base64
-import requests
-from datetime import datetime, timedelta
-import spotipy
+import inspect
+import re
+from contextlib import nullcontext
+from datetime import timedelta
+from typing import Optional
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import HttpRequest, HttpResponseForbidden
+from django.contrib.auth import authenticate
+from django.contrib.auth.middleware import get_user
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
 from django.shortcuts import redirect
-from graphene_django.views import GraphQLView
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from graphene_django.views import GraphQLView, HttpError
+from graphql import DocumentNode, ExecutionResult, FieldNode, OperationType, execute, get_operation_ast
+from graphql_jwt.utils import get_http_authorization
 
+from apps.api.metrics import export as export_metrics, graphql_operation
+from apps.api.spotify_client import SpotifyClient
+from apps.api.tracing import trace_operation
 from apps.models import User
+from apps.schema.documents import PersistedQueryError, documents, persisted_queries
+from apps.schema.middleware import TracingMiddleware
+
+
+OPERATION_NAME = re.compile(r"\s*(?:query|mutation|subscription)\s+([_A-Za-z][_0-9A-Za-z]*)")
+
 
 def spotify_callback_handle(
     request: HttpRequest,
@@ -30,8 +49,8 @@ def spotify_callback_handle(
     encodedData = base64.b64encode(bytes(f"{settings.SPOTIFY_APP_CLIENT_ID}:{settings.SPOTIFY_APP_CLIENT_SECRET}", "ISO-8859-1")).decode("ascii")
     credentials = f"{encodedData}"
 
-    res = requests.post(
-            "https://accounts.spotify.com/api/token?",
+    res = SpotifyClient.post(
+            SpotifyClient.accounts_url("api/token"),
             data= {
                 "grant_type": "authorization_code",
                 "code": authorization_code,
@@ -51,12 +70,26 @@ def spotify_callback_handle(
     user = User.objects.get(pk=user_id)
     user.spotify_access_token = res_data["access_token"]
     user.spotify_refresh_token = res_data["refresh_token"]
-    user.spotify_token_expires_at = datetime.now() + timedelta(seconds=res_data["expires_in"])
+    user.spotify_token_expires_at = timezone.now() + timedelta(seconds=res_data["expires_in"])
     user.save(update_fields=['spotify_access_token', 'spotify_refresh_token', 'spotify_token_expires_at'])
 
     return redirect(to=settings.FRONTEND_REDIRECT_URI, permanent=True)
 
 
+def metrics_view(
+    request: HttpRequest,
+):
+    # Scrapers send METRICS_TOKEN as a bearer token when it is set
+    if settings.METRICS_TOKEN and not constant_time_compare(
+        request.headers.get("Authorization", ""),
+        f"Bearer {settings.METRICS_TOKEN}",
+    ):
+        return HttpResponseForbidden()
+
+    content, content_type = export_metrics()
+    return HttpResponse(content, content_type=content_type)
+
+
 class AdminOnlyGraphiQLView(GraphQLView):
     def render_graphiql(self, request: HttpRequest, **data):
         if (
@@ -71,3 +104,199 @@ class AdminOnlyGraphiQLView(GraphQLView):
             )
         else:
             return super().render_graphiql(request, **data)
+
+    def get_middleware(self, request: HttpRequest):
+        middleware = super().get_middleware(request)
+        if settings.GRAPHQL_TRACING:
+            # First is innermost, resolver times leave the JWT middleware out
+            return [TracingMiddleware(), *(middleware or [])]
+        return middleware
+
+    def parse_body(self, request: HttpRequest):
+        # The async view hands some requests over to the sync one, parsed already
+        if not hasattr(request, "graphql_body"):
+            request.graphql_body = super().parse_body(request)
+        return request.graphql_body
+
+    def get_graphql_params(self, request: HttpRequest, data):
+        # Asked by get_response() then by graphene-django's, resolved once per body (or batch entry)
+        resolved = getattr(request, "graphql_params", None)
+        if resolved is None or resolved[0] is not data:
+            query, variables, operation_name, id = super().get_graphql_params(request, data)
+            # Persisted queries come as a hash in the extensions
+            extensions = request.GET.get("extensions") or data.get("extensions")
+            resolved = data, (persisted_queries.resolve(query, extensions), variables, operation_name, id)
+            request.graphql_params = resolved
+        return resolved[1]
+
+    def get_response(self, request: HttpRequest, data, show_graphiql=False):
+        try:
+            query, _, operation_name, _ = self.get_graphql_params(request, data)
+        except PersistedQueryError as error:
+            return self.json_encode(request, {"errors": [self.format_error(error)]}), error.status_code
+        operation_name = operation_name or self.document_operation_name(query)
+        with graphql_operation(operation_name):
+            if not settings.GRAPHQL_TRACING:
+                return super().get_response(request, data, show_graphiql)
+
+            with trace_operation(operation_name) as trace:
+                request.graphql_trace = trace
+                with trace.phase("auth"):
+                    self.authenticate_request(request)
+                with trace.phase("execute"):
+                    return super().get_response(request, data, show_graphiql)
+
+    def execute_graphql_request(self, request: HttpRequest, data, query, variables, operation_name, show_graphiql=False):
+        if not query:
+            return super().execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)
+
+        # Parsed and validated once, schema.execute() would do both again
+        document, errors = documents.get(self.schema.graphql_schema, query)
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+        request.graphql_cost = document.cost(operation_name)
+
+        # Mutations (atomic, refused on GET) and unknown operations are left to graphene-django
+        operation_ast = get_operation_ast(document.node, operation_name)
+        if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+            return super().execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)
+
+        try:
+            return self.execute_sync(document.node, {
+                "root_value": self.get_root_value(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "context_value": self.get_context(request),
+                "middleware": self.get_middleware(request),
+                "execution_context_class": self.execution_context_class,
+            })
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+    def execute_sync(self, document: DocumentNode, options) -> ExecutionResult:
+        result = execute(self.schema.graphql_schema, document, **options)
+        if inspect.isawaitable(result):
+            # As graphql_sync does, async resolvers belong to AsyncGraphQLView
+            result.close()
+            raise RuntimeError("GraphQL execution failed to complete synchronously.")
+        return result
+
+    @staticmethod
+    def document_operation_name(query: Optional[str]) -> Optional[str]:
+        # operationName is optional in the request when the document has one operation
+        match = OPERATION_NAME.match(query or "")
+        return match.group(1) if match else None
+
+    def json_encode(self, request: HttpRequest, d, pretty=False):
+        if isinstance(d, dict):
+            extensions = {}
+            cost = getattr(request, "graphql_cost", None)
+            if cost is not None and settings.GRAPHQL_COST_EXTENSIONS:
+                extensions["cost"] = cost.as_dict()
+            trace = getattr(request, "graphql_trace", None)
+            if trace is not None and settings.GRAPHQL_TRACING_EXTENSIONS and request.user.is_staff:
+                extensions["tracing"] = trace.as_dict()
+            if extensions:
+                d = {**d, "extensions": extensions}
+        return super().json_encode(request, d, pretty)
+
+    @staticmethod
+    def authenticate_request(request: HttpRequest) -> None:
+        user = None
+        if get_http_authorization(request) is not None:
+            user = authenticate(request=request)
+        if user is None:
+            user = get_user(request) if hasattr(request, "session") else AnonymousUser()
+        request.user = user
+
+
+class AsyncGraphQLView(AdminOnlyGraphiQLView):
+    """
+    GraphQL view of the ASGI deployment, serving the async schema.
+
+    Queries whose root fields all have async resolvers (the Spotify ones)
+    are executed on the event loop. Anything else (DB backed fields,
+    mutations, GraphiQL) goes through the sync view and schema, run in a
+    thread by Django.
+    """
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            data = self.parse_body(request)
+            query, variables, operation_name, _ = self.get_graphql_params(request, data)
+            document = self.get_async_document(request, data, query, operation_name)
+        except (HttpError, PersistedQueryError):
+            # Answered by the sync view
+            document = None
+
+        if document is None:
+            sync_view = AdminOnlyGraphiQLView(graphiql=self.graphiql)
+            return await sync_to_async(sync_view.dispatch)(request, *args, **kwargs)
+
+        operation_name = operation_name or self.document_operation_name(query)
+
+        with graphql_operation(operation_name):
+            if settings.GRAPHQL_TRACING:
+                with trace_operation(operation_name) as trace:
+                    request.graphql_trace = trace
+                    return await self.get_async_response(request, document, variables, operation_name)
+            return await self.get_async_response(request, document, variables, operation_name)
+
+    async def get_async_response(self, request, document, variables, operation_name) -> HttpResponse:
+        trace = getattr(request, "graphql_trace", None)
+
+        # JSONWebTokenMiddleware hits the DB, authenticate before leaving the thread
+        with trace.phase("auth") if trace else nullcontext():
+            await sync_to_async(self.authenticate_request)(request)
+
+        with trace.phase("execute") if trace else nullcontext():
+            request.graphql_cost = document.cost(operation_name)
+            execution_result = execute(
+                self.schema.graphql_schema,
+                document.node,
+                root_value=self.get_root_value(request),
+                variable_values=variables,
+                operation_name=operation_name,
+                context_value=self.get_context(request),
+                # JWT authentication was done above, off the event loop
+                middleware=[TracingMiddleware()] if trace else None,
+            )
+            if inspect.isawaitable(execution_result):
+                execution_result = await execution_result
+
+        response = {}
+        status_code = 200
+        if execution_result.errors:
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.errors and any(not getattr(e, "path", None) for e in execution_result.errors):
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+
+        return HttpResponse(
+            status=status_code,
+            content=self.json_encode(request, response),
+            content_type="application/json",
+        )
+
+    def get_async_document(self, request, data, query, operation_name) -> Optional[DocumentNode]:
+        if not query or self.batch or (self.graphiql and self.can_display_graphiql(request, data)):
+            return None
+        document, errors = documents.get(self.schema.graphql_schema, query)
+        if errors:
+            return None
+
+        operation_ast = get_operation_ast(document.node, operation_name)
+        if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+            return None
+
+        query_type = self.schema.graphql_schema.query_type
+        for selection in operation_ast.selection_set.selections:
+            if not isinstance(selection, FieldNode):
+                return None
+            field = query_type.fields.get(selection.name.value)
+            if field is None or not inspect.iscoroutinefunction(field.resolve):
+                return None
+        return document
+
@@ -0,0 +1,11 @@
+# Picked up by gunicorn when started from this directory
+
+import os
+
+
+def child_exit(server, worker):
+    # Counters and histograms of a dead worker are kept, its live gauges dropped
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)